@@ -1,13 +1,26 @@
 """
 Enhanced Cab Service Management System with Multi-Page Navigation
 """
+import json
+import os
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
-from database import get_database
-from config import APP_TITLE, APP_ICON
+from datetime import date, datetime, timedelta
+from mysql.connector import Error
+from async_db import get_concurrent_database
+from database import get_database, AssignmentConflict
+from dispatch import dispatch_pending
+from export import FORMATS as EXPORT_FORMATS, export_to_file
+from lifecycle import TripEvent
+from outbox import lag as outbox_lag
+from reconciliation import ISSUES, reconcile, rebuild_queue
+from settlement import PaymentChange
+from instrumentation import QueryStats
+from profiler import start_rerun
+from config import (APP_TITLE, APP_ICON, PAYMENT_MODES, TRIP_STATUS, PAYMENT_STATUS,
+                    DRIVER_STATUS, GEO_NEAREST_K, GEO_NEAREST_MAX_KM, EXPORT_MAX_DOWNLOAD_MB)
 
 # Page configuration
 st.set_page_config(
@@ -175,6 +188,10 @@ st.markdown("""
 # Initialize database
 db = get_database()
 
+# Profile this rerun when PROFILE_RERUNS=1 (no-op otherwise)
+rerun_profile = start_rerun(db.instrumentation)
+rerun_profile.checkpoint("setup")
+
 # Initialize session state for notifications and page
 if 'show_notification' not in st.session_state:
     st.session_state.show_notification = False
@@ -183,7 +200,7 @@ if 'notification_message' not in st.session_state:
 if 'notification_type' not in st.session_state:
     st.session_state.notification_type = "success"
 if 'current_page' not in st.session_state:
-    st.session_state.current_page = "Dashboard"
+    st.session_state.current_page = "🏠 Dashboard"
 
 # Function to show notification
 def show_notification(message, notification_type="success"):
@@ -191,6 +208,82 @@ def show_notification(message, notification_type="success"):
     st.session_state.notification_message = message
     st.session_state.notification_type = notification_type
 
+# Function to delete the prepared export file (after download or when replaced)
+def discard_export():
+    export_file = st.session_state.pop('export_file', None)
+    if export_file and os.path.exists(export_file[0]):
+        os.remove(export_file[0])
+
+# Function to format a listing's total ("1,234", "~1,234" or "10,000+")
+def page_total(page):
+    if page.total_exact:
+        return f"{page.total:,}"
+    if page.total_at_least:
+        return f"{page.total:,}+"
+    return f"~{page.total:,}"
+
+# Function to render one page of a keyset-paginated listing
+def paged_table(key, fetch_page, selectable=False, **filters):
+    """Show the current page of `fetch_page` with Previous/Next controls
+    
+    With selectable=True the rows get a Select checkbox column and the
+    returned page's rows are the edited table, so callers can act on the
+    ticked rows.
+    """
+    # Each entry is the cursor that opens a page; resetting when the
+    # filters change sends the user back to the first page
+    signature = repr(sorted(filters.items()))
+    state = st.session_state.get(f"pager_{key}")
+    if state is None or state['filters'] != signature:
+        state = {'filters': signature, 'cursors': [None]}
+        st.session_state[f"pager_{key}"] = state
+    cursors = state['cursors']
+    
+    page = fetch_page(cursor=cursors[-1], **filters)
+    if page.rows.empty and len(cursors) == 1:
+        return page
+    
+    if selectable:
+        rows = page.rows.copy()
+        rows.insert(0, 'Select', False)
+        page = page._replace(rows=st.data_editor(
+            rows,
+            hide_index=True,
+            use_container_width=True,
+            disabled=[c for c in rows.columns if c != 'Select'],
+            column_config={'Select': st.column_config.CheckboxColumn("✔")},
+            key=f"{key}_editor_{hash((signature, len(cursors)))}",
+        ))
+    else:
+        st.dataframe(page.rows, use_container_width=True, hide_index=True)
+    
+    col1, col2, col3 = st.columns([1, 3, 1])
+    with col1:
+        if st.button("◀ Previous", key=f"{key}_prev", disabled=len(cursors) == 1,
+                     use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Page {len(cursors)} · {page_total(page)} records")
+    with col3:
+        if st.button("Next ▶", key=f"{key}_next", disabled=page.next_cursor is None,
+                     use_container_width=True):
+            cursors.append(page.next_cursor)
+            st.rerun()
+    return page
+
+# Function to pick the visible view of a page
+def select_view(key, views):
+    """Horizontal view switcher used instead of st.tabs
+    
+    st.tabs runs every tab's code (and queries) on each rerun, hidden or
+    not. Here only the selected view runs; the choice is kept in session
+    state per page.
+    """
+    view = st.radio(key, views, horizontal=True, label_visibility="collapsed", key=f"view_{key}")
+    rerun_profile.checkpoint(f"{st.session_state.current_page} › {view}")
+    return view
+
 # Display notification banner if active
 if st.session_state.show_notification:
     if st.session_state.notification_type == "success":
@@ -201,12 +294,14 @@ if st.session_state.show_notification:
         st.info(f"ℹ️ {st.session_state.notification_message}", icon="ℹ️")
     st.session_state.show_notification = False
 
+rerun_profile.checkpoint("navigation")
+
 # Title
 st.markdown(f'<div class="main-header">{APP_ICON} Cab Service Management System</div>', unsafe_allow_html=True)
 
 # Modern Navigation Pills
 st.markdown('<div class="nav-container">', unsafe_allow_html=True)
-col1, col2, col3, col4, col5, col6, col7 = st.columns(7)
+col1, col2, col3, col4, col5, col6, col7, col8 = st.columns(8)
 
 pages = {
     "🏠 Dashboard": col1,
@@ -215,7 +310,8 @@ pages = {
     "🚙 Vehicles": col4,
     "🛣️ Trip Requests": col5,
     "💰 Payments": col6,
-    "📊 Analytics": col7
+    "📊 Analytics": col7,
+    "🛠️ Admin": col8
 }
 
 for page_name, col in pages.items():
@@ -228,6 +324,8 @@ st.markdown('</div>', unsafe_allow_html=True)
 
 # Get current page
 page = st.session_state.current_page
+db.instrumentation.set_page(page)
+rerun_profile.checkpoint(page)
 
 # =====================================================
 # DASHBOARD PAGE
@@ -235,8 +333,13 @@ page = st.session_state.current_page
 if page == "🏠 Dashboard":
     st.markdown('<p class="section-header">Dashboard Overview</p>', unsafe_allow_html=True)
     
-    # Get statistics
-    stats = db.get_dashboard_stats()
+    # Independent queries run concurrently; the page waits for the slowest
+    stats, trip_dist, revenue_data, recent_trips = get_concurrent_database().gather(
+        ('get_dashboard_stats',),
+        ('get_trip_status_distribution',),
+        ('get_revenue_by_vehicle_type',),
+        ('get_trips_page', {'page_size': 10}),
+    )
     
     # Display metrics with custom styling
     col1, col2, col3, col4 = st.columns(4)
@@ -285,7 +388,6 @@ if page == "🏠 Dashboard":
     
     with col1:
         st.subheader("📊 Trip Status Distribution")
-        trip_dist = db.get_trip_status_distribution()
         if not trip_dist.empty:
             fig = px.pie(trip_dist, values='count', names='Status', 
                         color_discrete_sequence=px.colors.qualitative.Set3,
@@ -297,7 +399,6 @@ if page == "🏠 Dashboard":
     
     with col2:
         st.subheader("💵 Revenue by Vehicle Type")
-        revenue_data = db.get_revenue_by_vehicle_type()
         if not revenue_data.empty:
             fig = px.bar(revenue_data, x='Vehicle_Type', y='Total_Revenue',
                         color='Total_Revenue', 
@@ -310,9 +411,8 @@ if page == "🏠 Dashboard":
     # Recent Activity
     st.divider()
     st.subheader("🕒 Recent Trips")
-    recent_trips = db.get_all_trips().head(10)
-    if not recent_trips.empty:
-        st.dataframe(recent_trips, use_container_width=True, hide_index=True)
+    if not recent_trips.rows.empty:
+        st.dataframe(recent_trips.rows, use_container_width=True, hide_index=True)
     else:
         st.info("No recent trips")
 
@@ -322,14 +422,14 @@ if page == "🏠 Dashboard":
 elif page == "👥 Users":
     st.markdown('<p class="section-header">User Management</p>', unsafe_allow_html=True)
     
-    tab1, tab2, tab3 = st.tabs(["📋 View Users", "➕ Add User", "🔍 Search Users"])
+    view = select_view("users", ["📋 View Users", "➕ Add User", "🔍 Search Users"])
     
-    with tab1:
-        users_df = db.get_all_users()
+    if view == "📋 View Users":
+        users_summary = st.empty()
+        users_page = paged_table("users", db.get_users_page)
         
-        if not users_df.empty:
-            st.info(f"📊 Total Users: {len(users_df)}")
-            st.dataframe(users_df, use_container_width=True, hide_index=True)
+        if users_page.total > 0:
+            users_summary.info(f"📊 Total Users: {page_total(users_page)}")
             
             # Quick actions
             st.divider()
@@ -378,9 +478,9 @@ elif page == "👥 Users":
                                 del st.session_state.edit_user_id
                                 st.rerun()
         else:
-            st.info("👋 No users found. Add your first user to get started!")
+            users_summary.info("👋 No users found. Add your first user to get started!")
     
-    with tab2:
+    elif view == "➕ Add User":
         with st.form("add_user_form", clear_on_submit=True):
             st.subheader("➕ Add New User")
             col1, col2 = st.columns(2)
@@ -402,7 +502,7 @@ elif page == "👥 Users":
                 else:
                     show_notification("⚠️ Please fill all required fields!", "error")
     
-    with tab3:
+    elif view == "🔍 Search Users":
         st.subheader("🔍 Advanced User Search")
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -413,15 +513,13 @@ elif page == "👥 Users":
             st.markdown("<br>", unsafe_allow_html=True)
             search_button = st.button("🔍 Search", use_container_width=True)
         
-        if search_button and search_term:
-            users_df = db.get_all_users()
-            if search_by == "Name":
-                filtered = users_df[users_df['First_Name'].str.contains(search_term, case=False) | 
-                                   users_df['Last_Name'].str.contains(search_term, case=False)]
-            elif search_by == "Phone":
-                filtered = users_df[users_df['Phone_Number'].str.contains(search_term)]
-            else:
-                filtered = users_df[users_df['Email'].str.contains(search_term, case=False)]
+        if search_button:
+            st.session_state.user_search = (search_by, search_term)
+        
+        active_search = st.session_state.get('user_search')
+        if active_search and active_search[1]:
+            search_by, search_term = active_search
+            filtered = db.search_users(search_term, by=search_by)
             
             if not filtered.empty:
                 st.success(f"✅ Found {len(filtered)} user(s)")
@@ -435,18 +533,18 @@ elif page == "👥 Users":
 elif page == "🚗 Drivers":
     st.markdown('<p class="section-header">Driver Management</p>', unsafe_allow_html=True)
     
-    tab1, tab2, tab3 = st.tabs(["📋 View Drivers", "➕ Add Driver", "🔍 Filter Drivers"])
+    view = select_view("drivers", ["📋 View Drivers", "➕ Add Driver", "🔍 Filter Drivers"])
     
-    with tab1:
-        drivers_df = db.get_all_drivers()
+    if view == "📋 View Drivers":
+        drivers_summary = st.empty()
+        drivers_page = paged_table("drivers", db.get_drivers_page)
         
-        if not drivers_df.empty:
-            st.info(f"📊 Total Drivers: {len(drivers_df)}")
-            st.dataframe(drivers_df, use_container_width=True, hide_index=True)
+        if drivers_page.total > 0:
+            drivers_summary.info(f"📊 Total Drivers: {page_total(drivers_page)}")
         else:
-            st.info("👋 No drivers found. Add your first driver!")
+            drivers_summary.info("👋 No drivers found. Add your first driver!")
     
-    with tab2:
+    elif view == "➕ Add Driver":
         with st.form("add_driver_form", clear_on_submit=True):
             st.subheader("➕ Add New Driver")
             col1, col2 = st.columns(2)
@@ -470,25 +568,26 @@ elif page == "🚗 Drivers":
                 else:
                     show_notification("⚠️ Please fill all required fields!", "error")
     
-    with tab3:
+    elif view == "🔍 Filter Drivers":
         st.subheader("🔍 Filter Drivers")
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         with col1:
             status_filter = st.multiselect("Filter by Status", ['Active', 'Inactive', 'Suspended'], default=['Active'])
         with col2:
             min_rating = st.slider("Minimum Rating", 0.0, 5.0, 0.0, 0.1)
+        with col3:
+            name_filter = st.text_input("Driver Name")
         
         if status_filter:
-            drivers_df = db.get_all_drivers()
-            filtered = drivers_df[drivers_df['Status'].isin(status_filter)]
-            if min_rating > 0:
-                filtered = filtered[filtered['Rating'] >= min_rating]
+            results_summary = st.empty()
+            filtered = paged_table("driver_filter", db.get_drivers_page,
+                                   statuses=tuple(status_filter), min_rating=min_rating or None,
+                                   name=name_filter or None)
             
-            if not filtered.empty:
-                st.success(f"✅ Found {len(filtered)} driver(s)")
-                st.dataframe(filtered, use_container_width=True, hide_index=True)
+            if filtered.total > 0:
+                results_summary.success(f"✅ Found {page_total(filtered)} driver(s)")
             else:
-                st.warning("⚠️ No drivers match your filters")
+                results_summary.warning("⚠️ No drivers match your filters")
 
 # =====================================================
 # VEHICLES PAGE
@@ -496,33 +595,28 @@ elif page == "🚗 Drivers":
 elif page == "🚙 Vehicles":
     st.markdown('<p class="section-header">Vehicle Management</p>', unsafe_allow_html=True)
     
-    tab1, tab2 = st.tabs(["📋 View Vehicles", "➕ Add Vehicle"])
+    view = select_view("vehicles", ["📋 View Vehicles", "➕ Add Vehicle"])
     
-    with tab1:
-        vehicles_df = db.get_all_vehicles()
+    if view == "📋 View Vehicles":
+        # Filter options
+        col1, col2 = st.columns(2)
+        with col1:
+            status_filter = st.multiselect("Filter by Status", ['Available', 'In_Use', 'Maintenance'], 
+                                          default=['Available'])
+        with col2:
+            type_filter = st.multiselect("Filter by Type", 
+                                        [vt['Vehicle_Type'] for vt in db.get_vehicle_types() or []])
         
-        if not vehicles_df.empty:
-            # Filter options
-            col1, col2 = st.columns(2)
-            with col1:
-                status_filter = st.multiselect("Filter by Status", ['Available', 'In_Use', 'Maintenance'], 
-                                              default=['Available'])
-            with col2:
-                type_filter = st.multiselect("Filter by Type", 
-                                            vehicles_df['Vehicle_Type'].unique().tolist() if 'Vehicle_Type' in vehicles_df else [])
-            
-            filtered_df = vehicles_df.copy()
-            if status_filter:
-                filtered_df = filtered_df[filtered_df['Status'].isin(status_filter)]
-            if type_filter:
-                filtered_df = filtered_df[filtered_df['Vehicle_Type'].isin(type_filter)]
-            
-            st.info(f"📊 Showing {len(filtered_df)} of {len(vehicles_df)} vehicles")
-            st.dataframe(filtered_df, use_container_width=True, hide_index=True)
+        vehicles_summary = st.empty()
+        vehicles_page = paged_table("vehicles", db.get_vehicles_page,
+                                    statuses=tuple(status_filter), vehicle_types=tuple(type_filter))
+        
+        if vehicles_page.total > 0:
+            vehicles_summary.info(f"📊 Showing {page_total(vehicles_page)} matching vehicles")
         else:
-            st.info("👋 No vehicles found. Add your first vehicle!")
+            vehicles_summary.info("👋 No vehicles found. Add your first vehicle or adjust the filters!")
     
-    with tab2:
+    elif view == "➕ Add Vehicle":
         vehicle_types = db.get_vehicle_types()
         
         with st.form("add_vehicle_form", clear_on_submit=True):
@@ -559,38 +653,33 @@ elif page == "🚙 Vehicles":
 elif page == "🛣️ Trip Requests":
     st.markdown('<p class="section-header">Trip Request Management</p>', unsafe_allow_html=True)
     
-    tab1, tab2, tab3 = st.tabs(["📋 All Trips", "🆕 Create Trip Request", "⏳ Pending Requests"])
+    view = select_view("trip_requests", ["📋 All Trips", "🆕 Create Trip Request", "⏳ Pending Requests", "🚦 Open Trips"])
     
-    with tab1:
-        trips_df = db.get_all_trips()
+    if view == "📋 All Trips":
+        # Filters
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            status_filter = st.multiselect("Filter by Status", 
+                                          ['Pending', 'Accepted', 'In_Progress', 'Completed', 'Cancelled'],
+                                          default=['Pending', 'Accepted', 'In_Progress'])
+        with col2:
+            date_filter = st.date_input("From Date", value=datetime.now().date() - timedelta(days=30))
+        with col3:
+            search_user = st.text_input("Search by User/Driver Name")
+        with col4:
+            search_location = st.text_input("Search by Location")
         
-        if not trips_df.empty:
-            # Filters
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                status_filter = st.multiselect("Filter by Status", 
-                                              ['Pending', 'Accepted', 'In_Progress', 'Completed', 'Cancelled'],
-                                              default=['Pending', 'Accepted', 'In_Progress'])
-            with col2:
-                date_filter = st.date_input("From Date", value=datetime.now().date() - timedelta(days=30))
-            with col3:
-                search_user = st.text_input("Search by User/Driver Name")
-            
-            filtered_df = trips_df.copy()
-            if status_filter:
-                filtered_df = filtered_df[filtered_df['Status'].isin(status_filter)]
-            if search_user:
-                filtered_df = filtered_df[
-                    filtered_df['User_Name'].str.contains(search_user, case=False, na=False) |
-                    filtered_df['Driver_Name'].str.contains(search_user, case=False, na=False)
-                ]
-            
-            st.info(f"📊 Showing {len(filtered_df)} of {len(trips_df)} trips")
-            st.dataframe(filtered_df, use_container_width=True, hide_index=True)
+        trips_summary = st.empty()
+        trips_page = paged_table("trips", db.get_trips_page, statuses=tuple(status_filter),
+                                 booked_from=date_filter, name=search_user or None,
+                                 location=search_location or None)
+        
+        if trips_page.total > 0:
+            trips_summary.info(f"📊 Showing {page_total(trips_page)} matching trips")
         else:
-            st.info("👋 No trips found. Create your first trip request!")
+            trips_summary.info("👋 No trips found. Create a trip request or adjust the filters!")
     
-    with tab2:
+    elif view == "🆕 Create Trip Request":
         users = db.get_users_list()
         
         with st.form("create_trip_form", clear_on_submit=True):
@@ -644,8 +733,13 @@ elif page == "🛣️ Trip Requests":
                         if result:
                             # If driver and vehicle selected, assign them
                             if driver_id and vehicle_id:
-                                db.assign_driver_vehicle(result, driver_id, vehicle_id)
-                                show_notification(f"✅ Trip #{result} created and assigned to driver!", "success")
+                                try:
+                                    if db.assign_driver_vehicle(result, driver_id, vehicle_id):
+                                        show_notification(f"✅ Trip #{result} created and assigned to driver!", "success")
+                                    else:
+                                        show_notification(f"⚠️ Trip #{result} created but could not be assigned", "error")
+                                except AssignmentConflict as e:
+                                    show_notification(f"⚠️ Trip #{result} created but not assigned: {e}", "error")
                             else:
                                 show_notification(f"✅ Trip request #{result} created successfully! Awaiting assignment.", "success")
                             st.rerun()
@@ -656,7 +750,7 @@ elif page == "🛣️ Trip Requests":
             else:
                 st.error("❌ No users available. Please add users first.")
     
-    with tab3:
+    elif view == "⏳ Pending Requests":
         st.subheader("⏳ Pending Trip Requests - Quick Assignment")
         
         # Get pending trips
@@ -667,6 +761,8 @@ elif page == "🛣️ Trip Requests":
                 u.Phone_Number AS User_Phone,
                 t.Pickup_Location,
                 t.Dropoff_Location,
+                t.Pickup_Lat,
+                t.Pickup_Lon,
                 t.Booking_Time,
                 t.Status
             FROM Trip t
@@ -677,7 +773,21 @@ elif page == "🛣️ Trip Requests":
         pending_trips = db.fetch_dataframe(pending_query)
         
         if not pending_trips.empty:
-            st.success(f"✅ {len(pending_trips)} pending request(s) waiting for assignment")
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.success(f"✅ {len(pending_trips)} pending request(s) waiting for assignment")
+            with col2:
+                if st.button("⚡ Auto-Assign All", use_container_width=True, type="primary"):
+                    try:
+                        assigned = dispatch_pending(db)
+                        show_notification(f"✅ Auto-assigned {len(assigned)} of {len(pending_trips)} pending trip(s)", "success")
+                    except Error as e:
+                        show_notification(f"❌ Auto-assignment failed: {e}", "error")
+                    st.rerun()
+            
+            # One availability snapshot shared by every pending trip on this render
+            available_drivers = db.get_available_drivers()
+            available_vehicles = db.get_available_vehicles()
             
             for idx, trip in pending_trips.iterrows():
                 with st.expander(f"🚕 Trip #{trip['Trip_ID']} - {trip['User_Name']} ({trip['Pickup_Location']} → {trip['Dropoff_Location']})"):
@@ -694,30 +804,115 @@ elif page == "🛣️ Trip Requests":
                     with col2:
                         # Assignment form
                         with st.form(f"assign_trip_{trip['Trip_ID']}"):
-                            available_drivers = db.get_available_drivers()
-                            available_vehicles = db.get_available_vehicles()
-                            
                             if available_drivers and available_vehicles:
-                                driver_select = st.selectbox(f"Select Driver", 
-                                                            [d['driver_info'] for d in available_drivers],
-                                                            key=f"driver_{trip['Trip_ID']}")
+                                # Nearest free drivers first when the pickup point is known
+                                nearby = []
+                                if pd.notna(trip['Pickup_Lat']) and pd.notna(trip['Pickup_Lon']):
+                                    nearby = db.get_nearest_drivers(trip['Pickup_Lat'], trip['Pickup_Lon'],
+                                                                    GEO_NEAREST_K, GEO_NEAREST_MAX_KM)
+                                nearby_ids = {d['Driver_ID'] for d, _ in nearby}
+                                driver_choices = ([d for d, _ in nearby] +
+                                                  [d for d in available_drivers if d['Driver_ID'] not in nearby_ids])
+                                distances = {d['Driver_ID']: km for d, km in nearby}
+                                driver_pick = st.selectbox(f"Select Driver", 
+                                                           range(len(driver_choices)),
+                                                           format_func=lambda i: driver_choices[i]['driver_info'] + (
+                                                               f" · {distances[driver_choices[i]['Driver_ID']]:.1f} km"
+                                                               if driver_choices[i]['Driver_ID'] in distances else ""),
+                                                           key=f"driver_{trip['Trip_ID']}")
                                 vehicle_select = st.selectbox(f"Select Vehicle", 
                                                              [v['vehicle_info'] for v in available_vehicles],
                                                              key=f"vehicle_{trip['Trip_ID']}")
                                 
                                 if st.form_submit_button("✅ Assign & Accept Trip", type="primary", use_container_width=True):
-                                    driver_id = available_drivers[[d['driver_info'] for d in available_drivers].index(driver_select)]['Driver_ID']
+                                    driver_id = driver_choices[driver_pick]['Driver_ID']
                                     vehicle_id = available_vehicles[[v['vehicle_info'] for v in available_vehicles].index(vehicle_select)]['Vehicle_ID']
                                     
-                                    if db.assign_driver_vehicle(trip['Trip_ID'], driver_id, vehicle_id):
-                                        show_notification(f"✅ Trip #{trip['Trip_ID']} assigned successfully!", "success")
-                                        st.rerun()
-                                    else:
-                                        show_notification("❌ Failed to assign trip", "error")
+                                    try:
+                                        if db.assign_driver_vehicle(trip['Trip_ID'], driver_id, vehicle_id):
+                                            show_notification(f"✅ Trip #{trip['Trip_ID']} assigned successfully!", "success")
+                                        else:
+                                            show_notification("❌ Failed to assign trip", "error")
+                                    except AssignmentConflict as e:
+                                        show_notification(f"❌ Assignment conflict: {e}", "error")
+                                    st.rerun()
                             else:
                                 st.warning("⚠️ No available drivers or vehicles to assign")
         else:
             st.info("✨ No pending requests at the moment!")
+    
+    elif view == "🚦 Open Trips":
+        st.subheader("🚦 Open Trips - Start, Complete or Cancel")
+        
+        open_query = """
+            SELECT 
+                t.Trip_ID,
+                t.Status,
+                CONCAT(u.First_Name, ' ', u.Last_Name) AS User_Name,
+                CONCAT(d.First_Name, ' ', d.Last_Name) AS Driver_Name,
+                t.Pickup_Location,
+                t.Dropoff_Location,
+                t.Booking_Time,
+                t.Pickup_Time
+            FROM Trip t
+            LEFT JOIN User u ON t.User_ID = u.User_ID
+            LEFT JOIN Driver d ON t.Driver_ID = d.Driver_ID
+            WHERE t.Status IN ('Pending', 'Accepted', 'In_Progress')
+            ORDER BY t.Booking_Time ASC
+            LIMIT 500
+        """
+        open_trips = db.fetch_dataframe(open_query)
+        
+        if not open_trips.empty:
+            st.caption("Tick trips and apply one action to all of them. Completed trips need a "
+                       "distance; their fare is priced automatically. Showing the 500 oldest open trips.")
+            open_trips.insert(0, 'Select', False)
+            open_trips['Distance_km'] = float('nan')
+            edited = st.data_editor(
+                open_trips,
+                hide_index=True,
+                use_container_width=True,
+                disabled=[c for c in open_trips.columns if c not in ('Select', 'Distance_km')],
+                column_config={
+                    'Select': st.column_config.CheckboxColumn("✔"),
+                    'Distance_km': st.column_config.NumberColumn("Distance (km)", min_value=0.0, step=0.1),
+                },
+                key="open_trips_editor",
+            )
+            selected = edited[edited['Select']]
+            
+            action = None
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if st.button("▶️ Start Selected", use_container_width=True):
+                    action = 'In_Progress'
+            with col2:
+                if st.button("✅ Complete Selected", use_container_width=True, type="primary"):
+                    action = 'Completed'
+            with col3:
+                if st.button("❌ Cancel Selected", use_container_width=True):
+                    action = 'Cancelled'
+            
+            if action:
+                if selected.empty:
+                    show_notification("⚠️ Select at least one trip first", "error")
+                elif action == 'Completed' and selected['Distance_km'].isna().any():
+                    show_notification("⚠️ Enter a distance for every trip being completed", "error")
+                else:
+                    events = [TripEvent(int(trip.Trip_ID), action,
+                                        distance=None if pd.isna(trip.Distance_km) else float(trip.Distance_km))
+                              for trip in selected.itertuples()]
+                    result = db.transition_trips(events)
+                    if result is not None:
+                        message = f"{len(result.applied)} trip(s) moved to {action.replace('_', ' ')}"
+                        if result.rejected:
+                            reasons = "; ".join(reason for _, reason in result.rejected[:3])
+                            show_notification(f"⚠️ {message}, {len(result.rejected)} rejected: {reasons}", "error")
+                        else:
+                            show_notification(f"✅ {message}", "success")
+                st.rerun()
+        else:
+            st.info("✨ No open trips at the moment!")
 
 # =====================================================
 # PAYMENTS PAGE
@@ -725,51 +920,73 @@ elif page == "🛣️ Trip Requests":
 elif page == "💰 Payments":
     st.markdown('<p class="section-header">Payment Management</p>', unsafe_allow_html=True)
     
-    tab1, tab2, tab3 = st.tabs(["📋 All Payments", "➕ Add Payment", "🔍 Payment Analytics"])
+    view = select_view("payments", ["📋 All Payments", "➕ Add Payment", "🔍 Payment Analytics",
+                                    "🧾 Reconciliation"])
     
-    with tab1:
-        payments_df = db.get_all_payments()
+    if view == "📋 All Payments":
+        # Filters
+        col1, col2 = st.columns(2)
+        with col1:
+            status_filter = st.multiselect("Filter by Status", 
+                                          ['Pending', 'Completed', 'Failed', 'Refunded'],
+                                          default=['Pending', 'Completed'])
+        with col2:
+            mode_filter = st.multiselect("Filter by Payment Mode", PAYMENT_MODES)
         
-        if not payments_df.empty:
-            # Filters
-            col1, col2 = st.columns(2)
-            with col1:
-                status_filter = st.multiselect("Filter by Status", 
-                                              ['Pending', 'Completed', 'Failed', 'Refunded'],
-                                              default=['Pending', 'Completed'])
-            with col2:
-                mode_filter = st.multiselect("Filter by Payment Mode",
-                                            payments_df['Payment_Mode'].unique().tolist() if 'Payment_Mode' in payments_df else [])
+        payments_summary = st.empty()
+        payments_page = paged_table("payments", db.get_payments_page, selectable=True,
+                                    statuses=tuple(status_filter), modes=tuple(mode_filter))
+        
+        if payments_page.total > 0:
+            payments_summary.info(f"📊 Showing {page_total(payments_page)} matching payments")
             
-            filtered_df = payments_df.copy()
-            if status_filter:
-                filtered_df = filtered_df[filtered_df['Payment_Status'].isin(status_filter)]
-            if mode_filter:
-                filtered_df = filtered_df[filtered_df['Payment_Mode'].isin(mode_filter)]
+            # Bulk status update of the ticked rows
+            st.divider()
+            st.subheader("⚡ Update Selected Payments")
+            selected = payments_page.rows[payments_page.rows['Select']]
+            st.caption(f"{len(selected)} payment(s) selected. Completed payments without a reference "
+                       "get one generated.")
             
-            st.info(f"📊 Showing {len(filtered_df)} of {len(payments_df)} payments")
-            st.dataframe(filtered_df, use_container_width=True, hide_index=True)
+            override = st.checkbox("Override status rules (corrections only)",
+                                   help="Allows any change, e.g. undoing a refund marked by mistake. "
+                                        "Normally Pending → Completed/Failed, Failed → Pending/Completed, "
+                                        "Completed → Refunded, and Refunded is final.")
             
-            # Quick status update
-            st.divider()
-            st.subheader("⚡ Quick Payment Status Update")
-            col1, col2, col3 = st.columns([2, 2, 1])
+            action = None
+            col1, col2, col3, col4 = st.columns(4)
             with col1:
-                payment_id = st.number_input("Payment ID", min_value=1, step=1)
+                if st.button("✅ Mark Completed", use_container_width=True, type="primary"):
+                    action = 'Completed'
             with col2:
-                new_status = st.selectbox("New Status", ['Completed', 'Failed', 'Refunded'])
+                if st.button("⏳ Mark Pending", use_container_width=True):
+                    action = 'Pending'
             with col3:
-                st.markdown("<br>", unsafe_allow_html=True)
-                if st.button("💾 Update", use_container_width=True, type="primary"):
-                    if db.update_payment_status(payment_id, new_status):
-                        show_notification(f"✅ Payment #{payment_id} status updated to {new_status}", "success")
-                        st.rerun()
-                    else:
-                        show_notification("❌ Failed to update payment status", "error")
+                if st.button("⚠️ Mark Failed", use_container_width=True):
+                    action = 'Failed'
+            with col4:
+                if st.button("↩️ Mark Refunded", use_container_width=True):
+                    action = 'Refunded'
+            
+            if action:
+                if selected.empty:
+                    show_notification("⚠️ Select at least one payment first", "error")
+                else:
+                    outcomes = db.settle_payments([PaymentChange(int(payment_id), action)
+                                                   for payment_id in selected['Payment_ID']], override)
+                    if outcomes is not None:
+                        applied = sum(outcome.result == 'applied' for outcome in outcomes)
+                        rejected = [outcome.detail for outcome in outcomes if outcome.result == 'rejected']
+                        message = f"{applied} payment(s) marked {action}"
+                        if rejected:
+                            show_notification(f"⚠️ {message}, {len(rejected)} rejected: "
+                                              f"{'; '.join(rejected[:3])}", "error")
+                        else:
+                            show_notification(f"✅ {message}", "success")
+                st.rerun()
         else:
-            st.info("👋 No payments recorded yet")
+            payments_summary.info("👋 No payments match these filters")
     
-    with tab2:
+    elif view == "➕ Add Payment":
         trips = db.get_completed_trips_without_payment()
         
         with st.form("add_payment_form", clear_on_submit=True):
@@ -788,10 +1005,8 @@ elif page == "💰 Payments":
                     reference = st.text_input("Reference Number (optional)")
                 
                 if st.form_submit_button("➕ Add Payment", type="primary", use_container_width=True):
-                    result = db.create_payment(trip_id, amount, payment_mode, payment_status)
+                    result = db.create_payment(trip_id, amount, payment_mode, payment_status, reference)
                     if result:
-                        if reference:
-                            db.update_payment_status(result, payment_status, reference)
                         show_notification(f"✅ Payment added successfully! Payment ID: {result}", "success")
                         st.rerun()
                     else:
@@ -799,20 +1014,15 @@ elif page == "💰 Payments":
             else:
                 st.info("✨ All completed trips have payments recorded!")
     
-    with tab3:
+    elif view == "🔍 Payment Analytics":
         st.subheader("📊 Payment Analytics")
         
         # Payment mode distribution
-        payments_df = db.get_all_payments()
-        if not payments_df.empty:
-            completed_payments = payments_df[payments_df['Payment_Status'] == 'Completed']
-            
+        mode_dist = db.get_payment_mode_summary('Completed')
+        if not mode_dist.empty:
             col1, col2 = st.columns(2)
             
             with col1:
-                mode_dist = completed_payments.groupby('Payment_Mode')['Amount'].agg(['count', 'sum']).reset_index()
-                mode_dist.columns = ['Payment_Mode', 'Count', 'Total_Amount']
-                
                 fig = px.pie(mode_dist, values='Count', names='Payment_Mode',
                             title='Payment Mode Distribution',
                             color_discrete_sequence=px.colors.qualitative.Set3)
@@ -824,6 +1034,41 @@ elif page == "💰 Payments":
                             color='Total_Amount',
                             color_continuous_scale='Viridis')
                 st.plotly_chart(fig, use_container_width=True)
+    
+    elif view == "🧾 Reconciliation":
+        st.subheader("🧾 Payment Reconciliation")
+        st.caption("Scans every trip and payment, so run it on demand rather than on every visit.")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("▶️ Run Reconciliation", type="primary", use_container_width=True):
+                with st.spinner("Reconciling payments..."):
+                    try:
+                        st.session_state.reconciliation = reconcile(db)
+                    except Error as e:
+                        st.session_state.reconciliation = None
+                        st.error(f"❌ Reconciliation failed: {e}")
+        with col2:
+            if st.button("🔄 Rebuild Unpaid Queue", use_container_width=True):
+                try:
+                    show_notification(f"✅ Unpaid queue rebuilt: {rebuild_queue(db):,} trip(s)", "success")
+                except Error as e:
+                    show_notification(f"❌ Queue rebuild failed: {e}", "error")
+        
+        reconciliation = st.session_state.get('reconciliation')
+        if reconciliation:
+            summary, issues = reconciliation
+            st.markdown(f"Checked **{summary['trips']:,}** trips and **{summary['payments']:,}** payments")
+            for col, issue in zip(st.columns(len(ISSUES)), ISSUES):
+                col.metric(issue.replace('_', ' ').title(), f"{summary[issue]:,}")
+            
+            if issues.empty:
+                st.success("✅ Every payment matches its trip")
+            else:
+                shown = st.multiselect("Issues", ISSUES, default=[i for i in ISSUES if summary[i]])
+                st.dataframe(issues[issues['Issue'].isin(shown)], use_container_width=True, hide_index=True)
+                st.download_button("📥 Download Issues (CSV)", issues.to_csv(index=False),
+                                   "payment_issues.csv", "text/csv", use_container_width=True)
 
 # =====================================================
 # ANALYTICS PAGE
@@ -831,81 +1076,241 @@ elif page == "💰 Payments":
 elif page == "📊 Analytics":
     st.markdown('<p class="section-header">Advanced Analytics & Reports</p>', unsafe_allow_html=True)
     
-    stats = db.get_dashboard_stats()
-    revenue_data = db.get_revenue_by_vehicle_type()
-    
-    # KPI Row
-    col1, col2, col3, col4 = st.columns(4)
+    view = select_view("analytics", ["📊 Overview", "📈 Trends", "📥 Export"])
     
-    kpis = [
-        ("✅", "Completed Trips", stats['completed_trips'], col1),
-        ("💰", "Total Revenue", f"₹{stats['total_revenue']:,.2f}", col2),
-        ("🚗", "Active Drivers", stats['active_drivers'], col3),
-        ("📈", "Avg Revenue/Trip", f"₹{stats['total_revenue']/stats['completed_trips'] if stats['completed_trips'] > 0 else 0:,.2f}", col4)
-    ]
-    
-    for icon, label, value, col in kpis:
-        with col:
-            st.markdown(f"""
-                <div class="metric-card">
-                    <div style="font-size: 2rem;">{icon}</div>
-                    <div class="metric-value">{value}</div>
-                    <div class="metric-label">{label}</div>
-                </div>
-            """, unsafe_allow_html=True)
+    if view == "📊 Overview":
+        stats = db.get_dashboard_stats()
+        revenue_data = db.get_revenue_by_vehicle_type()
+        
+        # KPI Row
+        col1, col2, col3, col4 = st.columns(4)
+        
+        kpis = [
+            ("✅", "Completed Trips", stats['completed_trips'], col1),
+            ("💰", "Total Revenue", f"₹{stats['total_revenue']:,.2f}", col2),
+            ("🚗", "Active Drivers", stats['active_drivers'], col3),
+            ("📈", "Avg Revenue/Trip", f"₹{stats['total_revenue']/stats['completed_trips'] if stats['completed_trips'] > 0 else 0:,.2f}", col4)
+        ]
+        
+        for icon, label, value, col in kpis:
+            with col:
+                st.markdown(f"""
+                    <div class="metric-card">
+                        <div style="font-size: 2rem;">{icon}</div>
+                        <div class="metric-value">{value}</div>
+                        <div class="metric-label">{label}</div>
+                    </div>
+                """, unsafe_allow_html=True)
+        
+        st.divider()
+        
+        # Charts
+        if not revenue_data.empty:
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.subheader("💵 Revenue Distribution")
+                fig = px.pie(revenue_data, values='Total_Revenue', names='Vehicle_Type',
+                            title='Revenue by Vehicle Type',
+                            color_discrete_sequence=px.colors.qualitative.Pastel)
+                st.plotly_chart(fig, use_container_width=True)
+            
+            with col2:
+                st.subheader("🚙 Trip Count by Vehicle Type")
+                fig = px.bar(revenue_data, x='Vehicle_Type', y='Total_Trips',
+                            title='Trips by Vehicle Type',
+                            color='Total_Trips',
+                            color_continuous_scale='Blues')
+                st.plotly_chart(fig, use_container_width=True)
     
-    st.divider()
+    elif view == "📈 Trends":
+        # Trends over a chosen range
+        st.subheader("📈 Trends")
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            trend_range = st.date_input("Date Range",
+                                        value=(date.today() - timedelta(days=30), date.today()),
+                                        key="trend_range")
+        with col2:
+            trend_bucket = st.radio("Bucket", ["hour", "day", "week"], index=1, horizontal=True,
+                                    format_func=str.title, key="trend_bucket")
+        
+        if len(trend_range) == 2:
+            trends = db.get_trends(trend_range[0], trend_range[1], trend_bucket)
+            if trends['Trips'].sum() == 0 and trends['Payments'].sum() == 0:
+                st.info("No trips or payments in the selected range")
+            else:
+                col1, col2 = st.columns(2)
+                with col1:
+                    fig = px.line(trends, x='Bucket', y=['Trips', 'Completed', 'Cancelled'],
+                                 title='Trips', labels={'value': 'Trips', 'Bucket': '', 'variable': ''})
+                    st.plotly_chart(fig, use_container_width=True)
+                    fig = px.line(trends, x='Bucket', y='Avg_Wait_Minutes',
+                                 title='Average Wait (booking to pickup)',
+                                 labels={'Avg_Wait_Minutes': 'Minutes', 'Bucket': ''})
+                    fig.update_traces(connectgaps=False)
+                    st.plotly_chart(fig, use_container_width=True)
+                with col2:
+                    fig = px.bar(trends, x='Bucket', y='Revenue', title='Revenue (completed payments)',
+                                labels={'Revenue': 'Revenue (₹)', 'Bucket': ''})
+                    st.plotly_chart(fig, use_container_width=True)
+                    cancel_rate = trends['Cancelled'] / trends['Trips'].where(trends['Trips'] > 0)
+                    fig = px.line(trends.assign(Cancellation_Rate=cancel_rate * 100), x='Bucket',
+                                 y='Cancellation_Rate', title='Cancellation Rate',
+                                 labels={'Cancellation_Rate': '%', 'Bucket': ''})
+                    st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("Pick a start and end date")
     
-    # Charts
-    if not revenue_data.empty:
-        col1, col2 = st.columns(2)
+    elif view == "📥 Export":
+        # Data Export - runs only when requested and streams to a compressed file
+        st.subheader("📥 Export Data")
+        with st.form("export_form"):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                export_kind = st.selectbox("Dataset", ["trips", "payments", "users", "drivers"],
+                                           format_func=str.title)
+            with col2:
+                export_range = st.date_input("Date Range", value=(), help="Leave empty to export everything")
+            with col3:
+                export_statuses = st.multiselect("Status (trips, payments, drivers)",
+                                                 sorted(set(TRIP_STATUS + PAYMENT_STATUS + DRIVER_STATUS)))
+            with col4:
+                export_format = st.radio("Format", ["csv", "parquet"], horizontal=True,
+                                         format_func=lambda f: {"csv": "CSV (gzip)", "parquet": "Parquet"}[f])
+            prepare_export = st.form_submit_button("⚙️ Prepare Export", use_container_width=True)
         
-        with col1:
-            st.subheader("💵 Revenue Distribution")
-            fig = px.pie(revenue_data, values='Total_Revenue', names='Vehicle_Type',
-                        title='Revenue by Vehicle Type',
-                        color_discrete_sequence=px.colors.qualitative.Pastel)
-            st.plotly_chart(fig, use_container_width=True)
+        if prepare_export:
+            start = export_range[0] if len(export_range) > 0 else None
+            end = export_range[1] if len(export_range) > 1 else start
+            with st.spinner(f"Exporting {export_kind}..."):
+                discard_export()
+                command = " ".join([f"python export.py {export_kind} {export_kind}{EXPORT_FORMATS[export_format]}"]
+                                   + ([f"--from {start}"] if start else [])
+                                   + ([f"--to {end}"] if end else [])
+                                   + [f"--status {status}" for status in export_statuses])
+                try:
+                    path, rows = export_to_file(db, export_kind, export_format, start, end,
+                                                export_statuses or None)
+                    st.session_state.export_file = (path, rows, export_kind, command) if path else None
+                    if not path:
+                        st.warning("⚠️ No rows match the selected filters")
+                except (Error, RuntimeError) as e:
+                    st.session_state.export_file = None
+                    st.error(f"❌ Export failed: {e}")
         
-        with col2:
-            st.subheader("🚙 Trip Count by Vehicle Type")
-            fig = px.bar(revenue_data, x='Vehicle_Type', y='Total_Trips',
-                        title='Trips by Vehicle Type',
-                        color='Total_Trips',
-                        color_continuous_scale='Blues')
-            st.plotly_chart(fig, use_container_width=True)
+        export_file = st.session_state.get('export_file')
+        if export_file and os.path.exists(export_file[0]):
+            path, rows, kind, command = export_file
+            size_mb = os.path.getsize(path) / 1e6
+            if size_mb > EXPORT_MAX_DOWNLOAD_MB:
+                # Streamlit keeps a served file in memory; large exports go through the CLI
+                discard_export()
+                st.warning(f"⚠️ This export is {size_mb:,.0f} MB, over the {EXPORT_MAX_DOWNLOAD_MB:,.0f} MB "
+                           f"the app serves. Run it from the command line instead:")
+                st.code(command, language="bash")
+            else:
+                with open(path, 'rb') as f:
+                    st.download_button(f"📥 Download {kind} ({rows:,} rows, {size_mb:,.1f} MB)", f,
+                                       os.path.basename(path), "application/octet-stream",
+                                       use_container_width=True, on_click=discard_export)
+
+# =====================================================
+# ADMIN PAGE
+# =====================================================
+elif page == "🛠️ Admin":
+    st.markdown('<p class="section-header">Query Performance & System Health</p>', unsafe_allow_html=True)
     
-    st.divider()
+    snapshot = db.instrumentation.snapshot()
+    query_stats = snapshot['stats'] or {'methods': {}, 'pages': {}, 'since': '-'}
     
-    # Data Export
-    st.subheader("📥 Export Data")
+    # Pool and index health
+    pool = db.get_pool_metrics()
+    availability = db.availability.stats()
     col1, col2, col3, col4 = st.columns(4)
-    
     with col1:
-        users_df = db.get_all_users()
-        if not users_df.empty:
-            csv = users_df.to_csv(index=False)
-            st.download_button("📥 Export Users", csv, "users.csv", "text/csv", use_container_width=True)
-    
+        st.metric("Pool Checkouts", f"{pool.get('checkouts', 0):,}")
     with col2:
-        drivers_df = db.get_all_drivers()
-        if not drivers_df.empty:
-            csv = drivers_df.to_csv(index=False)
-            st.download_button("📥 Export Drivers", csv, "drivers.csv", "text/csv", use_container_width=True)
-    
+        st.metric("Avg Pool Wait", f"{pool.get('avg_wait_ms', 0):.1f} ms")
     with col3:
-        trips_df = db.get_all_trips()
-        if not trips_df.empty:
-            csv = trips_df.to_csv(index=False)
-            st.download_button("📥 Export Trips", csv, "trips.csv", "text/csv", use_container_width=True)
+        st.metric("Free Drivers (index)", availability['free_drivers'])
+    with col4:
+        st.metric("Available Vehicles (index)", availability['available_vehicles'])
     
+    cache = db.cache.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Cache Hit Rate", f"{cache['hit_rate']:.0%}")
+    with col2:
+        st.metric("Cache Entries", f"{cache['entries']:,}")
+    with col3:
+        st.metric("Cache Misses", f"{cache['misses']:,}")
     with col4:
-        payments_df = db.get_all_payments()
-        if not payments_df.empty:
-            csv = payments_df.to_csv(index=False)
-            st.download_button("📥 Export Payments", csv, "payments.csv", "text/csv", use_container_width=True)
+        st.metric("Cache Invalidations", f"{cache['invalidations']:,}")
+    
+    consumers = outbox_lag(db)
+    if consumers:
+        st.caption("Change-event consumers (Behind = events logged since their offset, "
+                   "Skipped_Events = missing event IDs given up on after the gap grace)")
+        st.dataframe(pd.DataFrame(consumers), hide_index=True, use_container_width=True)
+    
+    st.divider()
+    
+    st.subheader("⏱️ Query Latency by Method")
+    st.caption(f"Since {query_stats['since']} · instrumentation "
+               f"{'on' if db.instrumentation.enabled else 'off'}")
+    if query_stats['methods']:
+        methods_df = pd.DataFrame.from_dict(query_stats['methods'], orient='index')
+        methods_df.index.name = 'Method'
+        methods_df['total_ms'] = (methods_df['mean_ms'] * methods_df['count']).round(1)
+        methods_df = methods_df.sort_values('total_ms', ascending=False)
+        st.dataframe(methods_df[['calls', 'errors', 'rows', 'bytes', 'mean_ms', 'p50_ms',
+                                 'p95_ms', 'p99_ms', 'max_ms', 'total_ms']],
+                     use_container_width=True)
+        
+        pages_df = pd.DataFrame.from_dict(query_stats['pages'], orient='index')
+        pages_df.index.name = 'Page'
+        fig = px.bar(pages_df.reset_index(), x='Page', y='total_ms', title='Query Time by Page',
+                    labels={'total_ms': 'Total query time (ms)'})
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.info("No queries recorded yet")
+    
+    st.subheader("🐢 Slow Queries")
+    slow_log = snapshot['slow_queries']
+    if slow_log:
+        for entry in slow_log[:50]:
+            with st.expander(f"{entry['elapsed_ms']:.0f} ms · {entry['method']} · {entry['at']}"):
+                st.code(entry['query'], language='sql')
+                st.caption(f"Params: {entry['params']} · Rows: {entry['rows']} · Page: {entry['page']}")
+                if entry['error']:
+                    st.error(entry['error'])
+                if isinstance(entry['plan'], list):
+                    st.dataframe(pd.DataFrame(entry['plan']), use_container_width=True)
+                elif entry['plan']:
+                    st.warning(entry['plan'])
+    else:
+        st.info("No slow queries recorded")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button("📥 Download JSON", json.dumps(snapshot, default=str, indent=2),
+                           "query_stats.json", "application/json", use_container_width=True)
+    with col2:
+        if st.button("💾 Write Dump File", use_container_width=True):
+            path = db.instrumentation.dump()
+            if path:
+                show_notification(f"Query stats written to {path}", "success")
+            else:
+                show_notification("Could not write the query stats dump", "error")
+            st.rerun()
+    with col3:
+        if st.button("🔄 Reset Statistics", use_container_width=True):
+            db.instrumentation.hook_of(QueryStats).reset()
+            st.rerun()
 
 # Footer with animated cab
+rerun_profile.checkpoint("footer")
 st.divider()
 
 # Animated cab moving across screen
@@ -942,4 +1347,6 @@ st.markdown("""
     <div style='text-align: center; color: gray; padding: 1rem;'>
         🚖 Cab Service Management System v2.0 | Built with ❤️ using Streamlit
     </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+rerun_profile.render(st)
@@ -0,0 +1,93 @@
+"""
+Concurrent database access for Cab Service Management System
+
+A page that needs several independent results (stats, a chart, a table)
+normally fetches them one after another. ConcurrentDatabase runs Database
+methods on a small thread pool, each on its own pooled connection, so the
+page waits for about the slowest query instead of the sum of all of them.
+
+mysql-connector is blocking, so threads do the concurrency. asyncio callers
+can await the same calls through ConcurrentDatabase.call_async().
+
+Usage:
+    cdb = get_concurrent_database()
+    stats, dist = cdb.gather(('get_dashboard_stats',), ('get_trip_status_distribution',))
+    future = cdb.get_trip_by_id(42)    # any Database method; returns a Future
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from config import DB_PARALLEL_WORKERS
+
+
+def _run_in(context, script_ctx, fn, args, kwargs):
+    """Run fn in the caller's context variables and Streamlit run context
+
+    The context variables carry the instrumentation page and the rerun
+    profile. The Streamlit context lets st.error() inside Database methods
+    reach the page that made the call.
+    """
+    if script_ctx is not None:
+        add_script_run_ctx(threading.current_thread(), script_ctx)
+    return context.run(fn, *args, **kwargs)
+
+
+class ConcurrentDatabase:
+    """Runs methods of a Database concurrently on a thread pool
+
+    Every Database method is also available here under the same name and
+    arguments, returning a concurrent.futures.Future. Concurrency is bounded
+    by `max_workers`; keep it within the connection pool's size plus
+    overflow, or workers will queue for connections.
+    """
+
+    def __init__(self, db, max_workers=DB_PARALLEL_WORKERS):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db-query')
+
+    def submit(self, method, *args, **kwargs):
+        """Start db.<method>(*args, **kwargs) on the pool; returns a Future"""
+        fn = getattr(self.db, method)
+        return self._executor.submit(_run_in, contextvars.copy_context(),
+                                     get_script_run_ctx(suppress_warning=True),
+                                     fn, args, kwargs)
+
+    def gather(self, *calls):
+        """Run calls concurrently and return their results in order
+
+        Each call is a tuple (method, *args), optionally ending with a dict
+        of keyword arguments. The first exception raised by any call is
+        re-raised once every call has finished.
+        """
+        futures = []
+        for call in calls:
+            method, args = call[0], list(call[1:])
+            kwargs = args.pop() if args and isinstance(args[-1], dict) else {}
+            futures.append(self.submit(method, *args, **kwargs))
+        wait(futures)
+        return [future.result() for future in futures]
+
+    async def call_async(self, method, *args, **kwargs):
+        """Await db.<method>(*args, **kwargs) without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(method, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not callable(getattr(self.db, name, None)):
+            raise AttributeError(name)
+        return functools.partial(self.submit, name)
+
+
+@st.cache_resource
+def get_concurrent_database():
+    """Get the cached ConcurrentDatabase over the shared Database instance"""
+    from database import get_database
+    return ConcurrentDatabase(get_database())
@@ -0,0 +1,131 @@
+"""
+Driver and vehicle availability index for Cab Service Management System
+
+Keeps the set of free drivers and available vehicles in memory. A page render
+that assigns many pending trips then costs at most two queries instead of two
+per trip. Free drivers with a known position are also kept in a spatial grid
+for nearest-driver lookups.
+"""
+import threading
+import time
+
+from config import AVAILABILITY_REFRESH_SECONDS
+from geo import GridIndex
+
+
+class AvailabilityIndex:
+    """In-process index of free drivers and available vehicles
+
+    The index is loaded with one query per entity and then kept in sync by the
+    Database write paths:
+    - assignments remove ("claim") rows in O(1);
+    - anything that can free a driver or vehicle marks the index stale, so the
+      next read reloads it.
+    It is also reloaded at least every AVAILABILITY_REFRESH_SECONDS. That picks
+    up changes made by other app replicas; assignments still lock and re-check
+    rows, so a stale entry can cause a reported conflict but never a double
+    booking.
+    """
+
+    def __init__(self, load_drivers, load_vehicles, refresh_seconds=AVAILABILITY_REFRESH_SECONDS):
+        self._load_drivers = load_drivers
+        self._load_vehicles = load_vehicles
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._drivers = {}          # Driver_ID -> row, in rating order
+        self._vehicles = {}         # Vehicle_ID -> row, in type order
+        self._driver_list = None    # cached list views, rebuilt after a claim
+        self._vehicle_list = None
+        self._driver_grid = GridIndex()  # Driver_ID -> current position, free drivers only
+        self._loaded_at = None
+
+    def _ensure_fresh(self):
+        """Reload from the database if stale; caller holds the lock"""
+        if (self._loaded_at is not None and
+                time.monotonic() - self._loaded_at < self.refresh_seconds):
+            return
+        drivers = self._load_drivers()
+        vehicles = self._load_vehicles()
+        if drivers is None or vehicles is None:
+            # Keep serving the last snapshot if the database hiccups
+            return
+        self._drivers = {row['Driver_ID']: row for row in drivers}
+        self._vehicles = {row['Vehicle_ID']: row for row in vehicles}
+        self._driver_grid = GridIndex()
+        for row in drivers:
+            if row.get('Current_Lat') is not None and row.get('Current_Lon') is not None:
+                self._driver_grid.insert(row['Driver_ID'], row['Current_Lat'], row['Current_Lon'])
+        self._driver_list = None
+        self._vehicle_list = None
+        self._loaded_at = time.monotonic()
+
+    def drivers(self):
+        """Free active drivers, best rated first (shared list, do not modify)"""
+        with self._lock:
+            self._ensure_fresh()
+            if self._driver_list is None:
+                self._driver_list = list(self._drivers.values())
+            return self._driver_list
+
+    def vehicles(self):
+        """Available vehicles, ordered by type (shared list, do not modify)"""
+        with self._lock:
+            self._ensure_fresh()
+            if self._vehicle_list is None:
+                self._vehicle_list = list(self._vehicles.values())
+            return self._vehicle_list
+
+    def is_driver_free(self, driver_id):
+        """O(1) check whether a driver is free"""
+        with self._lock:
+            self._ensure_fresh()
+            return driver_id in self._drivers
+
+    def is_vehicle_available(self, vehicle_id):
+        """O(1) check whether a vehicle is available"""
+        with self._lock:
+            self._ensure_fresh()
+            return vehicle_id in self._vehicles
+
+    def nearest_drivers(self, lat, lon, k=5, max_km=None):
+        """Up to k free drivers closest to (lat, lon) as (row, distance_km), closest first"""
+        with self._lock:
+            self._ensure_fresh()
+            return [(self._drivers[driver_id], distance)
+                    for driver_id, distance in self._driver_grid.nearest(lat, lon, k, max_km)]
+
+    def move_driver(self, driver_id, lat, lon):
+        """Record a driver's new position without reloading the index"""
+        with self._lock:
+            row = self._drivers.get(driver_id)
+            if row is None:
+                return
+            row['Current_Lat'], row['Current_Lon'] = lat, lon
+            if lat is None or lon is None:
+                self._driver_grid.remove(driver_id)
+            else:
+                self._driver_grid.insert(driver_id, lat, lon)
+
+    def claim(self, assignments):
+        """Remove assigned drivers and vehicles: iterable of (driver_id, vehicle_id)"""
+        with self._lock:
+            for driver_id, vehicle_id in assignments:
+                self._driver_grid.remove(driver_id)
+                if self._drivers.pop(driver_id, None) is not None:
+                    self._driver_list = None
+                if self._vehicles.pop(vehicle_id, None) is not None:
+                    self._vehicle_list = None
+
+    def invalidate(self):
+        """Force a reload on the next read"""
+        with self._lock:
+            self._loaded_at = None
+
+    def stats(self):
+        """Sizes and age of the current snapshot"""
+        with self._lock:
+            age = None if self._loaded_at is None else time.monotonic() - self._loaded_at
+            return {'free_drivers': len(self._drivers),
+                    'located_drivers': len(self._driver_grid),
+                    'available_vehicles': len(self._vehicles),
+                    'age_seconds': age}
@@ -0,0 +1,312 @@
+"""
+Database benchmark harness for Cab Service Management System
+
+Runs Database methods against the configured MySQL, usually loaded with
+datagen.py, and records latency percentiles, throughput and queries per
+call. Results are appended as JSON lines tagged with the git commit and the
+table sizes, so runs can be compared over time.
+
+By default every call starts cold: the entity cache, dashboard stats cache
+and availability index are cleared first, so the database is measured
+rather than the caches. --warm keeps them.
+
+The queries are MySQL-specific (FULLTEXT, SKIP LOCKED, JSON rollup SQL), so
+there is no embedded stand-in; a throwaway local MySQL 8 works, e.g.
+    docker run -d -p 3307:3306 -e MYSQL_ALLOW_EMPTY_PASSWORD=1 -e MYSQL_DATABASE=cab_service mysql:8
+
+Usage:
+    python benchmark.py                                  # read paths, 20 calls each
+    python benchmark.py --runs 100 --concurrency 8
+    python benchmark.py --only trips --unbounded         # include get_all_* style reads
+    python benchmark.py --writes                         # also write paths (modifies data)
+    python benchmark.py --compare benchmark_results.jsonl
+"""
+import argparse
+import json
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from instrumentation import LatencyHistogram
+
+RESULTS_PATH = 'benchmark_results.jsonl'
+
+# p95 growth over the previous run reported as a regression
+REGRESSION_THRESHOLD = 0.2
+
+
+class Sample:
+    """Random but valid arguments drawn from the loaded data"""
+
+    TABLES = {'user': ('User', 'User_ID'), 'driver': ('Driver', 'Driver_ID'),
+              'vehicle': ('Vehicle', 'Vehicle_ID'), 'trip': ('Trip', 'Trip_ID'),
+              'payment': ('Payment', 'Payment_ID')}
+
+    def __init__(self, db, rng):
+        from datagen import FIRST_NAMES, LAST_NAMES, load_places
+
+        self.rng = rng
+        selects = ', '.join(f"(SELECT COUNT(*) FROM {table}) AS {entity}s, "
+                            f"(SELECT MAX({key}) FROM {table}) AS max_{entity}"
+                            for entity, (table, key) in self.TABLES.items())
+        row = db.execute_query(f"SELECT {selects}", fetch=True)
+        if not row:
+            raise SystemExit("Could not read table sizes")
+        row = {key: int(value or 0) for key, value in row[0].items()}
+        self.sizes = {f"{entity}s": row[f"{entity}s"] for entity in self.TABLES}
+        self.max_ids = {entity: max(row[f"max_{entity}"], 1) for entity in self.TABLES}
+        self.names = [str(name) for name in FIRST_NAMES] + [str(name) for name in LAST_NAMES]
+        self.places = [(str(name), float(lat), float(lon)) for name, lat, lon in zip(*load_places())]
+
+    def id(self, entity):
+        return self.rng.randint(1, self.max_ids[entity])
+
+    def place(self):
+        """(name, latitude, longitude) of a gazetteer place"""
+        return self.rng.choice(self.places)
+
+    def name(self):
+        return self.rng.choice(self.names)
+
+
+def _lifecycle(db, s):
+    """Create, assign, start, complete and pay for one trip"""
+    from database import AssignmentConflict
+
+    trip_id = db.create_trip(s.id('user'), s.place()[0], s.place()[0])
+    free = {d['Driver_ID'] for d in db.get_available_drivers()}
+    vehicle = next((v for v in db.get_available_vehicles() if v['Driver_ID'] in free), None)
+    if not trip_id or vehicle is None:
+        raise RuntimeError("no trip or free driver/vehicle pair")
+    try:
+        db.assign_driver_vehicle(trip_id, vehicle['Driver_ID'], vehicle['Vehicle_ID'])
+    except AssignmentConflict as e:
+        raise RuntimeError(str(e))
+    db.start_trip(trip_id)
+    db.complete_trip(trip_id, round(s.rng.uniform(1, 30), 2))
+    trip = db.get_trip_by_id(trip_id)
+    payment_id = db.create_payment(trip_id, trip['Fare'] or 0, 'UPI', 'Pending')
+    db.update_payment_status(payment_id, 'Completed', f"BENCH{trip_id:012d}")
+
+
+def _pings(db, s):
+    now = datetime.now()
+    pings = [(s.id('driver'), lat + s.rng.uniform(-0.01, 0.01), lon + s.rng.uniform(-0.01, 0.01), now)
+             for _, lat, lon in (s.place() for _ in range(1000))]
+    db.record_driver_locations(pings)
+
+
+# (name, group, call). Groups: 'read' runs by default, 'unbounded' (results
+# grow with the table) with --unbounded, 'write' with --writes.
+CASES = [
+    ('get_users_page', 'read', lambda db, s: db.get_users_page()),
+    ('get_users_page[name]', 'read', lambda db, s: db.get_users_page(name=s.name())),
+    ('search_users[Name]', 'read', lambda db, s: db.search_users(s.name())),
+    ('search_users[Phone]', 'read', lambda db, s: db.search_users(f"9{s.rng.randint(0, 9999):04d}", by='Phone')),
+    ('search_users[Email]', 'read', lambda db, s: db.search_users(s.name().lower()[:4], by='Email')),
+    ('get_user_by_id', 'read', lambda db, s: db.get_user_by_id(s.id('user'))),
+    ('get_drivers_page', 'read', lambda db, s: db.get_drivers_page()),
+    ('get_drivers_page[filtered]', 'read',
+     lambda db, s: db.get_drivers_page(statuses=('Active',), min_rating=4.5)),
+    ('get_driver_by_id', 'read', lambda db, s: db.get_driver_by_id(s.id('driver'))),
+    ('get_available_drivers', 'read', lambda db, s: db.get_available_drivers()),
+    ('get_nearest_drivers', 'read', lambda db, s: db.get_nearest_drivers(*s.place()[1:], k=10)),
+    ('get_vehicles_page', 'read', lambda db, s: db.get_vehicles_page()),
+    ('get_vehicle_by_id', 'read', lambda db, s: db.get_vehicle_by_id(s.id('vehicle'))),
+    ('get_vehicle_types', 'read', lambda db, s: db.get_vehicle_types()),
+    ('get_available_vehicles', 'read', lambda db, s: db.get_available_vehicles()),
+    ('get_trips_page', 'read', lambda db, s: db.get_trips_page()),
+    ('get_trips_page[status+date]', 'read',
+     lambda db, s: db.get_trips_page(statuses=('Completed',), booked_from=date.today() - timedelta(days=30))),
+    ('get_trips_page[name]', 'read', lambda db, s: db.get_trips_page(name=s.name())),
+    ('get_trips_page[location]', 'read', lambda db, s: db.get_trips_page(location=s.place()[0].split(',')[0])),
+    ('get_trip_by_id', 'read', lambda db, s: db.get_trip_by_id(s.id('trip'))),
+    ('quote_fare', 'read', lambda db, s: db.quote_fare(s.id('trip'))),
+    ('get_payments_page', 'read', lambda db, s: db.get_payments_page()),
+    ('get_payments_page[Pending]', 'read', lambda db, s: db.get_payments_page(statuses=('Pending',))),
+    ('get_payment_by_id', 'read', lambda db, s: db.get_payment_by_id(s.id('payment'))),
+    ('get_dashboard_stats', 'read', lambda db, s: db.get_dashboard_stats()),
+    ('get_trip_status_distribution', 'read', lambda db, s: db.get_trip_status_distribution()),
+    ('get_revenue_by_vehicle_type', 'read', lambda db, s: db.get_revenue_by_vehicle_type()),
+    ('get_payment_mode_summary', 'read', lambda db, s: db.get_payment_mode_summary()),
+    ('get_trends[30d/day]', 'read',
+     lambda db, s: db.get_trends(date.today() - timedelta(days=30), date.today(), 'day')),
+    ('get_trends[365d/week]', 'read',
+     lambda db, s: db.get_trends(date.today() - timedelta(days=365), date.today(), 'week')),
+    ('get_users_list', 'unbounded', lambda db, s: db.get_users_list()),
+    ('get_completed_trips_without_payment', 'unbounded',
+     lambda db, s: db.get_completed_trips_without_payment()),
+    ('get_all_users', 'unbounded', lambda db, s: db.get_all_users()),
+    ('get_all_drivers', 'unbounded', lambda db, s: db.get_all_drivers()),
+    ('get_all_vehicles', 'unbounded', lambda db, s: db.get_all_vehicles()),
+    ('get_all_trips', 'unbounded', lambda db, s: db.get_all_trips()),
+    ('get_all_payments', 'unbounded', lambda db, s: db.get_all_payments()),
+    ('trip_lifecycle', 'write', _lifecycle),
+    ('update_driver_location', 'write',
+     lambda db, s: db.update_driver_location(s.id('driver'), *s.place()[1:])),
+    ('record_driver_locations[1000]', 'write', _pings),
+    ('refresh_rollups', 'write', lambda db, s: db.refresh_rollups(force=True)),
+]
+
+
+def reset_caches(db):
+    """Drop every in-process cache so the next call goes to MySQL"""
+    db._invalidate_caches()
+    db.cache.clear()
+    db.availability.invalidate()
+    db.fares.invalidate()
+
+
+class _QueryCounter:
+    """Instrumentation hook counting queries and failed queries"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.errors = 0
+
+    def __call__(self, event):
+        with self._lock:
+            self.queries += 1
+            self.errors += event['error'] is not None
+
+
+def run_case(db, sample, name, call, runs=20, concurrency=1, warm=False):
+    """Time `runs` calls (spread over `concurrency` threads); returns a result dict"""
+    histogram = LatencyHistogram()
+    lock = threading.Lock()
+    counter = _QueryCounter()
+    failures = []
+
+    def one(_):
+        if not warm:
+            reset_caches(db)
+        started = time.perf_counter()
+        try:
+            call(db, sample)
+        except Exception as e:
+            failures.append(str(e))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            histogram.observe(elapsed_ms)
+
+    if warm:
+        one(None)    # prime the caches outside the measurement
+        histogram = LatencyHistogram()
+    db.instrumentation.add_hook(counter)
+    try:
+        started = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(one, range(runs)))
+        else:
+            for i in range(runs):
+                one(i)
+        wall = time.perf_counter() - started
+    finally:
+        db.instrumentation.remove_hook(counter)
+
+    return dict(histogram.summary(), case=name, runs=runs, concurrency=concurrency, warm=warm,
+                calls_per_sec=round(runs / wall, 2) if wall else 0.0,
+                queries_per_call=round(counter.queries / runs, 2),
+                errors=counter.errors + len(failures),
+                failure=failures[0] if failures else None)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path):
+    """Latest recorded result per (case, concurrency, warm)"""
+    latest = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    latest[(result['case'], result['concurrency'], result['warm'])] = result
+    except FileNotFoundError:
+        pass
+    return latest
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Print p50/p95 changes against a baseline; returns the regressed case names"""
+    regressed = []
+    print(f"\n{'case':<38} {'p50 ms':>9} {'p95 ms':>9} {'base p95':>9} {'change':>8}")
+    for result in results:
+        base = baseline.get((result['case'], result['concurrency'], result['warm']))
+        change = ''
+        if base and base['p95_ms']:
+            ratio = result['p95_ms'] / base['p95_ms'] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > threshold:
+                regressed.append(result['case'])
+                change += ' !'
+        print(f"{result['case']:<38} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+              f"{base['p95_ms'] if base else float('nan'):>9.2f} {change:>8}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Database methods")
+    parser.add_argument('--runs', type=int, default=20, help="calls per case")
+    parser.add_argument('--concurrency', type=int, default=1, help="threads issuing calls")
+    parser.add_argument('--warm', action='store_true', help="keep in-process caches between calls")
+    parser.add_argument('--only', help="run cases whose name contains this text")
+    parser.add_argument('--unbounded', action='store_true', help="include full-table reads")
+    parser.add_argument('--writes', action='store_true', help="include write paths (modifies data)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default=RESULTS_PATH, help="append results to this JSON-lines file")
+    parser.add_argument('--compare', metavar='JSONL', help="compare with the latest results in this file")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="p95 growth reported as a regression")
+    args = parser.parse_args()
+
+    from database import Database
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Could not connect to the database")
+
+    groups = {'read'} | ({'unbounded'} if args.unbounded else set()) | ({'write'} if args.writes else set())
+    cases = [(name, call) for name, group, call in CASES
+             if group in groups and (not args.only or args.only in name)]
+    baseline = load_results(args.compare) if args.compare else {}
+
+    try:
+        sample = Sample(db, random.Random(args.seed))
+        print(f"Tables: {sample.sizes['users']:,} users, {sample.sizes['drivers']:,} drivers, "
+              f"{sample.sizes['vehicles']:,} vehicles, {sample.sizes['trips']:,} trips, "
+              f"{sample.sizes['payments']:,} payments")
+        context = {'at': datetime.now().isoformat(timespec='seconds'), 'commit': _git_commit(),
+                   'sizes': sample.sizes}
+        results = []
+        with open(args.out, 'a', encoding='utf-8') as out:
+            for name, call in cases:
+                result = run_case(db, sample, name, call, args.runs, args.concurrency, args.warm)
+                results.append(result)
+                out.write(json.dumps(dict(context, **result), default=str) + '\n')
+                out.flush()
+                print(f"{name:<38} p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+                      f"{result['calls_per_sec']:>9.1f} calls/s  {result['queries_per_call']:>5.1f} q/call"
+                      + (f"  {result['errors']} error(s)" if result['errors'] else ""))
+    finally:
+        db.disconnect()
+    print(f"Results appended to {args.out}")
+
+    if args.compare:
+        regressed = compare(results, baseline, args.threshold)
+        if regressed:
+            raise SystemExit(f"{len(regressed)} regression(s): {', '.join(regressed)}")
+
+
+if __name__ == '__main__':
+    main()
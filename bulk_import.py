@@ -0,0 +1,372 @@
+"""
+Bulk import pipeline for Cab Service Management System
+
+Streams CSV or Parquet files in chunks, validates each chunk against the same
+rules as the CHECK / NOT NULL / ENUM constraints in sql/schema.sql, and inserts
+valid rows with multi-row INSERTs (executemany), one transaction per batch.
+Imported trips and payments are logged to the change-event log (see
+outbox.py) in the same transaction, and the unpaid-trips queue (see
+reconciliation.py) is brought up to date from those events at the end.
+
+Usage:
+    python bulk_import.py users users.csv
+    python bulk_import.py trips trips.parquet --batch-size 20000
+    python bulk_import.py payments payments.csv --dry-run --rejects rejects.csv
+"""
+import argparse
+import csv
+import os
+import time
+
+import pandas as pd
+
+from config import (DRIVER_STATUS, PAYMENT_MODES, PAYMENT_STATUS, TRIP_STATUS,
+                    VEHICLE_STATUS, IMPORT_BATCH_SIZE)
+from outbox import SNAPSHOTS, record as record_event
+from reconciliation import sync_queue
+
+# Importable entities: target table, accepted columns, required columns,
+# defaults for NOT NULL columns that have a server-side default, and
+# datetime columns to parse. Columns missing from a file are left to the
+# table defaults.
+TABLES = {
+    'users': {
+        'table': 'User',
+        'columns': ['User_ID', 'First_Name', 'Last_Name', 'Phone_Number', 'Email',
+                    'Registration_Date', 'Last_Login'],
+        'required': ['First_Name', 'Last_Name', 'Phone_Number', 'Email'],
+        'defaults': {'Registration_Date': 'now'},
+        'datetimes': ['Registration_Date', 'Last_Login'],
+    },
+    'drivers': {
+        'table': 'Driver',
+        'columns': ['Driver_ID', 'First_Name', 'Last_Name', 'Phone_Number', 'License_Number',
+                    'Rating', 'Status', 'Current_Active_Location', 'Current_Lat', 'Current_Lon',
+                    'Location_Updated_At', 'Join_Date', 'Last_Active'],
+        'required': ['First_Name', 'Last_Name', 'Phone_Number', 'License_Number'],
+        'defaults': {'Status': 'Active', 'Join_Date': 'now'},
+        'datetimes': ['Location_Updated_At', 'Join_Date', 'Last_Active'],
+    },
+    'vehicles': {
+        'table': 'Vehicle',
+        'columns': ['Vehicle_ID', 'Driver_ID', 'Vehicle_Type', 'Vehicle_Number', 'Make', 'Model',
+                    'Year', 'Status', 'Assignment_Date', 'Registration_Date'],
+        'required': ['Vehicle_Type', 'Vehicle_Number'],
+        'defaults': {'Status': 'Available', 'Registration_Date': 'now'},
+        'datetimes': ['Assignment_Date', 'Registration_Date'],
+    },
+    'trips': {
+        'table': 'Trip',
+        'columns': ['Trip_ID', 'User_ID', 'Driver_ID', 'Vehicle_ID', 'Pickup_Location',
+                    'Dropoff_Location', 'Pickup_Lat', 'Pickup_Lon', 'Dropoff_Lat', 'Dropoff_Lon',
+                    'Pickup_Time', 'Dropoff_Time', 'Booking_Time', 'Distance', 'Fare', 'Status'],
+        'required': ['Pickup_Location', 'Dropoff_Location'],
+        'defaults': {'Status': 'Pending', 'Booking_Time': 'now'},
+        'datetimes': ['Pickup_Time', 'Dropoff_Time', 'Booking_Time'],
+    },
+    'payments': {
+        'table': 'Payment',
+        'columns': ['Payment_ID', 'Trip_ID', 'Amount', 'Payment_Mode', 'Payment_Status',
+                    'Payment_DateTime', 'Reference_Number'],
+        'required': ['Trip_ID', 'Amount', 'Payment_Mode'],
+        'defaults': {'Payment_Status': 'Pending', 'Payment_DateTime': 'now'},
+        'datetimes': ['Payment_DateTime'],
+    },
+}
+
+# Maximum VARCHAR lengths from schema.sql
+MAX_LENGTHS = {
+    'First_Name': 50, 'Last_Name': 50, 'Phone_Number': 15, 'Email': 100,
+    'License_Number': 20, 'Current_Active_Location': 200,
+    'Vehicle_Type': 20, 'Vehicle_Number': 20, 'Make': 30, 'Model': 30,
+    'Pickup_Location': 200, 'Dropoff_Location': 200,
+    'Payment_Mode': 20, 'Reference_Number': 50,
+}
+
+# ENUM / CHECK IN (...) domains
+ALLOWED_VALUES = {
+    ('drivers', 'Status'): DRIVER_STATUS,
+    ('vehicles', 'Status'): VEHICLE_STATUS,
+    ('trips', 'Status'): TRIP_STATUS,
+    ('payments', 'Payment_Mode'): PAYMENT_MODES,
+    ('payments', 'Payment_Status'): PAYMENT_STATUS,
+}
+
+# Latitude / longitude columns (chk_driver_coords, chk_trip_coords)
+COORDINATE_COLUMNS = ['Current_Lat', 'Current_Lon', 'Pickup_Lat', 'Pickup_Lon',
+                      'Dropoff_Lat', 'Dropoff_Lon']
+
+# Unique columns; duplicates inside one batch are rejected before insert
+UNIQUE_COLUMNS = {
+    'users': ['Phone_Number', 'Email'],
+    'drivers': ['Phone_Number', 'License_Number'],
+    'vehicles': ['Vehicle_Number'],
+    'payments': ['Reference_Number'],
+}
+
+
+def read_chunks(path, chunk_size):
+    """Yield DataFrames of at most chunk_size rows from a CSV or Parquet file"""
+    if path.lower().endswith(('.parquet', '.pq')):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet import requires pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False,
+                                 na_values=['']):
+            yield chunk
+
+
+def validate_chunk(kind, df, vehicle_types=None):
+    """Check a chunk against the schema constraints
+
+    Returns (valid_df, rejects). valid_df holds only accepted columns, with
+    defaults filled in and values converted. rejects is a list of
+    (row_index, reason) pairs.
+    """
+    spec = TABLES[kind]
+    unknown = [c for c in df.columns if c not in spec['columns']]
+    df = df.drop(columns=unknown)
+    missing = [c for c in spec['required'] if c not in df.columns]
+    if missing:
+        return df.iloc[0:0], [(idx, f"missing column(s): {', '.join(missing)}") for idx in df.index]
+
+    problems = pd.Series('', index=df.index, dtype=object)
+
+    def fail(mask, reason):
+        mask = mask.fillna(True) & (problems == '')
+        problems[mask] = reason
+
+    def text(column):
+        return df[column].astype(str).str.strip()
+
+    for column in spec['required']:
+        fail(df[column].isna() | (text(column) == ''), f"{column} is required")
+
+    for column in df.columns:
+        if column in MAX_LENGTHS:
+            fail(df[column].notna() & (text(column).str.len() > MAX_LENGTHS[column]),
+                 f"{column} longer than {MAX_LENGTHS[column]} characters")
+        if (kind, column) in ALLOWED_VALUES:
+            fail(df[column].notna() & ~df[column].isin(ALLOWED_VALUES[(kind, column)]),
+                 f"invalid {column}")
+
+    for column in spec['datetimes']:
+        if column in df.columns:
+            parsed = pd.to_datetime(df[column], errors='coerce')
+            fail(df[column].notna() & parsed.isna(), f"{column} is not a valid date/time")
+            df[column] = parsed
+
+    def number(column):
+        return pd.to_numeric(df[column], errors='coerce')
+
+    for column in ['User_ID', 'Driver_ID', 'Vehicle_ID', 'Trip_ID', 'Payment_ID',
+                   'Rating', 'Year', 'Distance', 'Fare', 'Amount'] + COORDINATE_COLUMNS:
+        if column in df.columns:
+            fail(df[column].notna() & number(column).isna(), f"{column} is not a number")
+            df[column] = number(column)
+
+    # CHECK constraints
+    if 'Phone_Number' in df.columns:
+        fail(~text('Phone_Number').str.fullmatch(r'[0-9]{10,15}'), "invalid phone number")     # chk_*_phone
+    if kind == 'users':
+        fail(~text('Email').str.contains(r'@.*\.', regex=True), "invalid email")                # chk_user_email
+    if 'Rating' in df.columns:
+        fail(df['Rating'].notna() & ~df['Rating'].between(0.0, 5.0), "rating must be 0-5")       # chk_driver_rating
+    if 'Year' in df.columns:
+        fail(df['Year'].notna() & ~df['Year'].between(1990, 2030), "year must be 1990-2030")     # chk_vehicle_year
+    for column in ['Distance', 'Fare', 'Amount']:                                               # chk_trip_*, chk_payment_amount
+        if column in df.columns:
+            fail(df[column].notna() & (df[column] < 0), f"{column} must not be negative")
+    for column in COORDINATE_COLUMNS:                                                           # chk_*_coords
+        if column in df.columns:
+            limit = 90 if column.endswith('_Lat') else 180
+            fail(df[column].notna() & ~df[column].between(-limit, limit), f"{column} out of range")
+    if 'Dropoff_Time' in df.columns and 'Pickup_Time' in df.columns:                           # chk_trip_times
+        fail(df['Dropoff_Time'].notna() & df['Pickup_Time'].notna() &
+             (df['Dropoff_Time'] < df['Pickup_Time']),
+             "Dropoff_Time must be on or after Pickup_Time")
+    if kind == 'vehicles' and vehicle_types is not None:                                        # fk_vehicle_type
+        fail(~df['Vehicle_Type'].isin(vehicle_types), "unknown Vehicle_Type")
+
+    for column in UNIQUE_COLUMNS.get(kind, []):
+        if column in df.columns:
+            fail(df[column].notna() & df[column].duplicated(keep='first'),
+                 f"duplicate {column} within batch")
+
+    rejects = [(idx, reason) for idx, reason in problems.items() if reason]
+    valid = df[problems == '']
+
+    now = pd.Timestamp.now().floor('s')
+    for column, default in spec['defaults'].items():
+        if column in valid.columns:
+            valid = valid.assign(**{column: valid[column].fillna(now if default == 'now' else default)})
+    return valid, rejects
+
+
+def _rows(df):
+    """DataFrame rows as tuples of driver-friendly Python values"""
+    from database import Database
+    return [tuple(None if pd.isna(value) else Database._to_param(value) for value in row)
+            for row in df.itertuples(index=False, name=None)]
+
+
+def insert_batch(db, kind, df):
+    """Insert a validated batch in one transaction
+
+    Tries one multi-row INSERT first. If the database rejects the batch
+    (e.g. a duplicate key already in the table), inserts the rows one by
+    one inside a single transaction to find out which rows fail. Trips and
+    payments get a 'created' change event each, committed with the rows.
+    Returns (inserted, rejects).
+    """
+    from mysql.connector import Error
+
+    if df.empty:
+        return 0, []
+    table = TABLES[kind]['table']
+    columns = list(df.columns)
+    query = (f"INSERT INTO {table} ({', '.join(columns)}) "
+             f"VALUES ({', '.join(['%s'] * len(columns))})")
+    rows = _rows(df)
+    key = SNAPSHOTS[table][1] if table in SNAPSHOTS else None
+    keys = df[key] if key in df.columns else pd.Series(index=df.index, dtype=float)
+
+    # A batch mixing given and generated IDs goes row by row, where each
+    # row's ID is known
+    if keys.notna().all() or keys.isna().all():
+        try:
+            with db.transaction() as cursor:
+                cursor.executemany(query, rows)
+                if key is not None:
+                    # One multi-row INSERT is a "simple insert", which gets
+                    # consecutive AUTO_INCREMENT values in every lock mode
+                    ids = (keys.astype(int).tolist() if keys.notna().all()
+                           else list(range(cursor.lastrowid, cursor.lastrowid + len(rows))))
+                    record_event(cursor, table, 'created', ids)
+            db.cache.invalidate(table, 'list')
+            return len(rows), []
+        except Error:
+            pass
+
+    # InnoDB rolls back only the failing statement, so the good rows can
+    # still be committed together
+    inserted = 0
+    rejects = []
+    ids = []
+    with db.transaction() as cursor:
+        for idx, row, given in zip(df.index, rows, keys):
+            try:
+                cursor.execute(query, row)
+                inserted += 1
+                ids.append(cursor.lastrowid if pd.isna(given) else int(given))
+            except Error as e:
+                rejects.append((idx, e.msg))
+        if key is not None:
+            record_event(cursor, table, 'created', ids)
+    db.cache.invalidate(table, 'list')
+    return inserted, rejects
+
+
+def import_file(db, kind, path, batch_size=IMPORT_BATCH_SIZE, dry_run=False, on_batch=None):
+    """Stream `path` into the table for `kind`
+
+    Calls on_batch(report) after each batch, where report has batch, rows,
+    inserted, rejected, seconds, rows_per_sec and rejects (list of
+    (row_number, reason), 1-based data row numbers). Returns the totals.
+    """
+    vehicle_types = None
+    if kind == 'vehicles' and db is not None:
+        vehicle_types = [vt['Vehicle_Type'] for vt in db.get_vehicle_types() or []]
+
+    totals = {'batches': 0, 'rows': 0, 'inserted': 0, 'rejected': 0, 'seconds': 0.0}
+    offset = 0
+    for number, chunk in enumerate(read_chunks(path, batch_size), start=1):
+        started = time.perf_counter()
+        chunk.index = range(offset + 1, offset + len(chunk) + 1)
+        offset += len(chunk)
+
+        valid, rejects = validate_chunk(kind, chunk, vehicle_types)
+        inserted = len(valid)
+        if not dry_run:
+            inserted, insert_rejects = insert_batch(db, kind, valid)
+            rejects += insert_rejects
+
+        seconds = time.perf_counter() - started
+        report = {
+            'batch': number,
+            'rows': len(chunk),
+            'inserted': inserted,
+            'rejected': len(rejects),
+            'seconds': seconds,
+            'rows_per_sec': len(chunk) / seconds if seconds else 0.0,
+            'rejects': sorted(rejects),
+        }
+        for key in ('rows', 'inserted', 'rejected', 'seconds'):
+            totals[key] += report[key]
+        totals['batches'] = number
+        if on_batch:
+            on_batch(report)
+
+    totals['rows_per_sec'] = totals['rows'] / totals['seconds'] if totals['seconds'] else 0.0
+    if not dry_run and db is not None and kind in ('drivers', 'vehicles', 'trips'):
+        db.availability.invalidate()
+    if not dry_run and db is not None and kind in ('trips', 'payments') and totals['inserted']:
+        # Work the import's events off here rather than on the next page view
+        sync_queue(db)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import CSV/Parquet data")
+    parser.add_argument('kind', choices=sorted(TABLES))
+    parser.add_argument('path')
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help="validate only, insert nothing")
+    parser.add_argument('--rejects', metavar='CSV', help="write rejected rows and reasons to this file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        raise SystemExit(f"No such file: {args.path}")
+
+    db = None
+    if not args.dry_run:
+        from database import Database
+        db = Database()
+        if not db.connect():
+            raise SystemExit("Could not connect to the database")
+
+    reject_writer = None
+    reject_file = None
+    if args.rejects:
+        reject_file = open(args.rejects, 'w', newline='')
+        reject_writer = csv.writer(reject_file)
+        reject_writer.writerow(['row', 'reason'])
+
+    verb = 'valid' if args.dry_run else 'inserted'
+
+    def on_batch(report):
+        print(f"batch {report['batch']:>5}: {report['rows']:>7,} rows, "
+              f"{report['inserted']:>7,} {verb}, {report['rejected']:>6,} rejected, "
+              f"{report['rows_per_sec']:>10,.0f} rows/sec")
+        if reject_writer:
+            reject_writer.writerows(report['rejects'])
+
+    try:
+        totals = import_file(db, args.kind, args.path, args.batch_size, args.dry_run, on_batch)
+    finally:
+        if reject_file:
+            reject_file.close()
+        if db:
+            db.disconnect()
+
+    print(f"done: {totals['rows']:,} rows in {totals['batches']} batch(es), "
+          f"{totals['inserted']:,} {verb}, "
+          f"{totals['rejected']:,} rejected, {totals['rows_per_sec']:,.0f} rows/sec")
+
+
+if __name__ == '__main__':
+    main()
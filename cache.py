@@ -0,0 +1,170 @@
+"""
+Read-through entity cache for Cab Service Management System
+
+Single-row lookups (get_user_by_id, get_trip_by_id, ...) and small dropdown
+lists are served from an in-process LRU with a TTL. Entries are keyed by
+(entity, key), where entity is the table name and key is the primary key or
+a name such as 'list'. The matching Database write methods invalidate them.
+
+Several app processes stay coherent through an optional shared backend. Every
+invalidation is published to it, and each cache replays the invalidations
+published by others before serving a read. InProcessBackend implements the
+interface in memory (shared by caches in one process); a network
+implementation, e.g. on a Redis stream, only needs the same two methods.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+from config import CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS
+
+# Key meaning "every entry of an entity" (a string so backends can store it)
+ALL = '*'
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+class CacheBackend:
+    """Shared invalidation log used to keep several caches coherent"""
+
+    def publish(self, entity, key):
+        """Record that (entity, key) changed; key ALL means the whole entity"""
+        raise NotImplementedError
+
+    def invalidations(self, after):
+        """(latest sequence number, [(entity, key), ...] published after `after`)
+
+        Returns None instead of the list when `after` is older than the log
+        retains, in which case the reader must drop everything it holds.
+        """
+        raise NotImplementedError
+
+
+class InProcessBackend(CacheBackend):
+    """CacheBackend kept in memory; the last `keep` invalidations are retained"""
+
+    def __init__(self, keep=10000):
+        self._lock = threading.Lock()
+        self._log = deque(maxlen=keep)    # (sequence, entity, key)
+        self._sequence = 0
+
+    def publish(self, entity, key):
+        with self._lock:
+            self._sequence += 1
+            self._log.append((self._sequence, entity, key))
+
+    def invalidations(self, after):
+        with self._lock:
+            if after >= self._sequence:
+                return self._sequence, []
+            if not self._log or self._log[0][0] > after + 1:
+                return self._sequence, None
+            return self._sequence, [(entity, key) for seq, entity, key in self._log if seq > after]
+
+
+class EntityCache:
+    """LRU + TTL cache of query results keyed by (entity, key)
+
+    get() loads a missing or expired entry through the given callable and
+    stores it unless it was invalidated while loading. None results (not
+    found or a database error) are never cached. Row dicts are copied on the
+    way out; lists are copied but share their rows (do not modify those).
+    """
+
+    def __init__(self, backend=None, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # (entity, key) -> (value, expires_at or None)
+        self._generations = {}           # entity -> count of invalidations seen
+        self._seen = backend.invalidations(0)[0] if backend is not None else 0
+        self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, entity, key, load, ttl=None):
+        """Cached value for (entity, key), loading it with load() on a miss
+
+        ttl overrides the default for this entry; pass 0 to keep it until it
+        is invalidated or evicted.
+        """
+        self._sync()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((entity, key))
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self._entries.move_to_end((entity, key))
+                self.metrics['hits'] += 1
+                return _copy(entry[0])
+            self.metrics['misses'] += 1
+            generation = self._generations.get(entity, 0)
+
+        value = load()
+        if value is None:
+            return None
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            # Don't cache a result that raced with a write
+            if self._generations.get(entity, 0) == generation:
+                self._entries[(entity, key)] = (value, now + ttl if ttl else None)
+                self._entries.move_to_end((entity, key))
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.metrics['evictions'] += 1
+        return _copy(value)
+
+    def invalidate(self, entity, *keys):
+        """Drop the given keys of an entity (every key when none are given)
+
+        The invalidation is also published to the shared backend.
+        """
+        keys = keys or (ALL,)
+        self._drop(entity, keys)
+        with self._lock:
+            self.metrics['invalidations'] += 1
+        if self.backend is not None:
+            for key in keys:
+                self.backend.publish(entity, key)
+
+    def clear(self):
+        """Drop every entry (local only)"""
+        with self._lock:
+            self._entries.clear()
+            for entity in self._generations:
+                self._generations[entity] += 1
+
+    def _drop(self, entity, keys):
+        with self._lock:
+            self._generations[entity] = self._generations.get(entity, 0) + 1
+            if ALL in keys:
+                for cache_key in [k for k in self._entries if k[0] == entity]:
+                    del self._entries[cache_key]
+            else:
+                for key in keys:
+                    self._entries.pop((entity, key), None)
+
+    def _sync(self):
+        """Apply invalidations published since the last read
+
+        Our own invalidations come back too; dropping them again is harmless.
+        """
+        if self.backend is None:
+            return
+        latest, changes = self.backend.invalidations(self._seen)
+        if changes is None:
+            self.clear()
+        else:
+            for entity, key in changes:
+                self._drop(entity, (key,))
+        self._seen = latest
+
+    def stats(self):
+        with self._lock:
+            lookups = self.metrics['hits'] + self.metrics['misses']
+            return dict(self.metrics, entries=len(self._entries),
+                        hit_rate=self.metrics['hits'] / lookups if lookups else 0.0)
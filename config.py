@@ -2,6 +2,7 @@
 Configuration file for Cab Service Management System
 """
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,6 +17,105 @@ DB_CONFIG = {
     'port': int(os.getenv('DB_PORT', 3307))
 }
 
+# Connection Pool Configuration
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))                # connections kept open
+DB_POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', 5))  # extra short-lived connections under load
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))       # seconds to wait for a free connection
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 5))  # ping idle connections older than this on checkout
+DB_PARALLEL_WORKERS = int(os.getenv('DB_PARALLEL_WORKERS', DB_POOL_SIZE))  # threads for concurrent page queries
+
+# Caching
+DASHBOARD_STATS_TTL = float(os.getenv('DASHBOARD_STATS_TTL', 30))  # seconds
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 60))  # entity lookups (VehicleType never expires)
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))  # LRU bound across all entities
+
+AVAILABILITY_REFRESH_SECONDS = float(os.getenv('AVAILABILITY_REFRESH_SECONDS', 15))
+
+# Search
+SEARCH_RESULT_LIMIT = int(os.getenv('SEARCH_RESULT_LIMIT', 50))
+FULLTEXT_MIN_TOKEN_SIZE = int(os.getenv('FULLTEXT_MIN_TOKEN_SIZE', 3))  # innodb_ft_min_token_size
+
+# Dispatcher
+DISPATCH_BATCH_SIZE = int(os.getenv('DISPATCH_BATCH_SIZE', 1000))  # pending trips per run
+DISPATCH_INTERVAL = float(os.getenv('DISPATCH_INTERVAL', 10))      # seconds between background runs
+DISPATCH_RATING_WEIGHT = 0.7  # share of a driver/vehicle score from rating; the rest from vehicle type
+DISPATCH_VEHICLE_TYPE_WEIGHTS = {  # preference for standard requests (no type requested)
+    'Sedan': 1.0,
+    'Hatchback': 0.9,
+    'SUV': 0.8,
+    'Auto': 0.7,
+    'Luxury': 0.6,
+    'Bike': 0.5,
+}
+
+# Fare Engine (per-km rates come from VehicleType.Base_Fare_Per_Km)
+FARE_PER_MINUTE = float(os.getenv('FARE_PER_MINUTE', 1.0))  # added per minute of ride time
+FARE_MINIMUMS = {  # minimum fare per vehicle type
+    'Bike': 25.0,
+    'Auto': 30.0,
+    'Hatchback': 50.0,
+    'Sedan': 60.0,
+    'SUV': 90.0,
+    'Luxury': 150.0,
+}
+FARE_SURGE_WINDOWS = [  # (start hour, end hour exclusive, multiplier) by pickup hour
+    (8, 11, 1.25),   # morning peak
+    (17, 21, 1.5),   # evening peak
+    (23, 5, 1.2),    # night (wraps past midnight)
+]
+FARE_AUDIT_TOLERANCE = float(os.getenv('FARE_AUDIT_TOLERANCE', 1.0))  # rupees
+FARE_RATES_REFRESH_SECONDS = float(os.getenv('FARE_RATES_REFRESH_SECONDS', 300))
+
+# Geo / Spatial Index
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.csv'))
+GEO_CELL_KM = float(os.getenv('GEO_CELL_KM', 1.0))  # grid cell size of the driver spatial index
+GEO_NEAREST_K = int(os.getenv('GEO_NEAREST_K', 10))  # nearest drivers offered in the assignment UI
+GEO_NEAREST_MAX_KM = float(os.getenv('GEO_NEAREST_MAX_KM', 25.0))  # ...and only within this distance
+GEO_DISPATCH_RADIUS_KM = float(os.getenv('GEO_DISPATCH_RADIUS_KM', 5.0))  # dispatcher prefers drivers within this
+
+# Driver Location Ingest
+LOCATION_FLUSH_SECONDS = float(os.getenv('LOCATION_FLUSH_SECONDS', 2.0))  # how often coalesced pings are written
+LOCATION_FLUSH_CHUNK = int(os.getenv('LOCATION_FLUSH_CHUNK', 1000))      # rows per multi-row UPDATE
+LOCATION_INGEST_HOST = os.getenv('LOCATION_INGEST_HOST', '127.0.0.1')
+LOCATION_INGEST_PORT = int(os.getenv('LOCATION_INGEST_PORT', 8765))
+
+# Query Instrumentation
+QUERY_INSTRUMENTATION = os.getenv('QUERY_INSTRUMENTATION', '1') != '0'
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))  # slower queries are logged with EXPLAIN
+SLOW_QUERY_LOG_PATH = os.getenv('SLOW_QUERY_LOG_PATH',
+                                os.path.join(tempfile.gettempdir(), 'cab_service_slow_queries.jsonl'))
+QUERY_STATS_DUMP_PATH = os.getenv('QUERY_STATS_DUMP_PATH',
+                                  os.path.join(tempfile.gettempdir(), 'cab_service_query_stats.json'))
+QUERY_STATS_DUMP_SECONDS = float(os.getenv('QUERY_STATS_DUMP_SECONDS', 60))  # JSON dump interval
+
+# Rerun Profiler
+PROFILE_RERUNS = os.getenv('PROFILE_RERUNS', '0') == '1'  # show a per-rerun profile under each page
+RERUN_QUERY_BUDGET = int(os.getenv('RERUN_QUERY_BUDGET', 15))  # warn above this many queries per rerun
+RERUN_TIME_BUDGET_MS = float(os.getenv('RERUN_TIME_BUDGET_MS', 1500))  # warn above this wall time per rerun
+
+# Bulk Import / Export
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 5000))  # rows per INSERT transaction
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 10000))  # rows held in memory while exporting
+EXPORT_DIR = os.getenv('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'cab_service_exports'))
+EXPORT_MAX_DOWNLOAD_MB = float(os.getenv('EXPORT_MAX_DOWNLOAD_MB', 200))  # larger exports: use export.py
+EXPORT_RETENTION_HOURS = float(os.getenv('EXPORT_RETENTION_HOURS', 24))  # undownloaded files kept this long
+
+# Analytics Rollups
+ROLLUP_REFRESH_SECONDS = float(os.getenv('ROLLUP_REFRESH_SECONDS', 60))  # min seconds between in-app refreshes
+ROLLUP_LOOKBACK_DAYS = int(os.getenv('ROLLUP_LOOKBACK_DAYS', 1))  # days before the high-water mark re-aggregated
+ROLLUP_BACKFILL_DAYS = int(os.getenv('ROLLUP_BACKFILL_DAYS', 31))  # days of history per backfill transaction
+
+# Change-Event Log (outbox)
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 10000))  # events scanned per consumer poll
+OUTBOX_MAX_TRANSACTION_SECONDS = float(os.getenv('OUTBOX_MAX_TRANSACTION_SECONDS', 30))  # longest a transaction may hold events
+OUTBOX_GAP_GRACE_SECONDS = float(os.getenv('OUTBOX_GAP_GRACE_SECONDS', 60))  # wait for a missing event ID this long (> the above)
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', 7))  # consumed events kept this long
+
+# Payment Reconciliation
+RECONCILE_TOLERANCE = float(os.getenv('RECONCILE_TOLERANCE', 1.0))  # rupees between fare and amount paid
+RECONCILE_STALE_PENDING_HOURS = float(os.getenv('RECONCILE_STALE_PENDING_HOURS', 24))  # Pending longer is stale
+
 # App Configuration
 APP_TITLE = "🚖 Cab Service Management System"
 APP_ICON = "🚖"
@@ -28,4 +128,5 @@ VEHICLE_STATUS = ['Available', 'In_Use', 'Maintenance']
 PAYMENT_MODES = ['Cash', 'Card', 'UPI', 'Wallet', 'Net_Banking']
 
 # Pagination
-RECORDS_PER_PAGE = 10
\ No newline at end of file
+RECORDS_PER_PAGE = 10
+COUNT_ESTIMATE_CAP = int(os.getenv('COUNT_ESTIMATE_CAP', 10000))  # exact counts up to this many rows
@@ -1,68 +1,609 @@
 """
 Database connection and operations for Cab Service Management System
 """
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta, time as dt_time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
 import pandas as pd
 import streamlit as st
-from config import DB_CONFIG
+from availability import AvailabilityIndex
+from cache import EntityCache
+from fares import FareEngine
+from geo import geocode
+from instrumentation import (Instrumentation, InstrumentedCursor, QueryStats, SlowQueryLog,
+                             caller_name)
+from lifecycle import TripEvent, apply_transitions
+from outbox import record as record_event
+from reconciliation import sync_queue as sync_unpaid_queue
+from rollups import refresh_all as refresh_all_rollups
+from settlement import PaymentChange, reference_for, settle
+from config import (DB_CONFIG, DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW,
+                    DB_POOL_TIMEOUT, DB_POOL_PING_AFTER, DASHBOARD_STATS_TTL,
+                    RECORDS_PER_PAGE, COUNT_ESTIMATE_CAP, SEARCH_RESULT_LIMIT,
+                    FULLTEXT_MIN_TOKEN_SIZE, ROLLUP_REFRESH_SECONDS, LOCATION_FLUSH_CHUNK,
+                    OUTBOX_MAX_TRANSACTION_SECONDS, QUERY_INSTRUMENTATION)
+
+
+# One page of a keyset-paginated listing. `next_cursor` is passed back to the
+# same get_*_page method to fetch the following page (None on the last page);
+# `total` is exact when `total_exact` is True. Otherwise it is an estimate
+# for unfiltered listings, or a lower bound when `total_at_least` is True.
+Page = namedtuple('Page', ['rows', 'next_cursor', 'total', 'total_exact', 'total_at_least'],
+                  defaults=(False,))
+
+
+# SQL expressions truncating a datetime column to the start of its time bucket
+# (weeks start on Monday), with the matching pandas frequency for gap filling
+TREND_BUCKETS = {
+    'hour': ("TIMESTAMP(DATE({col}), MAKETIME(HOUR({col}), 0, 0))", 'h'),
+    'day': ("DATE({col})", 'D'),
+    'week': ("DATE({col}) - INTERVAL WEEKDAY({col}) DAY", 'W-MON'),
+}
+
+
+class AssignmentConflict(Exception):
+    """A trip, driver or vehicle was no longer free when an assignment was attempted"""
+
+
+def values_table(columns, rows):
+    """Build a derived table of literal rows for multi-row UPDATE ... JOIN
+    
+    Returns (sql, params) where sql looks like
+    "SELECT %s AS a, %s AS b UNION ALL SELECT %s, %s", so a whole batch of
+    per-row values can be applied in one statement and one round trip.
+    """
+    first = "SELECT " + ", ".join(f"%s AS {column}" for column in columns)
+    rest = " UNION ALL SELECT " + ", ".join(["%s"] * len(columns))
+    sql = first + rest * (len(rows) - 1)
+    params = [value for row in rows for value in row]
+    return sql, params
+
+
+def fulltext_query(term):
+    """Turn free text into a BOOLEAN MODE query requiring every word as a prefix
+    
+    "rah sha" becomes "+rah* +sha*". Words shorter than the InnoDB minimum
+    token size are not in the index and are dropped; returns None when no
+    indexable word is left.
+    """
+    words = [w for w in re.findall(r'\w+', term or '') if len(w) >= FULLTEXT_MIN_TOKEN_SIZE]
+    if not words:
+        return None
+    return ' '.join(f'+{w}*' for w in words)
+
+
+class QueryFilter:
+    """Builds parameterized WHERE clauses from UI filter values
+    
+    Every method ignores empty values, so UI widgets can be passed straight
+    through, and returns self so conditions can be chained:
+    
+        f = QueryFilter().is_in('t.Status', statuses).since('t.Booking_Time', start)
+        db._fetch_page(..., where=f.clauses, params=f.params)
+    
+    Conditions compare bare indexed columns (no functions applied to them)
+    so MySQL can use the matching index for the range.
+    """
+    
+    def __init__(self):
+        self.clauses = []
+        self.params = []
+    
+    def _add(self, clause, *params):
+        self.clauses.append(clause)
+        self.params.extend(params)
+        return self
+    
+    @staticmethod
+    def _as_datetime(value, end_of_day=False):
+        """Widen a date to the start of that day (or of the next day)"""
+        if isinstance(value, date) and not isinstance(value, datetime):
+            value = datetime.combine(value, dt_time.min)
+            if end_of_day:
+                value += timedelta(days=1)
+        return value
+    
+    def equals(self, column, value):
+        """column = value"""
+        if value is None or value == '':
+            return self
+        return self._add(f"{column} = %s", value)
+    
+    def is_in(self, column, values):
+        """column IN (values)"""
+        values = list(values or [])
+        if not values:
+            return self
+        placeholders = ', '.join(['%s'] * len(values))
+        return self._add(f"{column} IN ({placeholders})", *values)
+    
+    def at_least(self, column, value):
+        """column >= value"""
+        if not value:
+            return self
+        return self._add(f"{column} >= %s", value)
+    
+    def since(self, column, start):
+        """column >= start (a date means from the start of that day)"""
+        if not start:
+            return self
+        return self._add(f"{column} >= %s", self._as_datetime(start))
+    
+    def until(self, column, end):
+        """column < end (a date means up to the end of that day)"""
+        if not end:
+            return self
+        return self._add(f"{column} < %s", self._as_datetime(end, end_of_day=True))
+    
+    def prefix(self, column, term):
+        """column LIKE 'term%' (can use an index on column)"""
+        if not term:
+            return self
+        return self._add(f"{column} LIKE %s", self._escape_like(term.strip()) + '%')
+    
+    def contains(self, columns, term):
+        """Any of columns LIKE '%term%' (case-insensitive under the default collation)"""
+        if not term:
+            return self
+        pattern = '%' + self._escape_like(term.strip()) + '%'
+        clause = " OR ".join(f"{column} LIKE %s" for column in columns)
+        return self._add(f"({clause})", *([pattern] * len(columns)))
+    
+    def fulltext(self, columns, term):
+        """MATCH(columns) AGAINST term, using the FULLTEXT index on columns
+        
+        Falls back to a prefix LIKE on each column when the term is too short
+        to be in the full-text index.
+        """
+        if not term:
+            return self
+        query = fulltext_query(term)
+        if query:
+            return self._add(f"MATCH({', '.join(columns)}) AGAINST (%s IN BOOLEAN MODE)", query)
+        pattern = self._escape_like(term.strip()) + '%'
+        clause = " OR ".join(f"{column} LIKE %s" for column in columns)
+        return self._add(f"({clause})", *([pattern] * len(columns)))
+    
+    def raw(self, clause, *params):
+        """Add a hand-written clause"""
+        return self._add(clause, *params)
+    
+    @staticmethod
+    def _escape_like(term):
+        return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of MySQL connections
+    
+    Up to `size` connections are kept open and reused. When all of them are
+    checked out, up to `max_overflow` extra connections may be opened; they are
+    closed again on release. Beyond that, callers wait up to `timeout` seconds
+    for a connection to be released before a PoolError is raised.
+    """
+    
+    def __init__(self, config, size=DB_POOL_SIZE, max_overflow=DB_POOL_MAX_OVERFLOW,
+                 timeout=DB_POOL_TIMEOUT, ping_after=DB_POOL_PING_AFTER):
+        self.config = config
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle = deque()        # (connection, released_at) pairs
+        self._open = 0              # idle + checked out connections
+        self._cond = threading.Condition()
+        self._closed = False
+        self.metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'overflow': 0,
+            'timeouts': 0,
+            'reconnects': 0,
+        }
+    
+    def _new_connection(self):
+        """Open a new physical connection"""
+        return mysql.connector.connect(**self.config)
+    
+    def _check_health(self, conn, released_at):
+        """Return a usable connection, replacing it if the server dropped it"""
+        if time.monotonic() - released_at < self.ping_after:
+            return conn
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except Error:
+            with self._cond:
+                self.metrics['reconnects'] += 1
+            try:
+                conn.close()
+            except Error:
+                pass
+            return self._new_connection()
+    
+    def acquire(self):
+        """Check out a connection, waiting for a free slot if necessary"""
+        start = time.monotonic()
+        waited = False
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed")
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    break
+                if self._open < self.size + self.max_overflow:
+                    if self._open >= self.size:
+                        self.metrics['overflow'] += 1
+                    self._open += 1
+                    break
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise PoolError(
+                        f"No database connection available within {self.timeout}s "
+                        f"(pool size {self.size}, overflow {self.max_overflow})")
+                waited = True
+                self._cond.wait(remaining)
+            self.metrics['checkouts'] += 1
+            if waited:
+                self.metrics['waits'] += 1
+                self.metrics['wait_time'] += time.monotonic() - start
+        
+        try:
+            if conn is None:
+                return self._new_connection()
+            return self._check_health(conn, released_at)
+        except Error:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+    
+    def release(self, conn):
+        """Return a connection to the pool, closing surplus or broken ones"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            reusable = conn.is_connected()
+        except Error:
+            reusable = False
+        
+        with self._cond:
+            if reusable and not self._closed and self._open <= self.size:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            else:
+                self._open -= 1
+            self._cond.notify()
+        
+        if conn is not None:
+            try:
+                conn.close()
+            except Error:
+                pass
+    
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a `with` block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        """Close all idle connections and refuse further checkouts"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            try:
+                conn.close()
+            except Error:
+                pass
+    
+    def stats(self):
+        """Snapshot of pool metrics and current occupancy"""
+        with self._cond:
+            stats = dict(self.metrics)
+            stats['size'] = self.size
+            stats['max_overflow'] = self.max_overflow
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open - len(self._idle)
+        stats['avg_wait_ms'] = (stats['wait_time'] / stats['waits'] * 1000) if stats['waits'] else 0.0
+        return stats
 
 
 class Database:
     """Database connection and operations handler"""
     
-    def __init__(self):
-        self.connection = None
-        self.cursor = None
+    def __init__(self, cache_backend=None):
+        self.pool = None
+        self._stats_cache = None
+        self._stats_cached_at = 0.0
+        self._cache_generation = 0
+        self._stats_lock = threading.Lock()
+        self._rollups_refreshed_at = None
+        self._rollups_unbuilt = []
+        self._rollup_lock = threading.Lock()
+        self.availability = AvailabilityIndex(self._load_available_drivers,
+                                              self._load_available_vehicles)
+        self.fares = FareEngine(self._load_fare_rates)
+        self.cache = EntityCache(cache_backend)
+        self.instrumentation = Instrumentation([QueryStats(), SlowQueryLog(self._explain)],
+                                               enabled=QUERY_INSTRUMENTATION)
     
     def connect(self):
-        """Establish database connection"""
+        """Create the connection pool and verify the database is reachable"""
         try:
-            self.connection = mysql.connector.connect(**DB_CONFIG)
-            if self.connection.is_connected():
-                self.cursor = self.connection.cursor(dictionary=True)
-                return True
+            if self.pool is None:
+                self.pool = ConnectionPool(DB_CONFIG)
+            with self.pool.connection():
+                pass
+            return True
         except Error as e:
             st.error(f"Database connection error: {e}")
             return False
     
     def disconnect(self):
-        """Close database connection"""
-        if self.connection and self.connection.is_connected():
-            if self.cursor:
-                self.cursor.close()
-            self.connection.close()
+        """Close all pooled connections"""
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+    
+    def _connection(self):
+        """Check out a pooled connection (use as a context manager)"""
+        if self.pool is None:
+            self.pool = ConnectionPool(DB_CONFIG)
+        return self.pool.connection()
+    
+    @contextmanager
+    def _timed(self, query, params):
+        """Time one query and report it to the instrumentation hooks
+        
+        Yields a dict the caller fills with 'rows' and/or 'result'. The
+        reporting method is named when the block is entered.
+        """
+        method = caller_name()
+        outcome = {'rows': 0, 'result': None, 'error': None}
+        started = time.perf_counter()
+        try:
+            yield outcome
+        except BaseException as e:
+            outcome['error'] = e
+            raise
+        finally:
+            self.instrumentation.record(method, query, params,
+                                        time.perf_counter() - started, **outcome)
+    
+    def _explain(self, query, params):
+        """EXPLAIN a query on its own connection (not instrumented)"""
+        with self._connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute("EXPLAIN " + query, params or ())
+                return cursor.fetchall()
+            finally:
+                cursor.close()
     
     def execute_query(self, query, params=None, fetch=False):
         """Execute a query and return results"""
         try:
-            if not self.connection or not self.connection.is_connected():
-                self.connect()
-            
-            self.cursor.execute(query, params or ())
-            
-            if fetch:
-                return self.cursor.fetchall()
-            else:
-                self.connection.commit()
-                return self.cursor.lastrowid
+            with self._connection() as conn, self._timed(query, params) as timing:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    cursor.execute(query, params or ())
+                    
+                    if fetch:
+                        timing['result'] = cursor.fetchall()
+                        timing['rows'] = len(timing['result'])
+                        return timing['result']
+                    else:
+                        timing['rows'] = max(cursor.rowcount, 0)
+                        conn.commit()
+                        self._invalidate_caches()
+                        return cursor.lastrowid
+                except Error:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
                 
         except Error as e:
             st.error(f"Query execution error: {e}")
-            self.connection.rollback()
             return None
     
     def fetch_dataframe(self, query, params=None):
         """Execute query and return pandas DataFrame"""
         try:
-            if not self.connection or not self.connection.is_connected():
-                self.connect()
-            
-            return pd.read_sql(query, self.connection, params=params)
+            with self._connection() as conn, self._timed(query, params) as timing:
+                timing['result'] = pd.read_sql(query, conn, params=params)
+                return timing['result']
         except Error as e:
             st.error(f"DataFrame fetch error: {e}")
             return pd.DataFrame()
     
+    def _execute_with_event(self, query, params, entity, event_type, entity_id=None):
+        """Execute one Trip or Payment write and log its ChangeEvent in the same transaction
+        
+        Inserts are logged for the new row, other writes for entity_id
+        (deletions before the row goes). Returns what execute_query would
+        (the new row's ID, 0 for other writes), or None on database errors.
+        """
+        try:
+            with self.transaction() as cursor:
+                if event_type == 'deleted':
+                    record_event(cursor, entity, event_type, [entity_id])
+                cursor.execute(query, params)
+                row_id = cursor.lastrowid
+                if event_type != 'deleted':
+                    record_event(cursor, entity, event_type, [entity_id or row_id])
+            return row_id
+        except Error as e:
+            st.error(f"Query execution error: {e}")
+            return None
+    
+    @contextmanager
+    def transaction(self, invalidate_caches=True):
+        """Run several statements atomically on one pooled connection
+        
+        Yields a dictionary cursor. Commits when the block exits normally and
+        rolls back (re-raising the error) otherwise, so callers decide how to
+        report failures. Writes that cannot change any cached read (such as
+        driver positions) pass invalidate_caches=False. Every statement is
+        reported to the instrumentation hooks under the calling method's name.
+        
+        A transaction still open OUTBOX_MAX_TRANSACTION_SECONDS after it
+        logged its first change event is rolled back instead of committed:
+        change-event consumers may already have skipped that event's ID.
+        """
+        method = caller_name()
+        with self._connection() as conn:
+            instrumented = InstrumentedCursor(conn.cursor(dictionary=True), self.instrumentation, method)
+            try:
+                conn.start_transaction()
+                yield instrumented
+                logged_at = getattr(instrumented, 'events_logged_at', None)
+                if logged_at is not None and time.monotonic() - logged_at > OUTBOX_MAX_TRANSACTION_SECONDS:
+                    raise Error(msg=f"Transaction held change events for more than "
+                                    f"{OUTBOX_MAX_TRANSACTION_SECONDS:g} s and was rolled back")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                instrumented.close()
+        if invalidate_caches:
+            self._invalidate_caches()
+    
+    def _invalidate_caches(self):
+        """Drop cached read results after a committed write"""
+        with self._stats_lock:
+            self._stats_cache = None
+            self._cache_generation += 1
+    
+    def stream_query(self, query, params=None, chunk_size=10000):
+        """Yield (description, rows) chunks from an unbuffered (server-side) cursor
+        
+        Rows are pulled from the server `chunk_size` at a time, so memory use
+        is bounded by one chunk no matter how large the result is. The pooled
+        connection is held until the generator is exhausted or closed. Errors
+        propagate to the caller.
+        """
+        with self._connection() as conn, self._timed(query, params) as timing:
+            cursor = conn.cursor(buffered=False)
+            try:
+                cursor.execute(query, params or ())
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    timing['rows'] += len(rows)
+                    yield cursor.description, rows
+            finally:
+                if conn.unread_result:
+                    conn.consume_results()
+                cursor.close()
+    
+    def _fetch_row(self, query, params):
+        """First row of a query, or None when there is none or it failed"""
+        result = self.execute_query(query, params, fetch=True)
+        return result[0] if result else None
+    
+    @staticmethod
+    def _to_param(value):
+        """Convert pandas/numpy scalars to types the MySQL connector accepts"""
+        if isinstance(value, pd.Timestamp):
+            return value.to_pydatetime()
+        if hasattr(value, 'item'):
+            return value.item()
+        return value
+    
+    def _fetch_page(self, query, sort_column, id_column, count_from, cursor=None,
+                    page_size=None, where=None, params=None):
+        """Fetch one page of `query` newest-first using keyset (seek) pagination
+        
+        `query` must contain a `{where}` placeholder followed by an `{order}`
+        placeholder; the helper fills in the filter clauses, the seek predicate
+        on (sort_column, id_column) and ORDER BY ... LIMIT. Because the seek
+        predicate only walks the (sort_column, id_column) index, every page
+        costs the same no matter how deep the user pages.
+        """
+        page_size = page_size or RECORDS_PER_PAGE
+        clauses = list(where or [])
+        params = list(params or [])
+        total, total_exact = self._estimate_count(count_from, clauses, params)
+        total_at_least = bool(clauses) and not total_exact
+        
+        if cursor is not None:
+            clauses.append(f"({sort_column} < %s OR ({sort_column} = %s AND {id_column} < %s))")
+            params += [cursor[0], cursor[0], cursor[1]]
+        
+        where_sql = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        order_sql = f"ORDER BY {sort_column} DESC, {id_column} DESC LIMIT %s"
+        df = self.fetch_dataframe(query.format(where=where_sql, order=order_sql),
+                                  tuple(params + [page_size + 1]))
+        
+        sort_name = sort_column.split('.')[-1]
+        id_name = id_column.split('.')[-1]
+        next_cursor = None
+        if not df.empty:
+            # Rows may repeat an id (one-to-many joins), so page by distinct ids
+            ids = df[id_name].drop_duplicates()
+            if len(ids) > page_size:
+                df = df[df[id_name].isin(ids.iloc[:page_size])]
+                last = df.iloc[-1]
+                next_cursor = (self._to_param(last[sort_name]), self._to_param(last[id_name]))
+        return Page(df.reset_index(drop=True), next_cursor, total, total_exact, total_at_least)
+    
+    def _estimate_count(self, count_from, where=None, params=None):
+        """Count matching rows exactly up to COUNT_ESTIMATE_CAP, estimate beyond it
+        
+        Returns (count, is_exact). Past the cap an unfiltered count comes from
+        the InnoDB table statistics, so large tables never pay for a full
+        COUNT(*). The statistics know nothing about `where`, so a filtered
+        count past the cap is returned as COUNT_ESTIMATE_CAP, a lower bound.
+        """
+        where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+        query = f"""
+            SELECT COUNT(*) AS count FROM (
+                SELECT 1 FROM {count_from} {where_sql} LIMIT %s
+            ) capped
+        """
+        result = self.execute_query(query, tuple(list(params or []) + [COUNT_ESTIMATE_CAP + 1]),
+                                    fetch=True)
+        count = result[0]['count'] if result else 0
+        if count <= COUNT_ESTIMATE_CAP:
+            return count, True
+        if where:
+            return COUNT_ESTIMATE_CAP, False
+        
+        table = count_from.split()[0]
+        stats = self.execute_query("""
+            SELECT TABLE_ROWS AS count FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (table,), fetch=True)
+        estimate = stats[0]['count'] if stats and stats[0]['count'] else 0
+        return max(int(estimate), count), False
+    
+    def get_pool_metrics(self):
+        """Get connection pool metrics (checkouts, waits, wait time, overflow)"""
+        return self.pool.stats() if self.pool else {}
+    
     # ==================== USER OPERATIONS ====================
     
     def create_user(self, first_name, last_name, phone, email):
@@ -71,7 +612,9 @@ class Database:
             INSERT INTO User (First_Name, Last_Name, Phone_Number, Email)
             VALUES (%s, %s, %s, %s)
         """
-        return self.execute_query(query, (first_name, last_name, phone, email))
+        result = self.execute_query(query, (first_name, last_name, phone, email))
+        self.cache.invalidate('User', 'list')
+        return result
     
     def get_all_users(self):
         """Get all users"""
@@ -83,11 +626,65 @@ class Database:
         """
         return self.fetch_dataframe(query)
     
+    def get_users_page(self, cursor=None, page_size=None, name=None, phone=None, email=None):
+        """Get one page of users, newest registrations first, optionally filtered"""
+        filters = (QueryFilter()
+                   .fulltext(['u.First_Name', 'u.Last_Name'], name)
+                   .prefix('u.Phone_Number', phone)
+                   .prefix('u.Email', email))
+        query = """
+            SELECT User_ID, First_Name, Last_Name, Phone_Number, Email, 
+                   Registration_Date, Last_Login
+            FROM User u
+            {where}
+            {order}
+        """
+        return self._fetch_page(query, 'u.Registration_Date', 'u.User_ID', 'User u',
+                                cursor=cursor, page_size=page_size,
+                                where=filters.clauses, params=filters.params)
+    
+    def search_users(self, term, by='Name', limit=None):
+        """Search users by name (ranked full-text), phone prefix or email prefix"""
+        limit = limit or SEARCH_RESULT_LIMIT
+        columns = """User_ID, First_Name, Last_Name, Phone_Number, Email,
+                     Registration_Date, Last_Login"""
+        
+        if by == 'Name':
+            ft_query = fulltext_query(term)
+            if ft_query:
+                query = f"""
+                    SELECT {columns},
+                           MATCH(First_Name, Last_Name) AGAINST (%s IN BOOLEAN MODE) AS Relevance
+                    FROM User
+                    WHERE MATCH(First_Name, Last_Name) AGAINST (%s IN BOOLEAN MODE)
+                    ORDER BY Relevance DESC, User_ID DESC
+                    LIMIT %s
+                """
+                return self.fetch_dataframe(query, (ft_query, ft_query, limit))
+            filters = QueryFilter().fulltext(['First_Name', 'Last_Name'], term)
+            order = "First_Name, Last_Name"
+        elif by == 'Phone':
+            filters = QueryFilter().prefix('Phone_Number', term)
+            order = "Phone_Number"
+        else:
+            filters = QueryFilter().prefix('Email', term)
+            order = "Email"
+        
+        if not filters.clauses:
+            return pd.DataFrame()
+        query = f"""
+            SELECT {columns}
+            FROM User
+            WHERE {' AND '.join(filters.clauses)}
+            ORDER BY {order}
+            LIMIT %s
+        """
+        return self.fetch_dataframe(query, tuple(filters.params + [limit]))
+    
     def get_user_by_id(self, user_id):
-        """Get user by ID"""
+        """Get user by ID (cached until the user is changed)"""
         query = "SELECT * FROM User WHERE User_ID = %s"
-        result = self.execute_query(query, (user_id,), fetch=True)
-        return result[0] if result else None
+        return self.cache.get('User', user_id, lambda: self._fetch_row(query, (user_id,)))
     
     def update_user(self, user_id, first_name, last_name, phone, email):
         """Update user details"""
@@ -96,12 +693,17 @@ class Database:
             SET First_Name = %s, Last_Name = %s, Phone_Number = %s, Email = %s
             WHERE User_ID = %s
         """
-        return self.execute_query(query, (first_name, last_name, phone, email, user_id))
+        result = self.execute_query(query, (first_name, last_name, phone, email, user_id))
+        self.cache.invalidate('User', user_id, 'list')
+        return result
     
     def delete_user(self, user_id):
         """Delete user"""
         query = "DELETE FROM User WHERE User_ID = %s"
-        return self.execute_query(query, (user_id,))
+        result = self.execute_query(query, (user_id,))
+        self.cache.invalidate('User', user_id, 'list')
+        self.cache.invalidate('Trip')    # Trip.User_ID is set to NULL
+        return result
     
     # ==================== DRIVER OPERATIONS ====================
     
@@ -111,7 +713,9 @@ class Database:
             INSERT INTO Driver (First_Name, Last_Name, Phone_Number, License_Number, Status)
             VALUES (%s, %s, %s, %s, %s)
         """
-        return self.execute_query(query, (first_name, last_name, phone, license_number, status))
+        result = self.execute_query(query, (first_name, last_name, phone, license_number, status))
+        self.availability.invalidate()
+        return result
     
     def get_all_drivers(self):
         """Get all drivers with vehicle info"""
@@ -127,11 +731,37 @@ class Database:
         """
         return self.fetch_dataframe(query)
     
+    def get_drivers_page(self, cursor=None, page_size=None, statuses=None, min_rating=None,
+                         name=None):
+        """Get one page of drivers with vehicle info, newest first, optionally filtered"""
+        filters = (QueryFilter()
+                   .is_in('d.Status', statuses)
+                   .at_least('d.Rating', min_rating)
+                   .fulltext(['d.First_Name', 'd.Last_Name'], name))
+        # Page over Driver alone, then join, so a driver with several
+        # vehicles is never split across two pages
+        query = """
+            SELECT 
+                d.Driver_ID, d.First_Name, d.Last_Name, d.Phone_Number,
+                d.License_Number, d.Rating, d.Status, d.Join_Date,
+                v.Vehicle_Number, v.Make, v.Model, vt.Vehicle_Type
+            FROM (
+                SELECT * FROM Driver d
+                {where}
+                {order}
+            ) d
+            LEFT JOIN Vehicle v ON d.Driver_ID = v.Driver_ID
+            LEFT JOIN VehicleType vt ON v.Vehicle_Type = vt.Vehicle_Type
+            ORDER BY d.Join_Date DESC, d.Driver_ID DESC
+        """
+        return self._fetch_page(query, 'd.Join_Date', 'd.Driver_ID', 'Driver d',
+                                cursor=cursor, page_size=page_size,
+                                where=filters.clauses, params=filters.params)
+    
     def get_driver_by_id(self, driver_id):
-        """Get driver by ID"""
+        """Get driver by ID (cached until the driver is changed)"""
         query = "SELECT * FROM Driver WHERE Driver_ID = %s"
-        result = self.execute_query(query, (driver_id,), fetch=True)
-        return result[0] if result else None
+        return self.cache.get('Driver', driver_id, lambda: self._fetch_row(query, (driver_id,)))
     
     def update_driver(self, driver_id, first_name, last_name, phone, license_number, status, rating=None):
         """Update driver details"""
@@ -141,28 +771,89 @@ class Database:
                 License_Number = %s, Status = %s, Rating = %s
             WHERE Driver_ID = %s
         """
-        return self.execute_query(query, (first_name, last_name, phone, license_number, 
-                                         status, rating, driver_id))
+        result = self.execute_query(query, (first_name, last_name, phone, license_number, 
+                                           status, rating, driver_id))
+        self.cache.invalidate('Driver', driver_id)
+        self.availability.invalidate()
+        return result
     
     def delete_driver(self, driver_id):
         """Delete driver"""
         query = "DELETE FROM Driver WHERE Driver_ID = %s"
-        return self.execute_query(query, (driver_id,))
+        result = self.execute_query(query, (driver_id,))
+        self.cache.invalidate('Driver', driver_id)
+        self.cache.invalidate('Vehicle')    # Vehicle.Driver_ID and Trip.Driver_ID are set to NULL
+        self.cache.invalidate('Trip')
+        self.availability.invalidate()
+        return result
     
     def get_available_drivers(self):
-        """Get available drivers not on active trip"""
+        """Get available drivers not on active trip (served from the availability index)"""
+        return self.availability.drivers()
+    
+    def _load_available_drivers(self):
+        """Query free active drivers for the availability index"""
         query = """
-            SELECT d.Driver_ID, CONCAT(d.First_Name, ' ', d.Last_Name, ' - ', d.Phone_Number) AS driver_info
+            SELECT d.Driver_ID, CONCAT(d.First_Name, ' ', d.Last_Name, ' - ', d.Phone_Number) AS driver_info,
+                   d.Rating, d.Current_Lat, d.Current_Lon
             FROM Driver d
             WHERE d.Status = 'Active'
-              AND d.Driver_ID NOT IN (
-                  SELECT Driver_ID FROM Trip 
-                  WHERE Status IN ('Accepted', 'In_Progress') AND Driver_ID IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM Trip t
+                  WHERE t.Driver_ID = d.Driver_ID AND t.Status IN ('Accepted', 'In_Progress')
               )
             ORDER BY d.Rating DESC
         """
         return self.execute_query(query, fetch=True)
     
+    def get_nearest_drivers(self, lat, lon, k=5, max_km=None):
+        """Get up to k free drivers nearest to a point as (driver, distance_km), closest first"""
+        if lat is None or lon is None:
+            return []
+        return self.availability.nearest_drivers(float(lat), float(lon), k, max_km)
+    
+    def update_driver_location(self, driver_id, lat=None, lon=None, location=None):
+        """Update a driver's current position
+        
+        Without coordinates the location name is geocoded with the offline
+        gazetteer. The spatial index is updated in place.
+        """
+        if (lat is None or lon is None) and location:
+            lat, lon = geocode(location)
+        query = """
+            UPDATE Driver
+            SET Current_Active_Location = COALESCE(%s, Current_Active_Location),
+                Current_Lat = %s, Current_Lon = %s, Location_Updated_At = NOW()
+            WHERE Driver_ID = %s
+        """
+        result = self.execute_query(query, (location, lat, lon, driver_id))
+        self.cache.invalidate('Driver', driver_id)
+        if result is not None:
+            self.availability.move_driver(driver_id, lat, lon)
+        return result
+    
+    def record_driver_locations(self, pings, chunk_size=LOCATION_FLUSH_CHUNK):
+        """Write a batch of (driver_id, lat, lon, seen_at) pings in one transaction
+        
+        Multi-row UPDATE ... JOIN statements of `chunk_size` rows each set the
+        position, Location_Updated_At and Last_Active. A ping older than the
+        stored position is ignored. Errors propagate so the caller can retry.
+        """
+        with self.transaction(invalidate_caches=False) as cursor:
+            for start in range(0, len(pings), chunk_size):
+                rows_sql, params = values_table(['Driver_ID', 'Lat', 'Lon', 'Seen_At'],
+                                                pings[start:start + chunk_size])
+                cursor.execute(f"""
+                    UPDATE Driver d
+                    JOIN ({rows_sql}) p ON d.Driver_ID = p.Driver_ID
+                    SET d.Current_Lat = p.Lat, d.Current_Lon = p.Lon,
+                        d.Location_Updated_At = p.Seen_At,
+                        d.Last_Active = GREATEST(COALESCE(d.Last_Active, p.Seen_At), p.Seen_At)
+                    WHERE d.Location_Updated_At IS NULL OR d.Location_Updated_At <= p.Seen_At
+                """, tuple(params))
+        self.cache.invalidate('Driver', *{ping[0] for ping in pings})
+        return len(pings)
+    
     # ==================== VEHICLE OPERATIONS ====================
     
     def create_vehicle(self, driver_id, vehicle_type, vehicle_number, make, model, year, status='Available'):
@@ -171,8 +862,10 @@ class Database:
             INSERT INTO Vehicle (Driver_ID, Vehicle_Type, Vehicle_Number, Make, Model, Year, Status, Assignment_Date)
             VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
         """
-        return self.execute_query(query, (driver_id, vehicle_type, vehicle_number, 
-                                         make, model, year, status))
+        result = self.execute_query(query, (driver_id, vehicle_type, vehicle_number, 
+                                           make, model, year, status))
+        self.availability.invalidate()
+        return result
     
     def get_all_vehicles(self):
         """Get all vehicles"""
@@ -189,16 +882,53 @@ class Database:
         """
         return self.fetch_dataframe(query)
     
+    def get_vehicles_page(self, cursor=None, page_size=None, statuses=None, vehicle_types=None):
+        """Get one page of vehicles, newest registrations first, optionally filtered"""
+        filters = (QueryFilter()
+                   .is_in('v.Status', statuses)
+                   .is_in('v.Vehicle_Type', vehicle_types))
+        query = """
+            SELECT 
+                v.Vehicle_ID, v.Vehicle_Number, v.Make, v.Model, v.Year,
+                vt.Vehicle_Type, vt.Standard_Capacity, v.Status,
+                CONCAT(d.First_Name, ' ', d.Last_Name) AS Driver_Name,
+                d.Phone_Number AS Driver_Phone, v.Registration_Date
+            FROM Vehicle v
+            JOIN VehicleType vt ON v.Vehicle_Type = vt.Vehicle_Type
+            LEFT JOIN Driver d ON v.Driver_ID = d.Driver_ID
+            {where}
+            {order}
+        """
+        return self._fetch_page(query, 'v.Registration_Date', 'v.Vehicle_ID', 'Vehicle v',
+                                cursor=cursor, page_size=page_size,
+                                where=filters.clauses, params=filters.params)
+    
     def get_vehicle_types(self):
-        """Get all vehicle types"""
+        """Get all vehicle types
+        
+        VehicleType is reference data, so it is cached with no expiry; call
+        cache.invalidate('VehicleType') after editing it by hand.
+        """
         query = "SELECT Vehicle_Type, Standard_Capacity, Base_Fare_Per_Km FROM VehicleType"
-        return self.execute_query(query, fetch=True)
+        return self.cache.get('VehicleType', 'list',
+                              lambda: self.execute_query(query, fetch=True), ttl=0)
+    
+    def _load_fare_rates(self):
+        """Vehicle_Type -> Base_Fare_Per_Km for the fare engine (None on error)
+        
+        Read straight from VehicleType rather than through get_vehicle_types(),
+        whose cache never expires: the engine's own FARE_RATES_REFRESH_SECONDS
+        reload must see rate changes made in the database.
+        """
+        rows = self.execute_query("SELECT Vehicle_Type, Base_Fare_Per_Km FROM VehicleType", fetch=True)
+        if rows is None:
+            return None
+        return {row['Vehicle_Type']: row['Base_Fare_Per_Km'] for row in rows}
     
     def get_vehicle_by_id(self, vehicle_id):
-        """Get vehicle by ID"""
+        """Get vehicle by ID (cached until the vehicle is changed)"""
         query = "SELECT * FROM Vehicle WHERE Vehicle_ID = %s"
-        result = self.execute_query(query, (vehicle_id,), fetch=True)
-        return result[0] if result else None
+        return self.cache.get('Vehicle', vehicle_id, lambda: self._fetch_row(query, (vehicle_id,)))
     
     def update_vehicle(self, vehicle_id, driver_id, vehicle_type, vehicle_number, 
                       make, model, year, status):
@@ -209,19 +939,31 @@ class Database:
                 Make = %s, Model = %s, Year = %s, Status = %s
             WHERE Vehicle_ID = %s
         """
-        return self.execute_query(query, (driver_id, vehicle_type, vehicle_number, 
-                                         make, model, year, status, vehicle_id))
+        result = self.execute_query(query, (driver_id, vehicle_type, vehicle_number, 
+                                           make, model, year, status, vehicle_id))
+        self.cache.invalidate('Vehicle', vehicle_id)
+        self.availability.invalidate()
+        return result
     
     def delete_vehicle(self, vehicle_id):
         """Delete vehicle"""
         query = "DELETE FROM Vehicle WHERE Vehicle_ID = %s"
-        return self.execute_query(query, (vehicle_id,))
+        result = self.execute_query(query, (vehicle_id,))
+        self.cache.invalidate('Vehicle', vehicle_id)
+        self.cache.invalidate('Trip')    # Trip.Vehicle_ID is set to NULL
+        self.availability.invalidate()
+        return result
     
     def get_available_vehicles(self):
-        """Get available vehicles"""
+        """Get available vehicles (served from the availability index)"""
+        return self.availability.vehicles()
+    
+    def _load_available_vehicles(self):
+        """Query available vehicles for the availability index"""
         query = """
             SELECT v.Vehicle_ID, 
-                   CONCAT(v.Vehicle_Number, ' - ', v.Make, ' ', v.Model, ' (', vt.Vehicle_Type, ')') AS vehicle_info
+                   CONCAT(v.Vehicle_Number, ' - ', v.Make, ' ', v.Model, ' (', vt.Vehicle_Type, ')') AS vehicle_info,
+                   v.Driver_ID, vt.Vehicle_Type
             FROM Vehicle v
             JOIN VehicleType vt ON v.Vehicle_Type = vt.Vehicle_Type
             WHERE v.Status = 'Available'
@@ -232,12 +974,17 @@ class Database:
     # ==================== TRIP OPERATIONS ====================
     
     def create_trip(self, user_id, pickup_location, dropoff_location):
-        """Create new trip"""
+        """Create new trip (locations are geocoded with the offline gazetteer)"""
+        pickup_lat, pickup_lon = geocode(pickup_location)
+        dropoff_lat, dropoff_lon = geocode(dropoff_location)
         query = """
-            INSERT INTO Trip (User_ID, Pickup_Location, Dropoff_Location, Status)
-            VALUES (%s, %s, %s, 'Pending')
+            INSERT INTO Trip (User_ID, Pickup_Location, Dropoff_Location,
+                              Pickup_Lat, Pickup_Lon, Dropoff_Lat, Dropoff_Lon, Status)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, 'Pending')
         """
-        return self.execute_query(query, (user_id, pickup_location, dropoff_location))
+        return self._execute_with_event(query, (user_id, pickup_location, dropoff_location,
+                                                pickup_lat, pickup_lon, dropoff_lat, dropoff_lon),
+                                        'Trip', 'created')
     
     def get_all_trips(self):
         """Get all trips with details"""
@@ -258,59 +1005,177 @@ class Database:
         """
         return self.fetch_dataframe(query)
     
+    def get_trips_page(self, cursor=None, page_size=None, statuses=None,
+                       booked_from=None, booked_to=None, name=None, location=None):
+        """Get one page of trips with details, newest bookings first, optionally filtered"""
+        filters = (QueryFilter()
+                   .is_in('t.Status', statuses)
+                   .since('t.Booking_Time', booked_from)
+                   .until('t.Booking_Time', booked_to)
+                   .fulltext(['t.Pickup_Location', 't.Dropoff_Location'], location))
+        if name:
+            # Match user or driver names through their primary keys so the
+            # filter only references Trip columns (and the count needs no joins)
+            users = QueryFilter().fulltext(['First_Name', 'Last_Name'], name)
+            drivers = QueryFilter().fulltext(['First_Name', 'Last_Name'], name)
+            filters.raw(f"""(t.User_ID IN (SELECT User_ID FROM User WHERE {users.clauses[0]})
+                          OR t.Driver_ID IN (SELECT Driver_ID FROM Driver WHERE {drivers.clauses[0]}))""",
+                        *(users.params + drivers.params))
+        query = """
+            SELECT 
+                t.Trip_ID, t.Status,
+                CONCAT(u.First_Name, ' ', u.Last_Name) AS User_Name,
+                CONCAT(d.First_Name, ' ', d.Last_Name) AS Driver_Name,
+                v.Vehicle_Number,
+                t.Pickup_Location, t.Dropoff_Location,
+                t.Booking_Time, t.Pickup_Time, t.Dropoff_Time,
+                t.Distance, t.Fare
+            FROM Trip t
+            LEFT JOIN User u ON t.User_ID = u.User_ID
+            LEFT JOIN Driver d ON t.Driver_ID = d.Driver_ID
+            LEFT JOIN Vehicle v ON t.Vehicle_ID = v.Vehicle_ID
+            {where}
+            {order}
+        """
+        return self._fetch_page(query, 't.Booking_Time', 't.Trip_ID', 'Trip t',
+                                cursor=cursor, page_size=page_size,
+                                where=filters.clauses, params=filters.params)
+    
     def get_trip_by_id(self, trip_id):
-        """Get trip by ID"""
+        """Get trip by ID (cached until the trip is changed)"""
         query = "SELECT * FROM Trip WHERE Trip_ID = %s"
+        return self.cache.get('Trip', trip_id, lambda: self._fetch_row(query, (trip_id,)))
+    
+    def quote_fare(self, trip_id, distance=None, dropoff_time=None):
+        """Price a trip with the fare engine
+        
+        Uses the trip's stored distance and dropoff time unless given; returns
+        None when the trip, its vehicle type or the distance is unknown.
+        """
+        query = """
+            SELECT v.Vehicle_Type, t.Distance, t.Pickup_Time, t.Dropoff_Time
+            FROM Trip t
+            LEFT JOIN Vehicle v ON t.Vehicle_ID = v.Vehicle_ID
+            WHERE t.Trip_ID = %s
+        """
         result = self.execute_query(query, (trip_id,), fetch=True)
-        return result[0] if result else None
+        if not result:
+            return None
+        trip = result[0]
+        return self.fares.quote(trip['Vehicle_Type'],
+                                distance if distance is not None else trip['Distance'],
+                                trip['Pickup_Time'],
+                                dropoff_time or trip['Dropoff_Time'] or datetime.now())
+    
+    def transition_trips(self, events):
+        """Apply a batch of TripEvents through the trip lifecycle
+        
+        Returns a lifecycle.TransitionResult (applied Trip_IDs and rejected
+        events with reasons), or None on database errors.
+        """
+        try:
+            return apply_transitions(self, events)
+        except Error as e:
+            st.error(f"Trip transition error: {e}")
+            return None
+    
+    def _transition_trip(self, event):
+        """Apply one TripEvent; True on success, None if rejected (shown) or failed"""
+        result = self.transition_trips([event])
+        if result is None:
+            return None
+        if result.rejected:
+            st.error(result.rejected[0][1])
+            return None
+        return True
     
     def update_trip_status(self, trip_id, status, driver_id=None, vehicle_id=None, 
                           distance=None, fare=None):
-        """Update trip status and details"""
-        query = """
-            UPDATE Trip 
-            SET Status = %s, Driver_ID = %s, Vehicle_ID = %s, Distance = %s, Fare = %s
-            WHERE Trip_ID = %s
+        """Move a trip to a new status through the trip lifecycle
+        
+        driver_id and vehicle_id are only used when accepting a trip, and
+        distance and fare when completing one; other stored values are kept.
+        A trip completed with a distance but no fare is priced by the fare
+        engine.
         """
-        return self.execute_query(query, (status, driver_id, vehicle_id, distance, fare, trip_id))
+        return self._transition_trip(TripEvent(trip_id, status, driver_id, vehicle_id, distance, fare))
     
     def assign_driver_vehicle(self, trip_id, driver_id, vehicle_id):
-        """Assign driver and vehicle to trip"""
-        query = """
-            UPDATE Trip 
-            SET Driver_ID = %s, Vehicle_ID = %s, Status = 'Accepted', Pickup_Time = NOW()
-            WHERE Trip_ID = %s
+        """Atomically assign a free driver and vehicle to a pending trip
+        
+        The trip, driver and vehicle rows are locked with SELECT ... FOR UPDATE
+        (always in that order, as the dispatcher does, to avoid deadlocks) and
+        re-checked before Trip, Vehicle and Driver are updated together. This
+        keeps several app replicas from double-booking a driver or vehicle.
+        
+        Returns True on success, raises AssignmentConflict if any of the three
+        is no longer free, and returns None on database errors.
         """
-        return self.execute_query(query, (driver_id, vehicle_id, trip_id))
+        try:
+            result = apply_transitions(self, [TripEvent(trip_id, 'Accepted', driver_id, vehicle_id)])
+        except Error as e:
+            st.error(f"Trip assignment error: {e}")
+            return None
+        if result.rejected:
+            raise AssignmentConflict(result.rejected[0][1])
+        return True
     
-    def complete_trip(self, trip_id, distance, fare):
-        """Complete trip"""
-        query = """
-            UPDATE Trip 
-            SET Status = 'Completed', Dropoff_Time = NOW(), Distance = %s, Fare = %s
-            WHERE Trip_ID = %s
+    def start_trip(self, trip_id):
+        """Mark an accepted trip In_Progress, stamping the pickup time"""
+        return self._transition_trip(TripEvent(trip_id, 'In_Progress'))
+    
+    def complete_trip(self, trip_id, distance, fare=None):
+        """Complete a trip in progress and release its vehicle
+        
+        Without an explicit fare the trip is priced by the fare engine from
+        the distance, ride time, vehicle type and pickup hour.
         """
-        return self.execute_query(query, (distance, fare, trip_id))
+        return self._transition_trip(TripEvent(trip_id, 'Completed', distance=distance, fare=fare))
+    
+    def cancel_trip(self, trip_id):
+        """Cancel a trip that has not completed, releasing its vehicle"""
+        return self._transition_trip(TripEvent(trip_id, 'Cancelled'))
     
     def delete_trip(self, trip_id):
         """Delete trip"""
         query = "DELETE FROM Trip WHERE Trip_ID = %s"
-        return self.execute_query(query, (trip_id,))
+        result = self._execute_with_event(query, (trip_id,), 'Trip', 'deleted', trip_id)
+        self.cache.invalidate('Trip', trip_id)
+        self.availability.invalidate()
+        return result
     
     def get_users_list(self):
-        """Get users for dropdown"""
+        """Get users for dropdown (cached until a user is added, changed or deleted)"""
         query = "SELECT User_ID, CONCAT(First_Name, ' ', Last_Name, ' - ', Phone_Number) AS user_info FROM User"
-        return self.execute_query(query, fetch=True)
+        return self.cache.get('User', 'list', lambda: self.execute_query(query, fetch=True))
     
     # ==================== PAYMENT OPERATIONS ====================
     
-    def create_payment(self, trip_id, amount, payment_mode, payment_status='Pending'):
-        """Create payment"""
+    def create_payment(self, trip_id, amount, payment_mode, payment_status='Pending',
+                       reference_number=None):
+        """Create payment
+        
+        A payment created as Completed without a reference gets the generated
+        one settlement would give it (see settlement.reference_for).
+        """
         query = """
-            INSERT INTO Payment (Trip_ID, Amount, Payment_Mode, Payment_Status)
-            VALUES (%s, %s, %s, %s)
+            INSERT INTO Payment (Trip_ID, Amount, Payment_Mode, Payment_Status, Reference_Number)
+            VALUES (%s, %s, %s, %s, %s)
         """
-        return self.execute_query(query, (trip_id, amount, payment_mode, payment_status))
+        params = (trip_id, amount, payment_mode, payment_status, reference_number or None)
+        if payment_status != 'Completed' or reference_number:
+            return self._execute_with_event(query, params, 'Payment', 'created')
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(query, params)
+                payment_id = cursor.lastrowid
+                cursor.execute("UPDATE Payment SET Reference_Number = %s WHERE Payment_ID = %s",
+                               (reference_for(payment_id), payment_id))
+                record_event(cursor, 'Payment', 'created', [payment_id])
+            return payment_id
+        except Error as e:
+            st.error(f"Query execution error: {e}")
+            return None
     
     def get_all_payments(self):
         """Get all payments"""
@@ -327,73 +1192,169 @@ class Database:
         """
         return self.fetch_dataframe(query)
     
+    def get_payments_page(self, cursor=None, page_size=None, statuses=None, modes=None,
+                          paid_from=None, paid_to=None):
+        """Get one page of payments, most recent first, optionally filtered"""
+        filters = (QueryFilter()
+                   .is_in('p.Payment_Status', statuses)
+                   .is_in('p.Payment_Mode', modes)
+                   .since('p.Payment_DateTime', paid_from)
+                   .until('p.Payment_DateTime', paid_to))
+        query = """
+            SELECT 
+                p.Payment_ID, p.Trip_ID, p.Amount, p.Payment_Mode,
+                p.Payment_Status, p.Payment_DateTime, p.Reference_Number,
+                CONCAT(u.First_Name, ' ', u.Last_Name) AS User_Name,
+                t.Fare AS Trip_Fare
+            FROM Payment p
+            JOIN Trip t ON p.Trip_ID = t.Trip_ID
+            LEFT JOIN User u ON t.User_ID = u.User_ID
+            {where}
+            {order}
+        """
+        return self._fetch_page(query, 'p.Payment_DateTime', 'p.Payment_ID', 'Payment p',
+                                cursor=cursor, page_size=page_size,
+                                where=filters.clauses, params=filters.params)
+    
     def get_payment_by_id(self, payment_id):
-        """Get payment by ID"""
+        """Get payment by ID (cached until the payment is changed)"""
         query = "SELECT * FROM Payment WHERE Payment_ID = %s"
-        result = self.execute_query(query, (payment_id,), fetch=True)
-        return result[0] if result else None
+        return self.cache.get('Payment', payment_id, lambda: self._fetch_row(query, (payment_id,)))
     
-    def update_payment_status(self, payment_id, payment_status, reference_number=None):
-        """Update payment status"""
-        query = """
-            UPDATE Payment 
-            SET Payment_Status = %s, Reference_Number = %s, Payment_DateTime = NOW()
-            WHERE Payment_ID = %s
+    def settle_payments(self, changes, override=False):
+        """Apply a batch of PaymentChanges through settlement
+        
+        override=True lets an operator make changes settlement.TRANSITIONS
+        does not allow, e.g. correcting a payment marked Refunded by mistake.
+        Returns a list of settlement.Outcome (one per change, in order), or
+        None on database errors.
+        """
+        try:
+            return settle(self, changes, override=override)
+        except Error as e:
+            st.error(f"Payment settlement error: {e}")
+            return None
+    
+    def update_payment_status(self, payment_id, payment_status, reference_number=None,
+                              override=False):
+        """Move a payment to a new status through settlement
+        
+        Only settlement.TRANSITIONS are allowed (Refunded is final) unless
+        override=True. The stored reference is kept unless a new one is
+        given. Returns True if the payment changed or already matched, None
+        if the change was rejected (the reason is shown) or on database errors.
         """
-        return self.execute_query(query, (payment_status, reference_number, payment_id))
+        outcomes = self.settle_payments([PaymentChange(payment_id, payment_status, reference_number)],
+                                        override)
+        if outcomes is None:
+            return None
+        if outcomes[0].result == 'rejected':
+            st.error(outcomes[0].detail)
+            return None
+        return True
     
     def delete_payment(self, payment_id):
         """Delete payment"""
         query = "DELETE FROM Payment WHERE Payment_ID = %s"
-        return self.execute_query(query, (payment_id,))
+        result = self._execute_with_event(query, (payment_id,), 'Payment', 'deleted', payment_id)
+        self.cache.invalidate('Payment', payment_id)
+        return result
     
     def get_completed_trips_without_payment(self):
-        """Get completed trips without payment"""
-        query = """
-            SELECT t.Trip_ID, 
-                   CONCAT('Trip #', t.Trip_ID, ' - ', u.First_Name, ' ', u.Last_Name, 
-                          ' (₹', t.Fare, ')') AS trip_info
-            FROM Trip t
-            LEFT JOIN Payment p ON t.Trip_ID = p.Trip_ID
-            LEFT JOIN User u ON t.User_ID = u.User_ID
-            WHERE t.Status = 'Completed' AND p.Payment_ID IS NULL
-            ORDER BY t.Dropoff_Time DESC
+        """Get completed trips waiting for a payment
+        
+        Reads the unpaid-trips queue after applying the Trip and Payment
+        changes logged since the last read, instead of anti-joining every
+        completed trip. A trip whose payments all failed stays listed.
+        Until the queue has been built (Reconciliation view or
+        `python reconciliation.py --rebuild-queue`) the trips are anti-joined.
         """
+        built = True
+        try:
+            built = sync_unpaid_queue(self, wait=False) is not None
+        except Error as e:
+            st.error(f"Unpaid trips queue error: {e}")
+        if built:
+            query = """
+                SELECT q.Trip_ID, 
+                       CONCAT('Trip #', q.Trip_ID, ' - ', u.First_Name, ' ', u.Last_Name, 
+                              ' (₹', q.Fare, ')') AS trip_info
+                FROM UnpaidTripQueue q
+                JOIN Trip t ON q.Trip_ID = t.Trip_ID
+                LEFT JOIN User u ON t.User_ID = u.User_ID
+                ORDER BY q.Completed_At DESC
+            """
+        else:
+            query = """
+                SELECT t.Trip_ID, 
+                       CONCAT('Trip #', t.Trip_ID, ' - ', u.First_Name, ' ', u.Last_Name, 
+                              ' (₹', t.Fare, ')') AS trip_info
+                FROM Trip t
+                LEFT JOIN User u ON t.User_ID = u.User_ID
+                WHERE t.Status = 'Completed'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM Payment p
+                      WHERE p.Trip_ID = t.Trip_ID
+                        AND p.Payment_Status IN ('Pending', 'Completed', 'Refunded')
+                  )
+                ORDER BY t.Dropoff_Time DESC
+            """
         return self.execute_query(query, fetch=True)
     
     # ==================== ANALYTICS ====================
     
     def get_dashboard_stats(self):
-        """Get dashboard statistics"""
-        stats = {}
-        
-        # Total counts
-        stats['total_users'] = self.execute_query("SELECT COUNT(*) as count FROM User", fetch=True)[0]['count']
-        stats['total_drivers'] = self.execute_query("SELECT COUNT(*) as count FROM Driver", fetch=True)[0]['count']
-        stats['total_vehicles'] = self.execute_query("SELECT COUNT(*) as count FROM Vehicle", fetch=True)[0]['count']
-        stats['total_trips'] = self.execute_query("SELECT COUNT(*) as count FROM Trip", fetch=True)[0]['count']
-        
-        # Active counts
-        stats['active_drivers'] = self.execute_query(
-            "SELECT COUNT(*) as count FROM Driver WHERE Status = 'Active'", fetch=True)[0]['count']
-        stats['available_vehicles'] = self.execute_query(
-            "SELECT COUNT(*) as count FROM Vehicle WHERE Status = 'Available'", fetch=True)[0]['count']
-        
-        # Trip stats
-        stats['pending_trips'] = self.execute_query(
-            "SELECT COUNT(*) as count FROM Trip WHERE Status = 'Pending'", fetch=True)[0]['count']
-        stats['ongoing_trips'] = self.execute_query(
-            "SELECT COUNT(*) as count FROM Trip WHERE Status IN ('Accepted', 'In_Progress')", fetch=True)[0]['count']
-        stats['completed_trips'] = self.execute_query(
-            "SELECT COUNT(*) as count FROM Trip WHERE Status = 'Completed'", fetch=True)[0]['count']
-        
-        # Revenue
-        revenue_result = self.execute_query(
-            "SELECT COALESCE(SUM(Amount), 0) as total FROM Payment WHERE Payment_Status = 'Completed'", 
-            fetch=True)
-        stats['total_revenue'] = revenue_result[0]['total'] if revenue_result else 0
+        """Get dashboard statistics
         
-        return stats
+        All counters are computed in a single round trip and cached for
+        DASHBOARD_STATS_TTL seconds. Any committed write drops the cache.
+        """
+        with self._stats_lock:
+            if (self._stats_cache is not None and
+                    time.monotonic() - self._stats_cached_at < DASHBOARD_STATS_TTL):
+                return dict(self._stats_cache)
+            generation = self._cache_generation
+        
+        query = """
+            SELECT 
+                (SELECT COUNT(*) FROM User) AS total_users,
+                d.total_drivers, d.active_drivers,
+                v.total_vehicles, v.available_vehicles,
+                t.total_trips, t.pending_trips, t.ongoing_trips, t.completed_trips,
+                (SELECT COALESCE(SUM(Amount), 0) FROM Payment
+                 WHERE Payment_Status = 'Completed') AS total_revenue
+            FROM 
+                (SELECT COUNT(*) AS total_drivers,
+                        COALESCE(SUM(Status = 'Active'), 0) AS active_drivers
+                 FROM Driver) d
+            CROSS JOIN
+                (SELECT COUNT(*) AS total_vehicles,
+                        COALESCE(SUM(Status = 'Available'), 0) AS available_vehicles
+                 FROM Vehicle) v
+            CROSS JOIN
+                (SELECT COUNT(*) AS total_trips,
+                        COALESCE(SUM(Status = 'Pending'), 0) AS pending_trips,
+                        COALESCE(SUM(Status IN ('Accepted', 'In_Progress')), 0) AS ongoing_trips,
+                        COALESCE(SUM(Status = 'Completed'), 0) AS completed_trips
+                 FROM Trip) t
+        """
+        result = self.execute_query(query, fetch=True)
+        if not result:
+            return {key: 0 for key in (
+                'total_users', 'total_drivers', 'total_vehicles', 'total_trips',
+                'active_drivers', 'available_vehicles', 'pending_trips',
+                'ongoing_trips', 'completed_trips', 'total_revenue')}
+        
+        row = result[0]
+        stats = {key: int(value) for key, value in row.items() if key != 'total_revenue'}
+        stats['total_revenue'] = row['total_revenue']
+        
+        with self._stats_lock:
+            # Don't cache a result that raced with a write
+            if generation == self._cache_generation:
+                self._stats_cache = stats
+                self._stats_cached_at = time.monotonic()
+        return dict(stats)
     
     def get_trip_status_distribution(self):
         """Get trip status distribution for charts"""
@@ -404,20 +1365,148 @@ class Database:
         """
         return self.fetch_dataframe(query)
     
+    def refresh_rollups(self, force=False):
+        """Refresh the daily rollup tables, at most every ROLLUP_REFRESH_SECONDS
+        
+        On failure the charts keep showing the last refreshed aggregates. A
+        rollup that has never been built is not backfilled here, which would
+        hold up the page; a warning points at `python rollups.py --backfill`.
+        """
+        with self._rollup_lock:
+            now = time.monotonic()
+            due = (force or self._rollups_refreshed_at is None or
+                   now - self._rollups_refreshed_at >= ROLLUP_REFRESH_SECONDS)
+            if due:
+                self._rollups_refreshed_at = now
+        if due:
+            try:
+                written = refresh_all_rollups(self)
+                self._rollups_unbuilt = sorted(name for name, rows in written.items() if rows is None)
+            except Error as e:
+                st.error(f"Rollup refresh error: {e}")
+        if self._rollups_unbuilt:
+            st.warning(f"Rollups not built yet ({', '.join(self._rollups_unbuilt)}); "
+                       "run `python rollups.py --backfill`")
+    
     def get_revenue_by_vehicle_type(self):
-        """Get revenue by vehicle type"""
+        """Get revenue by vehicle type (from the daily trip rollup)"""
+        self.refresh_rollups()
         query = """
             SELECT 
                 vt.Vehicle_Type,
-                COUNT(t.Trip_ID) AS Total_Trips,
-                COALESCE(SUM(t.Fare), 0) AS Total_Revenue
+                COALESCE(SUM(r.Trip_Count), 0) AS Total_Trips,
+                COALESCE(SUM(r.Total_Fare), 0) AS Total_Revenue
             FROM VehicleType vt
-            LEFT JOIN Vehicle v ON vt.Vehicle_Type = v.Vehicle_Type
-            LEFT JOIN Trip t ON v.Vehicle_ID = t.Vehicle_ID AND t.Status = 'Completed'
+            LEFT JOIN TripDailyRollup r
+                ON r.Vehicle_Type = vt.Vehicle_Type AND r.Status = 'Completed'
             GROUP BY vt.Vehicle_Type
             ORDER BY Total_Revenue DESC
         """
         return self.fetch_dataframe(query)
+    
+    def get_payment_mode_summary(self, payment_status='Completed'):
+        """Get payment count and amount per payment mode (from the daily payment rollup)"""
+        self.refresh_rollups()
+        query = """
+            SELECT 
+                Payment_Mode,
+                SUM(Payment_Count) AS Count,
+                SUM(Total_Amount) AS Total_Amount
+            FROM PaymentDailyRollup
+            WHERE Payment_Status = %s
+            GROUP BY Payment_Mode
+            ORDER BY Payment_Mode
+        """
+        return self.fetch_dataframe(query, (payment_status,))
+
+    
+    def _trend_range(self, start, end, bucket):
+        """Default to the last 30 days and validate the bucket"""
+        if bucket not in TREND_BUCKETS:
+            raise ValueError(f"bucket must be one of {sorted(TREND_BUCKETS)}")
+        end = end or date.today()
+        start = start or (end - timedelta(days=30))
+        return start, end
+    
+    def get_trip_trends(self, start=None, end=None, bucket='day'):
+        """Get trips, completions, cancellations and average wait per time bucket
+        
+        Trips are bucketed by Booking_Time; the range is inclusive and dates
+        cover whole days. Served by a range scan on idx_trip_booking_trend,
+        which covers every column read.
+        """
+        start, end = self._trend_range(start, end, bucket)
+        bucket_sql = TREND_BUCKETS[bucket][0].format(col='Booking_Time')
+        filters = QueryFilter().since('Booking_Time', start).until('Booking_Time', end)
+        query = f"""
+            SELECT 
+                {bucket_sql} AS Bucket,
+                COUNT(*) AS Trips,
+                SUM(Status = 'Completed') AS Completed,
+                SUM(Status = 'Cancelled') AS Cancelled,
+                AVG(TIMESTAMPDIFF(SECOND, Booking_Time, Pickup_Time)) / 60 AS Avg_Wait_Minutes
+            FROM Trip
+            WHERE {' AND '.join(filters.clauses)}
+            GROUP BY Bucket
+            ORDER BY Bucket
+        """
+        return self.fetch_dataframe(query, tuple(filters.params))
+    
+    def get_revenue_trends(self, start=None, end=None, bucket='day'):
+        """Get completed payment revenue per time bucket (by Payment_DateTime)
+        
+        Served by a range scan on the covering idx_payment_datetime_trend.
+        """
+        start, end = self._trend_range(start, end, bucket)
+        bucket_sql = TREND_BUCKETS[bucket][0].format(col='Payment_DateTime')
+        filters = (QueryFilter()
+                   .since('Payment_DateTime', start)
+                   .until('Payment_DateTime', end)
+                   .equals('Payment_Status', 'Completed'))
+        query = f"""
+            SELECT 
+                {bucket_sql} AS Bucket,
+                COUNT(*) AS Payments,
+                COALESCE(SUM(Amount), 0) AS Revenue
+            FROM Payment
+            WHERE {' AND '.join(filters.clauses)}
+            GROUP BY Bucket
+            ORDER BY Bucket
+        """
+        return self.fetch_dataframe(query, tuple(filters.params))
+    
+    def get_trends(self, start=None, end=None, bucket='day'):
+        """Get trip and revenue trends on one continuous time axis
+        
+        Buckets without any trips or payments are included with zero counts
+        (and no average wait), so charts show gaps as gaps.
+        """
+        start, end = self._trend_range(start, end, bucket)
+        trips = self.get_trip_trends(start, end, bucket)
+        revenue = self.get_revenue_trends(start, end, bucket)
+        
+        freq = TREND_BUCKETS[bucket][1]
+        first = pd.Timestamp(start)
+        if bucket == 'week':
+            first -= pd.Timedelta(days=first.weekday())
+        last = pd.Timestamp(end) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+        trends = pd.DataFrame({'Bucket': pd.date_range(first, last, freq=freq)})
+        
+        for frame in (trips, revenue):
+            if not frame.empty:
+                frame['Bucket'] = pd.to_datetime(frame['Bucket'])
+                trends = trends.merge(frame, on='Bucket', how='left')
+        for column in ('Trips', 'Completed', 'Cancelled', 'Payments'):
+            if column not in trends:
+                trends[column] = 0
+            trends[column] = pd.to_numeric(trends[column]).fillna(0).astype(int)
+        if 'Revenue' not in trends:
+            trends['Revenue'] = 0.0
+        trends['Revenue'] = pd.to_numeric(trends['Revenue']).fillna(0).astype(float)
+        if 'Avg_Wait_Minutes' not in trends:
+            trends['Avg_Wait_Minutes'] = float('nan')
+        trends['Avg_Wait_Minutes'] = pd.to_numeric(trends['Avg_Wait_Minutes'])
+        return trends
 
 
 # Singleton instance
@@ -0,0 +1,388 @@
+"""
+Batch dispatcher for Cab Service Management System
+
+Matches every pending trip to a free driver and an available vehicle in one
+pass and commits all assignments in a single transaction. Drivers close to a
+trip's pickup point are considered first and preferred when both positions
+are known.
+
+Usage:
+    python dispatch.py --once              # one dispatch run
+    python dispatch.py --interval 10       # run every 10 seconds
+    python dispatch.py --benchmark 10000   # time a dispatch batch on synthetic data (no SQL)
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from config import (DISPATCH_BATCH_SIZE, DISPATCH_INTERVAL, DISPATCH_RATING_WEIGHT,
+                    DISPATCH_VEHICLE_TYPE_WEIGHTS, GEO_DISPATCH_RADIUS_KM)
+from geo import GridIndex
+from outbox import record as record_event
+
+# Rows per multi-row UPDATE statement
+UPDATE_CHUNK_SIZE = 500
+
+# Free drivers considered around each trip's pickup point
+NEARBY_CANDIDATES = 3
+
+# Free drivers, locked; {where} narrows the candidates and {limit} caps them
+DRIVER_CANDIDATES = """
+    SELECT d.Driver_ID, d.Rating, d.Current_Lat, d.Current_Lon
+    FROM Driver d
+    WHERE d.Status = 'Active'{where}
+      AND NOT EXISTS (
+          SELECT 1 FROM Trip t
+          WHERE t.Driver_ID = d.Driver_ID AND t.Status IN ('Accepted', 'In_Progress')
+      )
+    ORDER BY d.Rating DESC
+    {limit}
+    FOR UPDATE SKIP LOCKED
+"""
+
+
+def type_weight(vehicle_type):
+    """Preference for a vehicle type, 0..1"""
+    return DISPATCH_VEHICLE_TYPE_WEIGHTS.get(vehicle_type, 0.5)
+
+
+def unit_score(rating, vehicle_type):
+    """Score a driver/vehicle pair (higher is better)"""
+    rating_part = float(rating or 0) / 5.0
+    return DISPATCH_RATING_WEIGHT * rating_part + (1 - DISPATCH_RATING_WEIGHT) * type_weight(vehicle_type)
+
+
+def build_units(drivers, vehicles):
+    """Pair free drivers with vehicles
+    
+    A driver drives their own available vehicle when they have one.
+    Otherwise they get one of the unassigned vehicles, with the best-rated
+    drivers getting the most preferred types. Vehicles assigned to some other
+    driver are never lent out.
+    
+    drivers:  dicts with Driver_ID and Rating
+    vehicles: dicts with Vehicle_ID, Driver_ID (owner or None) and Vehicle_Type
+    Returns a list of (score, driver_id, vehicle_id).
+    """
+    owned = {}
+    unassigned = []
+    for vehicle in vehicles:
+        if vehicle['Driver_ID'] is None:
+            unassigned.append(vehicle)
+        else:
+            owned.setdefault(vehicle['Driver_ID'], []).append(vehicle)
+    
+    units = []
+    without_vehicle = []
+    for driver in drivers:
+        own = owned.get(driver['Driver_ID'])
+        if own:
+            vehicle = max(own, key=lambda v: type_weight(v['Vehicle_Type']))
+            units.append((unit_score(driver['Rating'], vehicle['Vehicle_Type']),
+                          driver['Driver_ID'], vehicle['Vehicle_ID']))
+        else:
+            without_vehicle.append(driver)
+    
+    without_vehicle.sort(key=lambda d: float(d['Rating'] or 0), reverse=True)
+    unassigned.sort(key=lambda v: type_weight(v['Vehicle_Type']), reverse=True)
+    for driver, vehicle in zip(without_vehicle, unassigned):
+        units.append((unit_score(driver['Rating'], vehicle['Vehicle_Type']),
+                      driver['Driver_ID'], vehicle['Vehicle_ID']))
+    return units
+
+
+def match(trips, units):
+    """Assign driver/vehicle units to trips, longest-waiting trip first
+    
+    Sorting trips by wait and units by score, then pairing them in order,
+    maximises the total wait-weighted score. This follows from the
+    rearrangement inequality, so the greedy result is optimal, and it runs in
+    O(n log n) rather than the O(n^3) of a general assignment solver.
+    
+    trips: dicts with Trip_ID and Booking_Time
+    units: (score, driver_id, vehicle_id) tuples from build_units()
+    Returns a list of (trip_id, driver_id, vehicle_id).
+    """
+    trips = sorted(trips, key=lambda t: t['Booking_Time'])
+    units = sorted(units, key=lambda u: u[0], reverse=True)
+    return [(trip['Trip_ID'], unit[1], unit[2]) for trip, unit in zip(trips, units)]
+
+
+def match_nearby(trips, units, locations, radius_km=GEO_DISPATCH_RADIUS_KM):
+    """Like match(), but give each trip the closest unit within `radius_km` when possible
+    
+    Trips are served longest-waiting first. A trip with pickup coordinates
+    takes the nearest remaining unit whose driver is within `radius_km`, found
+    through a GridIndex of driver positions. Trips and units left over
+    (no coordinates, or nobody nearby) are paired by match().
+    
+    trips:     dicts with Trip_ID, Booking_Time and optional Pickup_Lat/Pickup_Lon
+    units:     (score, driver_id, vehicle_id) tuples from build_units()
+    locations: Driver_ID -> (lat, lon) for drivers with a known position
+    """
+    grid = GridIndex()
+    by_driver = {}
+    for unit in units:
+        position = locations.get(unit[1])
+        if position is not None:
+            grid.insert(unit[1], *position)
+            by_driver[unit[1]] = unit
+    if not len(grid):
+        return match(trips, units)
+    
+    assignments = []
+    leftover_trips = []
+    for trip in sorted(trips, key=lambda t: t['Booking_Time']):
+        nearest = []
+        if trip.get('Pickup_Lat') is not None and trip.get('Pickup_Lon') is not None:
+            nearest = grid.nearest(trip['Pickup_Lat'], trip['Pickup_Lon'], 1, radius_km)
+        if nearest:
+            unit = by_driver.pop(nearest[0][0])
+            grid.remove(unit[1])
+            assignments.append((trip['Trip_ID'], unit[1], unit[2]))
+        else:
+            leftover_trips.append(trip)
+    
+    taken = {driver_id for _, driver_id, _ in assignments}
+    leftover_units = [unit for unit in units if unit[1] not in taken]
+    return assignments + match(leftover_trips, leftover_units)
+
+
+def nearby_driver_ids(availability, trips, per_trip=NEARBY_CANDIDATES, radius_km=GEO_DISPATCH_RADIUS_KM):
+    """IDs of free drivers within `radius_km` of the trips' pickups, from the availability grid
+    
+    The index may lag the database; the caller locks and re-checks them.
+    """
+    driver_ids = set()
+    for trip in trips:
+        if trip.get('Pickup_Lat') is not None and trip.get('Pickup_Lon') is not None:
+            for row, _ in availability.nearest_drivers(trip['Pickup_Lat'], trip['Pickup_Lon'],
+                                                       per_trip, radius_km):
+                driver_ids.add(row['Driver_ID'])
+    return sorted(driver_ids)
+
+
+def _busy(cursor, column, ids):
+    """Those of `ids` (Driver_ID or Vehicle_ID) held by an active trip, by a locking read
+    
+    The NOT EXISTS filters of the candidate queries read the snapshot taken
+    by the transaction's first SELECT. FOR SHARE reads the latest committed
+    rows, so assignments made by other replicas since then are seen.
+    """
+    if not ids:
+        return set()
+    cursor.execute(f"""
+        SELECT {column} FROM Trip
+        WHERE {column} IN ({', '.join(['%s'] * len(ids))}) AND Status IN ('Accepted', 'In_Progress')
+        FOR SHARE
+    """, tuple(ids))
+    return {row[column] for row in cursor.fetchall()}
+
+
+def dispatch_pending(db, batch_size=DISPATCH_BATCH_SIZE):
+    """Assign up to `batch_size` pending trips in one transaction
+    
+    Candidate trips, drivers and vehicles are locked with
+    FOR UPDATE SKIP LOCKED (MySQL 8.0+), in the same Trip -> Driver -> Vehicle
+    order as Database.assign_driver_vehicle(). Dispatchers running on several
+    app replicas therefore work on disjoint rows instead of blocking each
+    other. Locked drivers and vehicles are re-checked for active trips with
+    a locking read before they are matched.
+    
+    Candidate drivers are the free drivers near the trips' pickups (from the
+    availability index), topped up with the best-rated free drivers to twice
+    the number of trips. Vehicles move to In_Use, drivers' Last_Active is
+    stamped and the assignments are logged to the change-event log in the
+    same transaction. Returns the committed (trip_id, driver_id, vehicle_id)
+    assignments.
+    """
+    from database import values_table
+    
+    with db.transaction() as cursor:
+        cursor.execute("""
+            SELECT Trip_ID, Booking_Time, Pickup_Lat, Pickup_Lon
+            FROM Trip
+            WHERE Status = 'Pending'
+            ORDER BY Booking_Time ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (batch_size,))
+        trips = cursor.fetchall()
+        if not trips:
+            return []
+        
+        # Twice as many drivers as trips leaves room for drivers whose
+        # vehicle turns out to be unavailable
+        drivers = []
+        nearby = nearby_driver_ids(db.availability, trips)
+        if nearby:
+            cursor.execute(DRIVER_CANDIDATES.format(
+                where=f"\n      AND d.Driver_ID IN ({', '.join(['%s'] * len(nearby))})", limit=""),
+                tuple(nearby))
+            drivers = cursor.fetchall()
+        missing = len(trips) * 2 - len(drivers)
+        if missing > 0:
+            taken = [d['Driver_ID'] for d in drivers]
+            where = f"\n      AND d.Driver_ID NOT IN ({', '.join(['%s'] * len(taken))})" if taken else ""
+            cursor.execute(DRIVER_CANDIDATES.format(where=where, limit="LIMIT %s"),
+                           tuple(taken) + (missing,))
+            drivers += cursor.fetchall()
+        busy = _busy(cursor, 'Driver_ID', [d['Driver_ID'] for d in drivers])
+        drivers = [d for d in drivers if d['Driver_ID'] not in busy]
+        if not drivers:
+            return []
+        
+        driver_ids = [d['Driver_ID'] for d in drivers]
+        placeholders = ', '.join(['%s'] * len(driver_ids))
+        cursor.execute(f"""
+            SELECT v.Vehicle_ID, v.Driver_ID, v.Vehicle_Type
+            FROM Vehicle v
+            WHERE v.Status = 'Available'
+              AND (v.Driver_ID IN ({placeholders}) OR v.Driver_ID IS NULL)
+              AND NOT EXISTS (
+                  SELECT 1 FROM Trip t
+                  WHERE t.Vehicle_ID = v.Vehicle_ID AND t.Status IN ('Accepted', 'In_Progress')
+              )
+            FOR UPDATE SKIP LOCKED
+        """, tuple(driver_ids))
+        vehicles = cursor.fetchall()
+        busy = _busy(cursor, 'Vehicle_ID', [v['Vehicle_ID'] for v in vehicles])
+        vehicles = [v for v in vehicles if v['Vehicle_ID'] not in busy]
+        
+        locations = {d['Driver_ID']: (d['Current_Lat'], d['Current_Lon']) for d in drivers
+                     if d['Current_Lat'] is not None and d['Current_Lon'] is not None}
+        assignments = match_nearby(trips, build_units(drivers, vehicles), locations)
+        for start in range(0, len(assignments), UPDATE_CHUNK_SIZE):
+            chunk = assignments[start:start + UPDATE_CHUNK_SIZE]
+            rows_sql, params = values_table(['Trip_ID', 'Driver_ID', 'Vehicle_ID'], chunk)
+            cursor.execute(f"""
+                UPDATE Trip t
+                JOIN ({rows_sql}) a ON t.Trip_ID = a.Trip_ID
+                SET t.Driver_ID = a.Driver_ID, t.Vehicle_ID = a.Vehicle_ID,
+                    t.Status = 'Accepted', t.Pickup_Time = NOW()
+                WHERE t.Status = 'Pending'
+            """, tuple(params))
+            cursor.execute(f"""
+                UPDATE Vehicle v
+                JOIN ({rows_sql}) a ON v.Vehicle_ID = a.Vehicle_ID
+                SET v.Status = 'In_Use'
+            """, tuple(params))
+            cursor.execute(f"""
+                UPDATE Driver d
+                JOIN ({rows_sql}) a ON d.Driver_ID = a.Driver_ID
+                SET d.Last_Active = NOW()
+            """, tuple(params))
+            record_event(cursor, 'Trip', 'status_changed', [trip_id for trip_id, _, _ in chunk])
+    if assignments:
+        trip_ids, driver_ids, vehicle_ids = zip(*assignments)
+        db.cache.invalidate('Trip', *trip_ids)
+        db.cache.invalidate('Driver', *driver_ids)
+        db.cache.invalidate('Vehicle', *vehicle_ids)
+    db.availability.claim((driver_id, vehicle_id) for _, driver_id, vehicle_id in assignments)
+    return assignments
+
+
+def run_forever(db, interval=DISPATCH_INTERVAL, batch_size=DISPATCH_BATCH_SIZE):
+    """Dispatch every `interval` seconds until interrupted"""
+    while True:
+        started = time.perf_counter()
+        try:
+            assigned = dispatch_pending(db, batch_size)
+            print(f"[{datetime.now():%H:%M:%S}] assigned {len(assigned)} trip(s) "
+                  f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+        except Exception as e:
+            print(f"[{datetime.now():%H:%M:%S}] dispatch failed: {e}")
+        time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+def benchmark(n_trips, seed=42):
+    """Time dispatch_pending()'s in-process work on synthetic data and print the assignment rate
+    
+    Runs what a dispatch batch does between its queries: the nearby-driver
+    lookup in an AvailabilityIndex, the candidate top-up, dropping drivers
+    and vehicles the re-check finds busy (about 5%, here a set lookup),
+    build_units() and match_nearby(). The SQL itself (locking reads, the
+    re-check and the UPDATEs) is not included.
+    """
+    from availability import AvailabilityIndex
+    
+    rng = random.Random(seed)
+    now = datetime.now()
+    types = list(DISPATCH_VEHICLE_TYPE_WEIGHTS)
+    n_drivers = int(n_trips * 1.2)
+    
+    def near_bangalore():
+        return 12.85 + rng.random() * 0.3, 77.45 + rng.random() * 0.35
+    
+    trips = []
+    for i in range(n_trips):
+        # Some bookings come without a geocoded pickup
+        lat, lon = near_bangalore() if rng.random() < 0.9 else (None, None)
+        trips.append({'Trip_ID': i, 'Booking_Time': now - timedelta(seconds=rng.randint(0, 3600)),
+                      'Pickup_Lat': lat, 'Pickup_Lon': lon})
+    drivers = []
+    for i in range(n_drivers):
+        lat, lon = near_bangalore()
+        drivers.append({'Driver_ID': i, 'Rating': round(rng.uniform(3.0, 5.0), 1),
+                        'Current_Lat': lat, 'Current_Lon': lon})
+    drivers.sort(key=lambda d: d['Rating'], reverse=True)
+    # Most drivers own a vehicle; the rest share a pool of unassigned vehicles
+    vehicles = [{'Vehicle_ID': i, 'Driver_ID': i if rng.random() < 0.8 else None,
+                 'Vehicle_Type': rng.choice(types)}
+                for i in range(n_drivers)]
+    busy = {i for i in range(n_drivers) if rng.random() < 0.05}
+    availability = AvailabilityIndex(lambda: drivers, lambda: vehicles, refresh_seconds=float('inf'))
+    availability.drivers()      # load outside the timing, as a warm index would be
+    by_id = {d['Driver_ID']: d for d in drivers}
+    
+    started = time.perf_counter()
+    candidates = [by_id[driver_id] for driver_id in nearby_driver_ids(availability, trips)]
+    taken = {d['Driver_ID'] for d in candidates}
+    missing = n_trips * 2 - len(candidates)
+    if missing > 0:
+        candidates += [d for d in drivers if d['Driver_ID'] not in taken][:missing]
+    candidates = [d for d in candidates if d['Driver_ID'] not in busy]
+    candidate_ids = {d['Driver_ID'] for d in candidates}
+    free_vehicles = [v for v in vehicles if v['Vehicle_ID'] not in busy and
+                     (v['Driver_ID'] is None or v['Driver_ID'] in candidate_ids)]
+    locations = {d['Driver_ID']: (d['Current_Lat'], d['Current_Lon']) for d in candidates}
+    assignments = match_nearby(trips, build_units(candidates, free_vehicles), locations)
+    elapsed = time.perf_counter() - started
+    
+    print(f"{n_trips:,} trips, {n_drivers:,} drivers -> {len(assignments):,} assignments "
+          f"in {elapsed * 1000:.1f} ms ({len(assignments) / elapsed:,.0f} assignments/sec)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Match pending trips to drivers and vehicles")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--once', action='store_true', help="run a single dispatch batch")
+    group.add_argument('--interval', type=float, help="run continuously every N seconds")
+    group.add_argument('--benchmark', type=int, metavar='N', help="benchmark a dispatch batch of N synthetic trips")
+    parser.add_argument('--batch-size', type=int, default=DISPATCH_BATCH_SIZE)
+    args = parser.parse_args()
+    
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+    
+    from database import Database
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Could not connect to the database")
+    try:
+        if args.once:
+            assigned = dispatch_pending(db, args.batch_size)
+            print(f"Assigned {len(assigned)} trip(s)")
+        else:
+            run_forever(db, args.interval, args.batch_size)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+Streaming data export for Cab Service Management System
+
+Streams rows from an unbuffered server-side cursor into gzip-compressed CSV
+or Parquet, one chunk at a time. Memory use stays at one chunk regardless of
+table size.
+
+The app serves finished files through Streamlit, which holds the whole file
+in memory, so it only offers files up to EXPORT_MAX_DOWNLOAD_MB; larger
+exports go through this script. Files in EXPORT_DIR are deleted once
+downloaded, or after EXPORT_RETENTION_HOURS.
+
+Usage:
+    python export.py trips trips.csv.gz --from 2024-01-01 --status Completed
+    python export.py payments payments.parquet --to 2024-12-31
+"""
+import argparse
+import csv
+import gzip
+import os
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from mysql.connector import FieldType
+
+from config import EXPORT_CHUNK_SIZE, EXPORT_DIR, EXPORT_RETENTION_HOURS
+
+# Export queries with a {where} placeholder, plus the columns the date range
+# and status filters apply to (None when the entity has no status)
+EXPORTS = {
+    'users': {
+        'query': """
+            SELECT u.User_ID, u.First_Name, u.Last_Name, u.Phone_Number, u.Email,
+                   u.Registration_Date, u.Last_Login
+            FROM User u
+            {where}
+        """,
+        'date_column': 'u.Registration_Date',
+        'status_column': None,
+    },
+    'drivers': {
+        'query': """
+            SELECT
+                d.Driver_ID, d.First_Name, d.Last_Name, d.Phone_Number,
+                d.License_Number, d.Rating, d.Status, d.Join_Date,
+                v.Vehicle_Number, v.Make, v.Model, vt.Vehicle_Type
+            FROM Driver d
+            LEFT JOIN Vehicle v ON d.Driver_ID = v.Driver_ID
+            LEFT JOIN VehicleType vt ON v.Vehicle_Type = vt.Vehicle_Type
+            {where}
+        """,
+        'date_column': 'd.Join_Date',
+        'status_column': 'd.Status',
+    },
+    'trips': {
+        'query': """
+            SELECT
+                t.Trip_ID, t.Status,
+                CONCAT(u.First_Name, ' ', u.Last_Name) AS User_Name,
+                CONCAT(d.First_Name, ' ', d.Last_Name) AS Driver_Name,
+                v.Vehicle_Number,
+                t.Pickup_Location, t.Dropoff_Location,
+                t.Booking_Time, t.Pickup_Time, t.Dropoff_Time,
+                t.Distance, t.Fare
+            FROM Trip t
+            LEFT JOIN User u ON t.User_ID = u.User_ID
+            LEFT JOIN Driver d ON t.Driver_ID = d.Driver_ID
+            LEFT JOIN Vehicle v ON t.Vehicle_ID = v.Vehicle_ID
+            {where}
+        """,
+        'date_column': 't.Booking_Time',
+        'status_column': 't.Status',
+    },
+    'payments': {
+        'query': """
+            SELECT
+                p.Payment_ID, p.Trip_ID, p.Amount, p.Payment_Mode,
+                p.Payment_Status, p.Payment_DateTime, p.Reference_Number,
+                CONCAT(u.First_Name, ' ', u.Last_Name) AS User_Name,
+                t.Fare AS Trip_Fare
+            FROM Payment p
+            JOIN Trip t ON p.Trip_ID = t.Trip_ID
+            LEFT JOIN User u ON t.User_ID = u.User_ID
+            {where}
+        """,
+        'date_column': 'p.Payment_DateTime',
+        'status_column': 'p.Payment_Status',
+    },
+}
+
+FORMATS = {'csv': '.csv.gz', 'parquet': '.parquet'}
+
+
+def stream_export(db, kind, start=None, end=None, statuses=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield (description, rows) chunks for an export, filtered in SQL"""
+    from database import QueryFilter
+
+    spec = EXPORTS[kind]
+    filters = (QueryFilter()
+               .since(spec['date_column'], start)
+               .until(spec['date_column'], end))
+    if spec['status_column']:
+        filters.is_in(spec['status_column'], statuses)
+    where = ("WHERE " + " AND ".join(filters.clauses)) if filters.clauses else ""
+    return db.stream_query(spec['query'].format(where=where), tuple(filters.params), chunk_size)
+
+
+def write_csv_gz(chunks, path):
+    """Write streamed chunks to a gzip-compressed CSV; returns rows written"""
+    rows_written = 0
+    with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        header_written = False
+        for description, rows in chunks:
+            if not header_written:
+                writer.writerow([column[0] for column in description])
+                header_written = True
+            writer.writerows(rows)
+            rows_written += len(rows)
+    return rows_written
+
+
+def _arrow_schema(description):
+    """Arrow schema from MySQL column types, so every chunk has the same schema"""
+    import pyarrow as pa
+
+    integer_types = {FieldType.TINY, FieldType.SHORT, FieldType.LONG,
+                     FieldType.INT24, FieldType.LONGLONG, FieldType.YEAR}
+    float_types = {FieldType.DECIMAL, FieldType.NEWDECIMAL, FieldType.FLOAT, FieldType.DOUBLE}
+    time_types = {FieldType.DATETIME, FieldType.TIMESTAMP, FieldType.DATE}
+
+    fields = []
+    for column in description:
+        name, type_code = column[0], column[1]
+        if type_code in integer_types:
+            arrow_type = pa.int64()
+        elif type_code in float_types:
+            arrow_type = pa.float64()
+        elif type_code in time_types:
+            arrow_type = pa.timestamp('us')
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def _arrow_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime.combine(value, datetime.min.time())
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    return value
+
+
+def write_parquet(chunks, path):
+    """Write streamed chunks to Parquet, one row group per chunk; returns rows written"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    rows_written = 0
+    writer = None
+    try:
+        for description, rows in chunks:
+            if writer is None:
+                schema = _arrow_schema(description)
+                writer = pq.ParquetWriter(path, schema, compression='snappy')
+            columns = {field.name: [_arrow_value(row[i]) for row in rows]
+                       for i, field in enumerate(schema)}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            rows_written += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows_written
+
+
+def prune_exports(max_age_hours=EXPORT_RETENTION_HOURS, directory=EXPORT_DIR):
+    """Delete export files older than `max_age_hours` from `directory`; returns the count"""
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def export_to_file(db, kind, fmt='csv', start=None, end=None, statuses=None,
+                   path=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Export `kind` to a file and return (path, rows_written)
+
+    Without an explicit path the file goes to EXPORT_DIR, after clearing out
+    files older than EXPORT_RETENTION_HOURS. When no rows match, no file is
+    left behind and (None, 0) is returned.
+    """
+    if path is None:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        prune_exports()
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(EXPORT_DIR, f"{kind}_{stamp}{FORMATS[fmt]}")
+
+    chunks = stream_export(db, kind, start, end, statuses, chunk_size)
+    if fmt == 'parquet':
+        rows_written = write_parquet(chunks, path)
+    else:
+        rows_written = write_csv_gz(chunks, path)
+    if rows_written == 0:
+        if os.path.exists(path):
+            os.remove(path)
+        return None, 0
+    return path, rows_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a table export to CSV (gzip) or Parquet")
+    parser.add_argument('kind', choices=sorted(EXPORTS))
+    parser.add_argument('path', help="output file (.csv.gz or .parquet)")
+    parser.add_argument('--from', dest='start', type=date.fromisoformat, help="YYYY-MM-DD, inclusive")
+    parser.add_argument('--to', dest='end', type=date.fromisoformat, help="YYYY-MM-DD, inclusive")
+    parser.add_argument('--status', action='append', dest='statuses', help="repeat for several")
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from database import Database
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Could not connect to the database")
+    fmt = 'parquet' if args.path.lower().endswith('.parquet') else 'csv'
+    try:
+        path, rows = export_to_file(db, args.kind, fmt, args.start, args.end, args.statuses,
+                                    args.path, args.chunk_size)
+    finally:
+        db.disconnect()
+    if path is None:
+        print(f"No {args.kind} rows matched; nothing written")
+    else:
+        print(f"Exported {rows:,} {args.kind} rows to {path}")
+
+
+if __name__ == '__main__':
+    main()
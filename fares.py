@@ -0,0 +1,261 @@
+"""
+Fare engine for Cab Service Management System
+
+Prices trips from distance, ride duration (Pickup_Time -> Dropoff_Time),
+the vehicle type's Base_Fare_Per_Km, time-of-day surge and per-type minimum
+fares. The same rules are available for a single trip (FareEngine.quote) and
+vectorized over a DataFrame (price_frame). The vectorized form is used to audit
+or reprice historical trips in bulk.
+
+Usage:
+    python fares.py --audit --from 2024-01-01 --out mismatches.csv
+    python fares.py --reprice --from 2024-01-01 --to 2024-03-31
+    python fares.py --benchmark 1000000     # time price_frame() on synthetic trips
+"""
+import argparse
+import threading
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from config import (FARE_PER_MINUTE, FARE_MINIMUMS, FARE_SURGE_WINDOWS,
+                    FARE_AUDIT_TOLERANCE, FARE_RATES_REFRESH_SECONDS, EXPORT_CHUNK_SIZE)
+
+# Rows per multi-row UPDATE statement when repricing
+UPDATE_CHUNK_SIZE = 1000
+
+
+def surge_by_hour(windows=FARE_SURGE_WINDOWS):
+    """24-entry array of surge multipliers; overlapping windows take the highest"""
+    table = np.ones(24)
+    for start_hour, end_hour, multiplier in windows:
+        hours = range(start_hour, end_hour) if start_hour < end_hour else \
+            list(range(start_hour, 24)) + list(range(0, end_hour))
+        for hour in hours:
+            table[hour] = max(table[hour], multiplier)
+    return table
+
+
+SURGE_BY_HOUR = surge_by_hour()
+
+
+class FareEngine:
+    """Prices trips from per-type rates cached in memory
+
+    The VehicleType rates are loaded with one query and reloaded at most every
+    FARE_RATES_REFRESH_SECONDS, or immediately after invalidate().
+    """
+
+    def __init__(self, load_rates, refresh_seconds=FARE_RATES_REFRESH_SECONDS):
+        self._load_rates = load_rates
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._rates = {}
+        self._loaded_at = None
+
+    def rates(self):
+        """Vehicle_Type -> Base_Fare_Per_Km"""
+        with self._lock:
+            if (self._loaded_at is None or
+                    time.monotonic() - self._loaded_at >= self.refresh_seconds):
+                rates = self._load_rates()
+                if rates is not None:
+                    self._rates = rates
+                    self._loaded_at = time.monotonic()
+            return self._rates
+
+    def invalidate(self):
+        """Force a reload on the next read"""
+        with self._lock:
+            self._loaded_at = None
+
+    def quote(self, vehicle_type, distance, pickup_time=None, dropoff_time=None):
+        """Fare for one trip, or None when the vehicle type has no rate"""
+        per_km = self.rates().get(vehicle_type)
+        if per_km is None or distance is None:
+            return None
+        minutes = 0.0
+        if pickup_time is not None and dropoff_time is not None:
+            minutes = max(0.0, (dropoff_time - pickup_time).total_seconds() / 60)
+        surge = SURGE_BY_HOUR[pickup_time.hour] if pickup_time is not None else 1.0
+        fare = (float(per_km) * float(distance) + FARE_PER_MINUTE * minutes) * surge
+        return round(max(fare, FARE_MINIMUMS.get(vehicle_type, 0.0)), 2)
+
+    def price_frame(self, trips):
+        """Vectorized quote() over a DataFrame; returns a float Series (NaN = unpriceable)
+
+        Expects Vehicle_Type, Distance, Pickup_Time and Dropoff_Time columns.
+        """
+        rates = {k: float(v) for k, v in self.rates().items()}
+        return price_frame(trips, rates)
+
+
+def price_frame(trips, rates):
+    """Compute fares for a DataFrame of trips with the given per-km rates"""
+    per_km = trips['Vehicle_Type'].map(rates).to_numpy(dtype=float, na_value=np.nan)
+    distance = pd.to_numeric(trips['Distance']).to_numpy(dtype=float, na_value=np.nan)
+    pickup = pd.to_datetime(trips['Pickup_Time'])
+    dropoff = pd.to_datetime(trips['Dropoff_Time'])
+
+    minutes = ((dropoff - pickup).dt.total_seconds() / 60).to_numpy(dtype=float, na_value=np.nan)
+    minutes = np.nan_to_num(np.clip(minutes, 0, None), nan=0.0)
+    hours = pickup.dt.hour.to_numpy(dtype=float, na_value=np.nan)
+    surge = np.ones(len(trips))
+    known = ~np.isnan(hours)
+    surge[known] = SURGE_BY_HOUR[hours[known].astype(int)]
+    minimum = trips['Vehicle_Type'].map(FARE_MINIMUMS).to_numpy(dtype=float, na_value=np.nan)
+
+    fare = (per_km * distance + FARE_PER_MINUTE * minutes) * surge
+    fare = np.fmax(fare, np.nan_to_num(minimum, nan=0.0))
+    fare[np.isnan(per_km) | np.isnan(distance)] = np.nan
+    return pd.Series(np.round(fare, 2), index=trips.index, name='Computed_Fare')
+
+
+AUDIT_QUERY = """
+    SELECT t.Trip_ID, v.Vehicle_Type, t.Distance, t.Pickup_Time, t.Dropoff_Time,
+           t.Booking_Time, t.Fare
+    FROM Trip t
+    LEFT JOIN Vehicle v ON t.Vehicle_ID = v.Vehicle_ID
+    WHERE t.Status = 'Completed' {where}
+"""
+
+
+def audit_chunks(db, start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield DataFrames of completed trips with their Computed_Fare, chunk by chunk"""
+    from database import QueryFilter
+
+    filters = QueryFilter().since('t.Dropoff_Time', start).until('t.Dropoff_Time', end)
+    where = "".join(" AND " + clause for clause in filters.clauses)
+    engine = db.fares
+    for description, rows in db.stream_query(AUDIT_QUERY.format(where=where),
+                                             tuple(filters.params), chunk_size):
+        frame = pd.DataFrame.from_records(rows, columns=[column[0] for column in description])
+        frame['Computed_Fare'] = engine.price_frame(frame)
+        yield frame
+
+
+def flag_mismatches(frame, tolerance=FARE_AUDIT_TOLERANCE):
+    """Rows whose stored Fare differs from Computed_Fare by more than `tolerance`"""
+    stored = pd.to_numeric(frame['Fare']).astype(float)
+    computed = frame['Computed_Fare']
+    differs = computed.notna() & (stored.isna() | ((stored - computed).abs() > tolerance))
+    flagged = frame[differs].copy()
+    flagged['Difference'] = (flagged['Computed_Fare'] - pd.to_numeric(flagged['Fare']).astype(float)).round(2)
+    return flagged
+
+
+def audit(db, start=None, end=None, tolerance=FARE_AUDIT_TOLERANCE, chunk_size=EXPORT_CHUNK_SIZE):
+    """Return (trips checked, DataFrame of mismatched trips)"""
+    checked = 0
+    flagged = []
+    for frame in audit_chunks(db, start, end, chunk_size):
+        checked += len(frame)
+        mismatches = flag_mismatches(frame, tolerance)
+        if not mismatches.empty:
+            flagged.append(mismatches)
+    columns = ['Trip_ID', 'Vehicle_Type', 'Distance', 'Pickup_Time', 'Dropoff_Time',
+               'Booking_Time', 'Fare', 'Computed_Fare', 'Difference']
+    result = pd.concat(flagged, ignore_index=True) if flagged else pd.DataFrame(columns=columns)
+    return checked, result
+
+
+def reprice(db, start=None, end=None, tolerance=FARE_AUDIT_TOLERANCE, chunk_size=EXPORT_CHUNK_SIZE):
+    """Overwrite mismatched fares with the computed ones; returns (checked, updated)
+
+    Each streamed chunk is written in its own transaction with multi-row
+    UPDATE ... JOIN statements and logged as fare_changed events. The trip
+    rollup then re-aggregates just the repriced days from those events.
+    """
+    from database import values_table
+    from outbox import record as record_event
+    from rollups import refresh as refresh_rollup
+
+    checked = updated = 0
+    for frame in audit_chunks(db, start, end, chunk_size):
+        checked += len(frame)
+        mismatches = flag_mismatches(frame, tolerance)
+        if mismatches.empty:
+            continue
+        rows = [(int(trip_id), float(fare)) for trip_id, fare in
+                zip(mismatches['Trip_ID'], mismatches['Computed_Fare'])]
+        with db.transaction() as cursor:
+            for i in range(0, len(rows), UPDATE_CHUNK_SIZE):
+                rows_sql, params = values_table(['Trip_ID', 'Fare'], rows[i:i + UPDATE_CHUNK_SIZE])
+                cursor.execute(f"""
+                    UPDATE Trip t
+                    JOIN ({rows_sql}) f ON t.Trip_ID = f.Trip_ID
+                    SET t.Fare = f.Fare
+                """, tuple(params))
+                record_event(cursor, 'Trip', 'fare_changed',
+                             [trip_id for trip_id, _ in rows[i:i + UPDATE_CHUNK_SIZE]])
+        db.cache.invalidate('Trip', *(trip_id for trip_id, _ in rows))
+        updated += len(rows)
+    if updated:
+        refresh_rollup(db, 'trip_daily')
+    return checked, updated
+
+
+def benchmark(n_trips, seed=42):
+    """Time price_frame() on synthetic trips and print the pricing rate"""
+    rng = np.random.default_rng(seed)
+    rates = {'Hatchback': 8.0, 'Sedan': 10.0, 'SUV': 15.0, 'Luxury': 25.0, 'Auto': 6.0, 'Bike': 5.0}
+    pickup = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 86400, n_trips), unit='s')
+    trips = pd.DataFrame({
+        'Vehicle_Type': rng.choice(list(rates), n_trips),
+        'Distance': rng.uniform(0.5, 40, n_trips).round(2),
+        'Pickup_Time': pickup,
+        'Dropoff_Time': pickup + pd.to_timedelta(rng.integers(120, 5400, n_trips), unit='s'),
+    })
+
+    started = time.perf_counter()
+    fares = price_frame(trips, rates)
+    elapsed = time.perf_counter() - started
+
+    print(f"Priced {len(fares):,} trips in {elapsed * 1000:.1f} ms "
+          f"({len(fares) / elapsed:,.0f} trips/sec)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit or reprice trip fares")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--audit', action='store_true', help="report trips whose stored fare differs")
+    group.add_argument('--reprice', action='store_true', help="overwrite mismatched fares")
+    group.add_argument('--benchmark', type=int, metavar='N', help="price N synthetic trips")
+    parser.add_argument('--from', dest='start', type=date.fromisoformat, help="dropoff date, inclusive")
+    parser.add_argument('--to', dest='end', type=date.fromisoformat, help="dropoff date, inclusive")
+    parser.add_argument('--tolerance', type=float, default=FARE_AUDIT_TOLERANCE)
+    parser.add_argument('--out', help="write mismatches to this CSV (audit only)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+
+    from database import Database
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Could not connect to the database")
+    started = time.perf_counter()
+    try:
+        if args.audit:
+            checked, mismatches = audit(db, args.start, args.end, args.tolerance)
+            print(f"Checked {checked:,} trips, {len(mismatches):,} fare mismatch(es) "
+                  f"in {time.perf_counter() - started:.2f} s")
+            if args.out:
+                mismatches.to_csv(args.out, index=False)
+                print(f"Mismatches written to {args.out}")
+            elif not mismatches.empty:
+                print(mismatches.head(20).to_string(index=False))
+        else:
+            checked, updated = reprice(db, args.start, args.end, args.tolerance)
+            print(f"Checked {checked:,} trips, repriced {updated:,} "
+                  f"in {time.perf_counter() - started:.2f} s")
+    finally:
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
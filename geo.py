@@ -0,0 +1,223 @@
+"""
+Geocoding and spatial lookup for Cab Service Management System
+
+- Gazetteer: resolves known location names ("MG Road, Bangalore") to
+  coordinates from an offline CSV, with no network calls.
+- GridIndex: in-process uniform grid over points (drivers) answering
+  k-nearest queries by searching outward ring by ring from the query cell.
+"""
+import csv
+import heapq
+import math
+import re
+import threading
+from functools import lru_cache
+
+from config import GAZETTEER_PATH, GEO_CELL_KM
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def normalize_place(text):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', (text or '').lower()).split())
+
+
+class Gazetteer:
+    """Offline name -> (lat, lon) lookup loaded from a CSV
+
+    The CSV has Name, Latitude, Longitude and an optional semicolon-separated
+    Aliases column. The whole text is tried first, then the longest known
+    name contained in it as whole words, so "MG Road, Bangalore" finds
+    "MG Road".
+    """
+
+    def __init__(self, places):
+        self._places = places
+        # Longest names first so "mg road metro" wins over "mg road"
+        self._by_length = sorted(places, key=len, reverse=True)
+
+    @classmethod
+    def from_csv(cls, path=GAZETTEER_PATH):
+        places = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                coords = (float(row['Latitude']), float(row['Longitude']))
+                names = [row['Name']] + (row.get('Aliases') or '').split(';')
+                for name in names:
+                    key = normalize_place(name)
+                    if key:
+                        places[key] = coords
+        return cls(places)
+
+    def __len__(self):
+        return len(self._places)
+
+    def resolve(self, text):
+        """(lat, lon) for a location name, or None if it is not known"""
+        return self._resolve(normalize_place(text))
+
+    @lru_cache(maxsize=4096)
+    def _resolve(self, key):
+        if not key:
+            return None
+        if key in self._places:
+            return self._places[key]
+        padded = f' {key} '
+        for name in self._by_length:
+            if f' {name} ' in padded:
+                return self._places[name]
+        return None
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer():
+    """Shared Gazetteer, loaded on first use (empty if the CSV is missing)"""
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            try:
+                _gazetteer = Gazetteer.from_csv()
+            except OSError:
+                _gazetteer = Gazetteer({})
+        return _gazetteer
+
+
+def geocode(text):
+    """(lat, lon) for a location name via the shared gazetteer, or (None, None)"""
+    return get_gazetteer().resolve(text) or (None, None)
+
+
+class GridIndex:
+    """Uniform lat/lon grid of points keyed by id
+
+    Cells are about `cell_km` on a side, so a k-nearest query only looks at
+    the cells around the query point. With drivers spread over a city, that
+    is a handful of cells and a few dozen distance computations. Not
+    thread-safe; the owner serializes access.
+    """
+
+    def __init__(self, cell_km=GEO_CELL_KM):
+        self.cell_km = cell_km
+        self._lat_step = cell_km / KM_PER_DEGREE_LAT
+        self._lon_step = None   # fixed from the first point's latitude
+        self._cells = {}        # (row, col) -> {id: (lat, lon)}
+        self._points = {}       # id -> (lat, lon, cell)
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def _cell(self, lat, lon):
+        if self._lon_step is None:
+            self._lon_step = self._lat_step / max(math.cos(math.radians(lat)), 0.01)
+        return (math.floor(lat / self._lat_step), math.floor(lon / self._lon_step))
+
+    def insert(self, key, lat, lon):
+        """Add or move a point"""
+        self.remove(key)
+        lat, lon = float(lat), float(lon)
+        cell = self._cell(lat, lon)
+        self._cells.setdefault(cell, {})[key] = (lat, lon)
+        self._points[key] = (lat, lon, cell)
+
+    def remove(self, key):
+        """Drop a point if present"""
+        point = self._points.pop(key, None)
+        if point is not None:
+            members = self._cells[point[2]]
+            del members[key]
+            if not members:
+                del self._cells[point[2]]
+
+    def location(self, key):
+        """(lat, lon) of a point, or None"""
+        point = self._points.get(key)
+        return point[:2] if point else None
+
+    def nearest(self, lat, lon, k=5, max_km=None):
+        """Up to k (key, distance_km) pairs, closest first
+
+        Rings of cells are searched outward from the query cell. The search
+        stops once the next ring cannot hold anything closer than the current
+        k-th result, once it is beyond max_km, or once every point has been
+        seen. When a ring would have more cells than there are occupied
+        cells, the remaining cells are scanned directly instead.
+        """
+        if not self._points or k <= 0:
+            return []
+        lat, lon = float(lat), float(lon)
+        row, col = self._cell(lat, lon)
+        # Smallest real-world width of a cell near the query point
+        lon_km = self._lon_step * KM_PER_DEGREE_LAT * math.cos(math.radians(lat))
+        ring_km = min(self.cell_km, lon_km)
+
+        # Candidates are ranked by the equirectangular approximation, which
+        # costs two multiplications and is accurate to well under 1% over a
+        # city; only the returned points get an exact haversine distance.
+        lon_scale = math.cos(math.radians(lat))
+        limit_sq = (max_km / KM_PER_DEGREE_LAT) ** 2 if max_km is not None else math.inf
+        best = []   # max-heap of (-squared degree distance, key) holding the k closest
+        seen = 0
+        ring = 0
+        total = len(self._points)
+        while seen < total:
+            # Anything in this ring is at least (ring - 1) cell widths away
+            floor_deg = max(ring - 1, 0) * ring_km / KM_PER_DEGREE_LAT
+            if floor_deg * floor_deg > limit_sq:
+                break
+            if len(best) == k and floor_deg * floor_deg > -best[0][0]:
+                break
+            if 8 * ring > len(self._cells):
+                # The rings now cover more cells than are occupied, e.g. when
+                # points sit in distant cities: scan what is left instead
+                cells = [cell for cell in self._cells
+                         if max(abs(cell[0] - row), abs(cell[1] - col)) >= ring]
+                seen = total
+            else:
+                cells = self._ring_cells(row, col, ring)
+            for cell in cells:
+                members = self._cells.get(cell)
+                if not members:
+                    continue
+                seen += len(members)
+                for key, (p_lat, p_lon) in members.items():
+                    d_lat = p_lat - lat
+                    d_lon = (p_lon - lon) * lon_scale
+                    distance_sq = d_lat * d_lat + d_lon * d_lon
+                    if distance_sq > limit_sq:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance_sq, key))
+                    elif distance_sq < -best[0][0]:
+                        heapq.heapreplace(best, (-distance_sq, key))
+            ring += 1
+        return [(key, haversine_km(lat, lon, *self._points[key][:2]))
+                for _, key in sorted(best, reverse=True)]
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        """Cells exactly `ring` steps (Chebyshev distance) from (row, col)"""
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
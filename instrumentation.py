@@ -0,0 +1,378 @@
+"""
+Query instrumentation for Cab Service Management System
+
+Database routes every query through Instrumentation.record(). Hooks subscribe
+to the resulting events. Two hooks are built in:
+- QueryStats: per-method call counts, row counts, bytes fetched and latency
+  histograms (p50/p95/p99), plus totals per app page;
+- SlowQueryLog: queries above SLOW_QUERY_MS, with their EXPLAIN plan, kept in
+  memory and appended to a JSON-lines file.
+
+Any callable taking an event dict can be added with add_hook().
+"""
+import contextlib
+import contextvars
+import json
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cache
+from config import (QUERY_STATS_DUMP_PATH, QUERY_STATS_DUMP_SECONDS, SLOW_QUERY_LOG_PATH,
+                    SLOW_QUERY_MS)
+
+# Frames skipped when naming the method that issued a query. Cached lookups
+# go through EntityCache.get() and a loader lambda before reaching
+# _fetch_row(), so those are skipped too.
+_INTERNAL_FUNCTIONS = {'execute_query', 'fetch_dataframe', 'stream_query', 'transaction',
+                       '_fetch_page', '_estimate_count', '_fetch_row', '_timed',
+                       '__enter__', '__exit__', '<lambda>'}
+_INTERNAL_FILES = {__file__, os.path.abspath(__file__), contextlib.__file__,
+                   cache.__file__, os.path.abspath(cache.__file__)}
+
+
+def caller_name(depth=2):
+    """'module.function' of the nearest frame outside the database plumbing"""
+    frame = sys._getframe(depth)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name not in _INTERNAL_FUNCTIONS and code.co_filename not in _INTERNAL_FILES:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            return f"{module}.{code.co_name}"
+        frame = frame.f_back
+    return 'unknown'
+
+
+def estimate_bytes(result):
+    """Approximate size of fetched data without walking every value
+
+    DataFrames report their own memory use. For lists of rows, the first 50
+    rows are measured and the average is scaled up.
+    """
+    if result is None:
+        return 0
+    if hasattr(result, 'memory_usage'):
+        return int(result.memory_usage(index=False).sum())
+    if not isinstance(result, list) or not result:
+        return 0
+    sample = result[:50]
+    total = 0
+    for row in sample:
+        values = row.values() if isinstance(row, dict) else row
+        for value in values:
+            total += len(value) if isinstance(value, (str, bytes, bytearray)) else 8
+    return total * len(result) // len(sample)
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram (milliseconds)
+
+    Buckets grow by 25%, from 0.05 ms to a few minutes, so any percentile is
+    reported within about 12% of its true value in constant memory.
+    """
+    GROWTH = 1.25
+    FIRST = 0.05
+    BUCKETS = 80
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        if ms <= self.FIRST:
+            index = 0
+        else:
+            index = min(self.BUCKETS, int(math.log(ms / self.FIRST, self.GROWTH)) + 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (0-100)"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.max, self.FIRST * self.GROWTH ** index)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean_ms': round(self.total / self.count, 3) if self.count else 0.0,
+                'p50_ms': round(self.percentile(50), 3),
+                'p95_ms': round(self.percentile(95), 3),
+                'p99_ms': round(self.percentile(99), 3),
+                'max_ms': round(self.max, 3)}
+
+
+class QueryStats:
+    """Aggregates events per method and per page"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+            self._pages = {}
+            self.started_at = datetime.now()
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self._methods.get(event['method'])
+            if stats is None:
+                stats = self._methods[event['method']] = {
+                    'calls': 0, 'errors': 0, 'rows': 0, 'bytes': 0, 'latency': LatencyHistogram()}
+            stats['calls'] += 1
+            stats['errors'] += event['error'] is not None
+            stats['rows'] += event['rows']
+            stats['bytes'] += event['bytes']
+            stats['latency'].observe(event['elapsed_ms'])
+
+            page = self._pages.setdefault(event['page'] or '-', {'calls': 0, 'total_ms': 0.0})
+            page['calls'] += 1
+            page['total_ms'] += event['elapsed_ms']
+
+    def snapshot(self):
+        """Plain dicts, safe to serialize"""
+        with self._lock:
+            methods = {name: dict({k: v for k, v in s.items() if k != 'latency'},
+                                  **s['latency'].summary())
+                       for name, s in self._methods.items()}
+            pages = {name: {'calls': p['calls'], 'total_ms': round(p['total_ms'], 3)}
+                     for name, p in self._pages.items()}
+            return {'since': self.started_at.isoformat(timespec='seconds'),
+                    'methods': methods, 'pages': pages}
+
+
+class SlowQueryLog:
+    """Keeps queries slower than `threshold_ms` with their EXPLAIN plan
+
+    EXPLAIN runs on a background thread so the slow request is not delayed
+    further, and at most once per query text per `explain_every` seconds.
+    """
+
+    def __init__(self, explain=None, threshold_ms=SLOW_QUERY_MS, path=SLOW_QUERY_LOG_PATH,
+                 keep=200, explain_every=300):
+        self._explain = explain
+        self.threshold_ms = threshold_ms
+        self.path = path
+        self.entries = deque(maxlen=keep)
+        self._explained = {}    # query text -> monotonic time of the last EXPLAIN
+        self._explain_every = explain_every
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=100)
+        self._worker = None
+
+    def __call__(self, event):
+        if event['elapsed_ms'] < self.threshold_ms:
+            return
+        entry = {'at': datetime.now().isoformat(timespec='milliseconds'),
+                 'method': event['method'], 'page': event['page'],
+                 'elapsed_ms': round(event['elapsed_ms'], 3), 'rows': event['rows'],
+                 'query': ' '.join(event['query'].split()),
+                 'params': repr(event['params'])[:500], 'error': event['error'], 'plan': None}
+        with self._lock:
+            self.entries.append(entry)
+            last = self._explained.get(entry['query'])
+            explain = (self._explain is not None and
+                       entry['query'].split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE') and
+                       (last is None or time.monotonic() - last > self._explain_every))
+            if explain:
+                self._explained[entry['query']] = time.monotonic()
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name='slow-query-explain',
+                                                    daemon=True)
+                    self._worker.start()
+        if explain:
+            try:
+                self._queue.put_nowait((entry, event['query'], event['params']))
+                return
+            except queue.Full:
+                pass
+        self._write(entry)
+
+    def _run(self):
+        while True:
+            entry, query, params = self._queue.get()
+            try:
+                entry['plan'] = self._explain(query, params)
+            except Exception as e:
+                entry['plan'] = f"EXPLAIN failed: {e}"
+            self._write(entry)
+
+    def _write(self, entry):
+        if not self.path:
+            return
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, default=str) + '\n')
+        except OSError:
+            pass
+
+    def recent(self):
+        with self._lock:
+            return list(reversed(self.entries))
+
+
+class InstrumentedCursor:
+    """Cursor proxy reporting every execute() to an Instrumentation as `method`
+
+    A statement that returns rows is reported once its rows have been read,
+    when the next statement runs or the cursor is closed, so `rows` counts
+    the rows fetched and the time includes fetching them. Other statements
+    are reported straight away with the affected-row count.
+    """
+
+    def __init__(self, cursor, instrumentation, method):
+        self._cursor = cursor
+        self._instrumentation = instrumentation
+        self._method = method
+        self._pending = None    # [query, params, started, finished, rows] of an unreported result
+
+    def _report(self):
+        if self._pending is not None:
+            query, params, started, finished, rows = self._pending
+            self._pending = None
+            self._instrumentation.record(self._method, query, params, finished - started, rows=rows)
+
+    def _run(self, run, query, params):
+        self._report()
+        started = time.perf_counter()
+        try:
+            result = run(query, params)
+        except BaseException as e:
+            self._instrumentation.record(self._method, query, params,
+                                         time.perf_counter() - started, error=e)
+            raise
+        if self._cursor.with_rows:
+            self._pending = [query, params, started, time.perf_counter(), 0]
+        else:
+            self._instrumentation.record(self._method, query, params,
+                                         time.perf_counter() - started,
+                                         rows=max(self._cursor.rowcount, 0))
+        return result
+
+    def _fetched(self, count):
+        if self._pending is not None:
+            self._pending[3] = time.perf_counter()
+            self._pending[4] += count
+
+    def execute(self, query, params=()):
+        return self._run(self._cursor.execute, query, params)
+
+    def executemany(self, query, seq_params):
+        return self._run(self._cursor.executemany, query, seq_params)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._fetched(row is not None)
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._cursor.fetchmany(size)
+        self._fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._fetched(len(rows))
+        return rows
+
+    def close(self):
+        self._report()
+        return self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._fetched(1)
+            yield row
+
+
+class Instrumentation:
+    """Dispatches one event per query to the registered hooks"""
+
+    def __init__(self, hooks=(), enabled=True, dump_path=QUERY_STATS_DUMP_PATH,
+                 dump_every=QUERY_STATS_DUMP_SECONDS):
+        self.hooks = list(hooks)
+        self.enabled = enabled
+        self.dump_path = dump_path
+        self.dump_every = dump_every
+        self._last_dump = time.monotonic()
+        # A context variable rather than a thread-local, so work handed to
+        # other threads with contextvars.copy_context() keeps the page
+        self._page = contextvars.ContextVar(f'instrumentation_page_{id(self)}', default=None)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def set_page(self, page):
+        """Label queries issued from the current context (the app's current page)"""
+        self._page.set(page)
+
+    def record(self, method, query, params, elapsed, rows=0, result=None, error=None):
+        """Report one finished query to every hook
+
+        elapsed is in seconds; rows defaults to len(result) for fetches.
+        A failing hook never breaks the query that triggered it.
+        """
+        if not self.enabled:
+            return
+        if result is not None and not rows:
+            rows = len(result)
+        event = {'method': method, 'page': self._page.get(),
+                 'query': query, 'params': params, 'elapsed_ms': elapsed * 1000,
+                 'rows': rows or 0, 'bytes': estimate_bytes(result),
+                 'error': None if error is None else str(error)}
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception:
+                pass
+        if self.dump_path and time.monotonic() - self._last_dump > self.dump_every:
+            self._last_dump = time.monotonic()
+            self.dump()
+
+    def hook_of(self, kind):
+        """First registered hook of a given class, or None"""
+        return next((hook for hook in self.hooks if isinstance(hook, kind)), None)
+
+    def snapshot(self):
+        """Machine-readable view of every built-in hook's data"""
+        stats = self.hook_of(QueryStats)
+        slow = self.hook_of(SlowQueryLog)
+        return {'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'stats': stats.snapshot() if stats else None,
+                'slow_queries': slow.recent() if slow else []}
+
+    def dump(self, path=None):
+        """Write snapshot() as JSON; returns the path (None if dumping is off)"""
+        path = path or self.dump_path
+        if not path:
+            return None
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, default=str, indent=2)
+            os.replace(tmp, path)
+        except OSError:
+            return None
+        return path
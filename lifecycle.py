@@ -0,0 +1,272 @@
+"""
+Trip lifecycle for Cab Service Management System
+
+Trips move Pending -> Accepted -> In_Progress -> Completed and can be
+Cancelled until they complete. apply_transitions() checks every status
+change against TRANSITIONS, stamps the trip's times and claims or releases
+its driver and vehicle in the same transaction:
+
+    Accepted     claims a free driver and an available vehicle (-> In_Use)
+    In_Progress  Pickup_Time is the actual pickup
+    Completed    Dropoff_Time, Distance and Fare (priced by the fare engine
+                 unless given); the vehicle is released (-> Available).
+                 Rejected without a distance or a fare, which would leave
+                 the trip impossible to reconcile
+    Cancelled    the vehicle is released; a started trip gets a
+                 Dropoff_Time, an unstarted one loses its Pickup_Time
+
+Events are applied in batches, e.g. completing every open trip at the end of
+a shift. Each batch is one transaction: a locking SELECT of its trips (plus
+locking reads of the drivers and vehicles it claims and of the active
+trips already holding them), a single
+multi-table UPDATE of Trip, Vehicle and Driver and one INSERT logging the
+changed trips to the change-event log, however many events it holds.
+"""
+from collections import namedtuple
+
+from outbox import record as record_event
+
+# Allowed status changes
+TRANSITIONS = {
+    'Pending': ('Accepted', 'Cancelled'),
+    'Accepted': ('In_Progress', 'Cancelled'),
+    'In_Progress': ('Completed', 'Cancelled'),
+    'Completed': (),
+    'Cancelled': (),
+}
+
+# Statuses in which a trip holds its driver and vehicle
+ACTIVE_STATUSES = ('Accepted', 'In_Progress')
+
+# Events per transaction
+BATCH_SIZE = 500
+
+# A requested status change. driver_id / vehicle_id are required for
+# Accepted; distance and fare are used for Completed. `at` defaults to the
+# database's NOW().
+TripEvent = namedtuple('TripEvent', ['trip_id', 'status', 'driver_id', 'vehicle_id',
+                                     'distance', 'fare', 'at'],
+                       defaults=(None, None, None, None, None))
+
+# applied: Trip_IDs that changed; rejected: (event, reason) pairs
+TransitionResult = namedtuple('TransitionResult', ['applied', 'rejected'])
+
+# Columns of the per-trip rows joined into the batch UPDATE
+_UPDATE_COLUMNS = ['Trip_ID', 'Status', 'Driver_ID', 'Vehicle_ID', 'Pickup_Time',
+                   'Dropoff_Time', 'Distance', 'Fare', 'Vehicle_Status']
+
+
+def can_transition(current, status):
+    """Whether a trip in status `current` may move to `status`"""
+    return status in TRANSITIONS.get(current, ())
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _lock_trips(cursor, trip_ids):
+    """Lock the batch's trips; returns {Trip_ID: row} (rows include NOW() as Now)"""
+    cursor.execute(f"""
+        SELECT t.Trip_ID, t.Status, t.Driver_ID, t.Vehicle_ID, t.Pickup_Time,
+               t.Dropoff_Time, t.Distance, t.Fare, v.Vehicle_Type, NOW() AS Now
+        FROM Trip t
+        LEFT JOIN Vehicle v ON t.Vehicle_ID = v.Vehicle_ID
+        WHERE t.Trip_ID IN ({_placeholders(trip_ids)})
+        ORDER BY t.Trip_ID
+        FOR UPDATE OF t
+    """, tuple(trip_ids))
+    return {row['Trip_ID']: row for row in cursor.fetchall()}
+
+
+def _busy_trips(cursor, column, ids):
+    """{ID: Trip_ID} of the active trip holding each driver or vehicle in `ids`
+
+    A locking read (FOR SHARE), so it sees assignments committed while this
+    transaction waited for the Driver / Vehicle locks; a plain subquery would
+    read the snapshot taken before the wait.
+    """
+    cursor.execute(f"""
+        SELECT {column}, Trip_ID FROM Trip
+        WHERE {column} IN ({_placeholders(ids)}) AND Status IN ('Accepted', 'In_Progress')
+        ORDER BY Trip_ID DESC
+        FOR SHARE
+    """, tuple(ids))
+    return {row[column]: row['Trip_ID'] for row in cursor.fetchall()}
+
+
+def _lock_claims(cursor, events):
+    """Lock the drivers and vehicles that Accepted events want to claim
+
+    Locks are taken in the Trip -> Driver -> Vehicle order used by the
+    dispatcher. Returns ({Driver_ID: row}, {Vehicle_ID: row}); each row
+    carries the ID of an active trip already holding it as Busy_Trip_ID.
+    """
+    driver_ids = sorted({e.driver_id for e in events if e.driver_id is not None})
+    vehicle_ids = sorted({e.vehicle_id for e in events if e.vehicle_id is not None})
+    drivers, vehicles = {}, {}
+    if driver_ids:
+        cursor.execute(f"""
+            SELECT Driver_ID, Status FROM Driver
+            WHERE Driver_ID IN ({_placeholders(driver_ids)})
+            ORDER BY Driver_ID
+            FOR UPDATE
+        """, tuple(driver_ids))
+        drivers = {row['Driver_ID']: row for row in cursor.fetchall()}
+        busy = _busy_trips(cursor, 'Driver_ID', driver_ids)
+        for driver_id, driver in drivers.items():
+            driver['Busy_Trip_ID'] = busy.get(driver_id)
+    if vehicle_ids:
+        cursor.execute(f"""
+            SELECT Vehicle_ID, Status, Vehicle_Type FROM Vehicle
+            WHERE Vehicle_ID IN ({_placeholders(vehicle_ids)})
+            ORDER BY Vehicle_ID
+            FOR UPDATE
+        """, tuple(vehicle_ids))
+        vehicles = {row['Vehicle_ID']: row for row in cursor.fetchall()}
+        busy = _busy_trips(cursor, 'Vehicle_ID', vehicle_ids)
+        for vehicle_id, vehicle in vehicles.items():
+            vehicle['Busy_Trip_ID'] = busy.get(vehicle_id)
+    return drivers, vehicles
+
+
+def _claim_conflict(event, drivers, vehicles, claimed):
+    """Why an Accepted event cannot claim its driver and vehicle, or None"""
+    if event.driver_id is None or event.vehicle_id is None:
+        return f"Trip #{event.trip_id} needs a driver and a vehicle to be accepted"
+    driver = drivers.get(event.driver_id)
+    if driver is None or driver['Status'] != 'Active':
+        return f"Driver #{event.driver_id} is not active"
+    if driver['Busy_Trip_ID'] or ('Driver', event.driver_id) in claimed:
+        return f"Driver #{event.driver_id} is already on trip #{driver['Busy_Trip_ID'] or '(this batch)'}"
+    vehicle = vehicles.get(event.vehicle_id)
+    if vehicle is None or vehicle['Status'] != 'Available':
+        status = vehicle['Status'] if vehicle else 'missing'
+        return f"Vehicle #{event.vehicle_id} is not available ({status})"
+    if vehicle['Busy_Trip_ID'] or ('Vehicle', event.vehicle_id) in claimed:
+        return f"Vehicle #{event.vehicle_id} is already on trip #{vehicle['Busy_Trip_ID'] or '(this batch)'}"
+    return None
+
+
+def _transition(trip, event, drivers, vehicles, claimed, fares):
+    """Apply one event to a locked trip row in place; returns a rejection reason or None"""
+    current = trip['Status']
+    if not can_transition(current, event.status):
+        if event.status == 'Accepted':
+            return f"Trip #{event.trip_id} is already {current}"
+        return f"Trip #{event.trip_id} is {current} and cannot become {event.status}"
+    at = event.at or trip['Now']
+
+    if event.status == 'Accepted':
+        reason = _claim_conflict(event, drivers, vehicles, claimed)
+        if reason:
+            return reason
+        claimed.update({('Driver', event.driver_id), ('Vehicle', event.vehicle_id)})
+        trip.update(Driver_ID=event.driver_id, Vehicle_ID=event.vehicle_id, Pickup_Time=at,
+                    Vehicle_Type=vehicles[event.vehicle_id]['Vehicle_Type'], Vehicle_Status='In_Use')
+    elif event.status == 'In_Progress':
+        trip['Pickup_Time'] = at
+    elif event.status == 'Completed':
+        distance = trip['Distance'] if event.distance is None else event.distance
+        if distance is None:
+            return f"Trip #{event.trip_id} needs a distance to be completed"
+        fare = event.fare
+        if fare is None:
+            fare = fares.quote(trip['Vehicle_Type'], distance, trip['Pickup_Time'], at)
+            if fare is None:
+                return f"Trip #{event.trip_id} has no fare rate for vehicle type {trip['Vehicle_Type']}"
+        trip.update(Dropoff_Time=at, Distance=distance, Fare=fare, Vehicle_Status='Available')
+    elif event.status == 'Cancelled':
+        if current == 'In_Progress':
+            trip['Dropoff_Time'] = at
+        else:
+            trip['Pickup_Time'] = None
+        if current in ACTIVE_STATUSES:
+            trip['Vehicle_Status'] = 'Available'
+    trip['Status'] = event.status
+    return None
+
+
+def _apply_batch(db, events):
+    """Apply one batch of events in one transaction; returns (applied, rejected)"""
+    from database import values_table
+
+    applied, rejected = [], []
+    with db.transaction() as cursor:
+        trips = _lock_trips(cursor, sorted({e.trip_id for e in events}))
+        drivers, vehicles = _lock_claims(cursor, [e for e in events
+                                                  if e.status == 'Accepted' and e.trip_id in trips])
+        for trip in trips.values():
+            trip['Vehicle_Status'] = None
+
+        claimed = set()
+        for event in events:
+            trip = trips.get(event.trip_id)
+            reason = (f"Trip #{event.trip_id} no longer exists" if trip is None else
+                      _transition(trip, event, drivers, vehicles, claimed, db.fares))
+            if reason:
+                rejected.append((event, reason))
+            elif event.trip_id not in applied:
+                applied.append(event.trip_id)
+
+        rows = [[trips[trip_id][column] for column in _UPDATE_COLUMNS] for trip_id in applied]
+        if rows:
+            # A released vehicle only goes back to Available if it is still
+            # In_Use (not, say, moved to Maintenance meanwhile)
+            rows_sql, params = values_table(_UPDATE_COLUMNS, rows)
+            cursor.execute(f"""
+                UPDATE Trip t
+                JOIN ({rows_sql}) e ON t.Trip_ID = e.Trip_ID
+                LEFT JOIN Vehicle v ON v.Vehicle_ID = e.Vehicle_ID
+                LEFT JOIN Driver d ON d.Driver_ID = e.Driver_ID
+                SET t.Status = e.Status, t.Driver_ID = e.Driver_ID, t.Vehicle_ID = e.Vehicle_ID,
+                    t.Pickup_Time = e.Pickup_Time, t.Dropoff_Time = e.Dropoff_Time,
+                    t.Distance = e.Distance, t.Fare = e.Fare,
+                    v.Status = CASE
+                        WHEN e.Vehicle_Status IS NULL THEN v.Status
+                        WHEN e.Vehicle_Status = 'Available' AND v.Status <> 'In_Use' THEN v.Status
+                        ELSE e.Vehicle_Status
+                    END,
+                    d.Last_Active = NOW()
+            """, tuple(params))
+            record_event(cursor, 'Trip', 'status_changed', applied)
+
+    touched = [trips[trip_id] for trip_id in applied]
+    claims = [(trip['Driver_ID'], trip['Vehicle_ID']) for trip in touched
+              if trip['Vehicle_Status'] == 'In_Use']
+    released = any(trip['Vehicle_Status'] == 'Available' for trip in touched)
+
+    if applied:
+        db.cache.invalidate('Trip', *applied)
+        driver_ids = {trip['Driver_ID'] for trip in touched if trip['Driver_ID']}
+        vehicle_ids = {trip['Vehicle_ID'] for trip in touched if trip['Vehicle_ID']}
+        if driver_ids:
+            db.cache.invalidate('Driver', *driver_ids)
+        if vehicle_ids:
+            db.cache.invalidate('Vehicle', *vehicle_ids)
+    # Freed resources and failed claims mean our availability snapshot is stale
+    if released or any(event.status == 'Accepted' for event, _ in rejected):
+        db.availability.invalidate()
+    else:
+        db.availability.claim(claims)
+    return applied, rejected
+
+
+def apply_transitions(db, events, batch_size=BATCH_SIZE):
+    """Apply trip status changes, one transaction per `batch_size` events
+
+    Events are applied in order, and a trip may appear more than once (e.g.
+    In_Progress then Completed). A driver or vehicle released by an event can
+    only be claimed again from the next batch on. Rejected events leave their
+    trip unchanged and do not affect the rest of the batch.
+
+    Returns a TransitionResult. Database errors are raised; the failing batch
+    is rolled back, earlier batches stay committed.
+    """
+    events = list(events)
+    applied, rejected = [], []
+    for start in range(0, len(events), batch_size):
+        batch_applied, batch_rejected = _apply_batch(db, events[start:start + batch_size])
+        applied.extend(batch_applied)
+        rejected.extend(batch_rejected)
+    return TransitionResult(applied, rejected)
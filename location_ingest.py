@@ -0,0 +1,346 @@
+"""
+Driver location ingest for Cab Service Management System
+
+Driver apps ping their position every few seconds. Pings are coalesced in
+memory, so only the latest position per driver is kept, and written to the
+Driver table in periodic multi-row batches. The current positions (and the
+availability index's spatial grid) are updated on every ping, so
+nearest-driver lookups never wait for MySQL.
+
+Usage:
+    python location_ingest.py serve                       # HTTP endpoint, flushing to MySQL
+    python location_ingest.py loadgen --seconds 10        # in-process ingest benchmark
+    python location_ingest.py loadgen --url http://127.0.0.1:8765 --rate 10000
+
+Endpoint:
+    POST /pings              {"driver_id": 1, "lat": 12.97, "lon": 77.6, "ts": 1700000000.0}
+                             or a JSON list of such objects ("ts" is optional)
+    GET  /drivers/<id>       latest known position
+    GET  /nearest?lat=..&lon=..&k=5
+    GET  /stats
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from config import LOCATION_FLUSH_SECONDS, LOCATION_INGEST_HOST, LOCATION_INGEST_PORT
+
+# How far a ping's ts may be ahead of this host's clock
+MAX_CLOCK_SKEW_SECONDS = 300
+
+
+class LocationIngestor:
+    """Coalesces driver pings and flushes them in batches
+
+    write: callable taking a list of (driver_id, lat, lon, seen_at) rows,
+           normally Database.record_driver_locations; None keeps positions in
+           memory only
+    on_move: callable (driver_id, lat, lon) run for every accepted ping,
+             normally AvailabilityIndex.move_driver
+    """
+
+    def __init__(self, write=None, on_move=None, flush_interval=LOCATION_FLUSH_SECONDS):
+        self._write = write
+        self._on_move = on_move
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._positions = {}    # driver_id -> (lat, lon, ts), latest known
+        self._pending = {}      # driver_id -> (lat, lon, ts), not yet written
+        self._stop = threading.Event()
+        self._thread = None
+        self.metrics = {'pings': 0, 'stale': 0, 'rejected': 0, 'flushes': 0, 'rows_written': 0,
+                        'rows_dropped': 0, 'flush_errors': 0, 'last_flush_ms': 0.0}
+
+    def ping(self, driver_id, lat, lon, ts=None):
+        """Accept one position; returns False for a ping older than the latest known
+
+        A ts that is not a finite number of seconds, or is more than
+        MAX_CLOCK_SKEW_SECONDS ahead of this clock (e.g. milliseconds since
+        the epoch), is rejected: stored, it would make every later ping
+        from the driver look stale.
+        """
+        lat, lon = float(lat), float(lon)
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+            raise ValueError(f"coordinates out of range: {lat}, {lon}")
+        now = time.time()
+        if ts is None:
+            ts = now
+        else:
+            try:
+                ts = float(ts)
+            except (TypeError, ValueError):
+                ts = math.nan
+            if not (0.0 <= ts <= now + MAX_CLOCK_SKEW_SECONDS):     # also False for NaN
+                with self._lock:
+                    self.metrics['pings'] += 1
+                    self.metrics['rejected'] += 1
+                return False
+        with self._lock:
+            self.metrics['pings'] += 1
+            current = self._positions.get(driver_id)
+            if current is not None and current[2] > ts:
+                self.metrics['stale'] += 1
+                return False
+            self._positions[driver_id] = self._pending[driver_id] = (lat, lon, ts)
+        if self._on_move is not None:
+            self._on_move(driver_id, lat, lon)
+        return True
+
+    def ping_many(self, pings):
+        """Accept dicts with driver_id, lat, lon and optional ts; returns the number accepted"""
+        accepted = 0
+        for p in pings:
+            accepted += self.ping(int(p['driver_id']), p['lat'], p['lon'], p.get('ts'))
+        return accepted
+
+    def position(self, driver_id):
+        """Latest (lat, lon, ts) for a driver, or None"""
+        with self._lock:
+            return self._positions.get(driver_id)
+
+    def flush(self):
+        """Write everything pending in one batch; returns the number of rows written
+
+        The pending map is swapped out under the lock, so pings keep flowing
+        while the batch is written. If the write fails, positions that have
+        not been superseded since go back into the pending map for the next
+        flush. A row whose ts cannot be converted is dropped and counted
+        rather than failing the batch.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        started = time.perf_counter()
+        rows, dropped = [], []
+        try:
+            for driver_id, (lat, lon, ts) in batch.items():
+                try:
+                    rows.append((driver_id, lat, lon, datetime.fromtimestamp(ts)))
+                except (ValueError, OverflowError, OSError):
+                    dropped.append(driver_id)
+            if dropped:
+                with self._lock:
+                    self.metrics['rows_dropped'] += len(dropped)
+                    for driver_id in dropped:
+                        batch.pop(driver_id)
+            if self._write is not None and rows:
+                self._write(rows)
+        except Exception:
+            with self._lock:
+                self.metrics['flush_errors'] += 1
+                for driver_id, position in batch.items():
+                    self._pending.setdefault(driver_id, position)
+            raise
+        with self._lock:
+            self.metrics['flushes'] += 1
+            self.metrics['rows_written'] += len(rows)
+            self.metrics['last_flush_ms'] = (time.perf_counter() - started) * 1000
+        return len(rows)
+
+    def start(self):
+        """Flush every `flush_interval` seconds on a background thread"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='location-flush', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the flush thread after a final flush"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[{datetime.now():%H:%M:%S}] location flush failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return dict(self.metrics, drivers=len(self._positions), pending=len(self._pending))
+
+
+def make_handler(ingestor, nearest=None):
+    """HTTP request handler bound to an ingestor (and an optional nearest-driver lookup)"""
+
+    class PingHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'      # keep-alive, so clients reuse one connection
+        disable_nagle_algorithm = True     # headers and body go out as separate small writes
+
+        def _reply(self, status, body):
+            data = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != '/pings':
+                return self._reply(404, {'error': 'not found'})
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'null')
+                pings = payload if isinstance(payload, list) else [payload]
+                accepted = ingestor.ping_many(pings)
+            except (ValueError, KeyError, TypeError) as e:
+                return self._reply(400, {'error': str(e)})
+            self._reply(200, {'accepted': accepted, 'received': len(pings)})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/stats':
+                return self._reply(200, ingestor.stats())
+            if url.path.startswith('/drivers/'):
+                try:
+                    position = ingestor.position(int(url.path.rsplit('/', 1)[1]))
+                except ValueError:
+                    return self._reply(400, {'error': 'bad driver id'})
+                if position is None:
+                    return self._reply(404, {'error': 'no position'})
+                return self._reply(200, {'lat': position[0], 'lon': position[1], 'ts': position[2]})
+            if url.path == '/nearest' and nearest is not None:
+                query = parse_qs(url.query)
+                try:
+                    lat, lon = float(query['lat'][0]), float(query['lon'][0])
+                    k = int(query.get('k', ['5'])[0])
+                except (KeyError, ValueError):
+                    return self._reply(400, {'error': 'lat, lon and optional k are required'})
+                return self._reply(200, [{'driver_id': row['Driver_ID'], 'distance_km': round(km, 3)}
+                                         for row, km in nearest(lat, lon, k)])
+            self._reply(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            pass    # one line per ping would swamp the console
+
+    return PingHandler
+
+
+def serve(ingestor, host=LOCATION_INGEST_HOST, port=LOCATION_INGEST_PORT, nearest=None):
+    """Run the HTTP endpoint until interrupted"""
+    server = ThreadingHTTPServer((host, port), make_handler(ingestor, nearest))
+    print(f"Accepting driver pings on http://{host}:{port}/pings")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def _synthetic_pings(n_drivers, rng):
+    """Endless stream of (driver_id, lat, lon) jittering around Bangalore"""
+    positions = [(12.85 + rng.random() * 0.3, 77.45 + rng.random() * 0.35) for _ in range(n_drivers)]
+    while True:
+        driver_id = rng.randrange(n_drivers)
+        lat, lon = positions[driver_id]
+        lat += rng.uniform(-0.0005, 0.0005)
+        lon += rng.uniform(-0.0005, 0.0005)
+        positions[driver_id] = (lat, lon)
+        yield driver_id + 1, lat, lon
+
+
+def loadgen(seconds=10, n_drivers=5000, rate=0, url=None, batch=100, seed=42):
+    """Send synthetic pings and print the sustained rate
+
+    In-process (no url) the pings go through LocationIngestor.ping() with the
+    driver spatial grid attached and a flush every LOCATION_FLUSH_SECONDS, on
+    the calling thread only. With a url they are POSTed to a running endpoint
+    in batches of `batch`. rate=0 sends as fast as possible.
+    """
+    rng = random.Random(seed)
+    pings = _synthetic_pings(n_drivers, rng)
+    sent = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+
+    if url is None:
+        from geo import GridIndex
+        grid = GridIndex()
+        ingestor = LocationIngestor(write=None, on_move=grid.insert)
+        next_flush = started + ingestor.flush_interval
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if rate and sent >= (now - started) * rate:
+                time.sleep(0.001)
+                continue
+            for _ in range(batch):
+                ingestor.ping(*next(pings))
+            sent += batch
+            if now >= next_flush:
+                ingestor.flush()
+                next_flush = now + ingestor.flush_interval
+        ingestor.flush()
+        stats = ingestor.stats()
+        extra = f", {stats['flushes']} flushes, {stats['rows_written']:,} rows coalesced"
+    else:
+        import http.client
+        target = urlparse(url)
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80)
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if rate and sent >= (now - started) * rate:
+                time.sleep(0.001)
+                continue
+            body = json.dumps([{'driver_id': d, 'lat': lat, 'lon': lon}
+                               for d, lat, lon in (next(pings) for _ in range(batch))])
+            conn.request('POST', '/pings', body, {'Content-Type': 'application/json'})
+            conn.getresponse().read()
+            sent += batch
+        conn.close()
+        extra = ""
+
+    elapsed = time.perf_counter() - started
+    print(f"Sent {sent:,} pings from {n_drivers:,} drivers in {elapsed:.1f} s "
+          f"({sent / elapsed:,.0f} pings/sec{extra})")
+    return sent / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Driver location ingest endpoint and load generator")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve_parser = sub.add_parser('serve', help="run the HTTP ping endpoint")
+    serve_parser.add_argument('--host', default=LOCATION_INGEST_HOST)
+    serve_parser.add_argument('--port', type=int, default=LOCATION_INGEST_PORT)
+    load_parser = sub.add_parser('loadgen', help="send synthetic pings")
+    load_parser.add_argument('--seconds', type=float, default=10)
+    load_parser.add_argument('--drivers', type=int, default=5000)
+    load_parser.add_argument('--rate', type=int, default=0, help="pings/sec target (0 = as fast as possible)")
+    load_parser.add_argument('--url', help="POST to a running endpoint instead of ingesting in-process")
+    load_parser.add_argument('--batch', type=int, default=100, help="pings per request")
+    args = parser.parse_args()
+
+    if args.command == 'loadgen':
+        loadgen(args.seconds, args.drivers, args.rate, args.url, args.batch)
+        return
+
+    from database import Database
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Could not connect to the database")
+    ingestor = LocationIngestor(db.record_driver_locations, db.availability.move_driver).start()
+    try:
+        serve(ingestor, args.host, args.port, db.availability.nearest_drivers)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingestor.stop()
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
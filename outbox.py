@@ -0,0 +1,293 @@
+"""
+Change-event log (outbox) for Cab Service Management System
+
+Every Trip and Payment write made through Database, the lifecycle engine,
+the dispatcher or the fare repricer appends rows to ChangeEvent in the same
+transaction. Each row holds a JSON snapshot of the changed row. Downstream
+work (rollups, notifications, cache warmers) tails the log from a stored
+offset with a Consumer instead of polling whole tables.
+
+Event types: created, status_changed, fare_changed and deleted.
+bulk_import logs the trips and payments it inserts. Writes that bypass
+these paths are not recorded (imports of other tables, foreign-key
+cascades).
+
+Event IDs come from AUTO_INCREMENT. A transaction can therefore commit an
+event with a lower ID after a consumer has read past it. Consumers stop at
+the first missing ID until the event after it is OUTBOX_GAP_GRACE_SECONDS
+old, then skip it and count it in ConsumerOffset.Skipped_Events. That is
+only safe if no transaction holds an event for that long, so
+Database.transaction() rolls back a transaction that is still open
+OUTBOX_MAX_TRANSACTION_SECONDS after its first event; keep the grace well
+above that limit. Events are written with plain multi-row INSERTs, which
+get consecutive IDs, so gaps come only from rolled-back transactions.
+
+Usage:
+    python outbox.py --tail               # print events as they are committed
+    python outbox.py --lag                # position of every consumer
+    python outbox.py --prune 7            # drop consumed events older than 7 days
+"""
+import argparse
+import json
+import time
+from datetime import date
+
+from config import OUTBOX_BATCH_SIZE, OUTBOX_GAP_GRACE_SECONDS, OUTBOX_RETENTION_DAYS
+
+# entity -> (table, key column, columns in the payload snapshot)
+SNAPSHOTS = {
+    'Trip': ('Trip', 'Trip_ID', ['User_ID', 'Driver_ID', 'Vehicle_ID', 'Status', 'Booking_Time',
+                                 'Pickup_Time', 'Dropoff_Time', 'Distance', 'Fare']),
+    'Payment': ('Payment', 'Payment_ID', ['Trip_ID', 'Amount', 'Payment_Mode', 'Payment_Status',
+                                          'Payment_DateTime', 'Reference_Number']),
+}
+
+# Rows per prune DELETE
+PRUNE_CHUNK_SIZE = 10000
+
+
+def record(cursor, entity, event_type, ids, previous=None, previous_by_id=None):
+    """Append one event per row of `entity` in `ids`, in the caller's transaction
+
+    The payload is the row as it is when this runs, so record deletions
+    before the DELETE. `previous` (a dict) is added to the payload under
+    'Previous' for values the change overwrote; `previous_by_id` gives a
+    separate dict per ID instead.
+
+    The snapshots are read first and inserted with one INSERT ... VALUES:
+    an INSERT ... SELECT can reserve more AUTO_INCREMENT values than it uses,
+    and every unused one would hold consumers up for the gap grace.
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    if getattr(cursor, 'events_logged_at', None) is None:
+        cursor.events_logged_at = time.monotonic()
+    table, key, columns = SNAPSHOTS[entity]
+    payload = "JSON_OBJECT(" + ", ".join(f"'{column}', {column}" for column in columns) + ")"
+    params = []
+    join = ""
+    if previous:
+        payload = f"JSON_SET({payload}, '$.Previous', CAST(%s AS JSON))"
+        params.append(json.dumps(previous, default=str))
+    elif previous_by_id:
+        from database import values_table
+
+        rows_sql, rows_params = values_table(['Previous_ID', 'Previous'], [
+            (i, json.dumps(previous_by_id.get(i), default=str)) for i in ids])
+        payload = f"JSON_SET({payload}, '$.Previous', CAST(prev.Previous AS JSON))"
+        join = f"LEFT JOIN ({rows_sql}) prev ON {key} = prev.Previous_ID"
+        params.extend(rows_params)
+    params.extend(ids)
+    cursor.execute(f"""
+        SELECT {key} AS Entity_ID, {payload} AS Payload
+        FROM {table}
+        {join}
+        WHERE {key} IN ({', '.join(['%s'] * len(ids))})
+        ORDER BY {key}
+        FOR SHARE
+    """, tuple(params))
+    rows = cursor.fetchall()
+    if not rows:
+        return
+    values = []
+    for row in rows:
+        snapshot = row['Payload']
+        values.extend((entity, row['Entity_ID'], event_type,
+                       snapshot.decode() if isinstance(snapshot, bytes) else snapshot))
+    cursor.execute(f"""
+        INSERT INTO ChangeEvent (Entity, Entity_ID, Event_Type, Payload)
+        VALUES {', '.join(['(%s, %s, %s, %s)'] * len(rows))}
+    """, tuple(values))
+
+
+def event_date(value):
+    """Date of a DATETIME value taken from a payload ('YYYY-MM-DD hh:mm:ss...'), or None"""
+    return date.fromisoformat(value[:10]) if value else None
+
+
+def read(cursor, after, limit=OUTBOX_BATCH_SIZE, entities=None, grace=OUTBOX_GAP_GRACE_SECONDS):
+    """(events, position, skipped): events after ID `after`, oldest first, the
+    last ID read past, and how many missing IDs were given up on
+
+    At most `limit` events are scanned. Only events of `entities` (all when
+    None) are returned, but the position moves past the others too.
+    Payloads are decoded to dicts.
+    """
+    cursor.execute("""
+        SELECT Event_ID, Entity, Entity_ID, Event_Type, Payload, Created_At,
+               Created_At <= NOW(3) - INTERVAL %s MICROSECOND AS Settled
+        FROM ChangeEvent
+        WHERE Event_ID > %s
+        ORDER BY Event_ID
+        LIMIT %s
+    """, (int(grace * 1_000_000), after, limit))
+
+    events = []
+    position = after
+    skipped = 0
+    for event in cursor.fetchall():
+        if event['Event_ID'] != position + 1:
+            if not event['Settled']:
+                break    # a lower ID may still be committed
+            skipped += event['Event_ID'] - position - 1
+        position = event['Event_ID']
+        if entities is None or event['Entity'] in entities:
+            payload = event.pop('Payload')
+            event['Payload'] = json.loads(payload) if isinstance(payload, (str, bytes)) else payload
+            del event['Settled']
+            events.append(event)
+    return events, position, skipped
+
+
+class Consumer:
+    """Reads ChangeEvent rows after a stored offset
+
+    poll() and commit() run on the caller's cursor. A consumer that writes to
+    the database can then store its offset in the same transaction as its
+    results, so each event takes effect exactly once. poll() locks the
+    consumer's offset row until that transaction ends, so two processes
+    running the same consumer take turns.
+    """
+
+    def __init__(self, name, entities=None, grace=OUTBOX_GAP_GRACE_SECONDS):
+        self.name = name
+        self.entities = set(entities) if entities else None
+        self.grace = grace
+        self.offset = None      # stored offset read by the last poll()
+        self.position = None    # last event ID that poll() got past
+        self.skipped = 0        # missing IDs the last poll() gave up on
+
+    def _lock_offset(self, cursor, skip_locked=False):
+        cursor.execute(f"""
+            SELECT Last_Event_ID FROM ConsumerOffset WHERE Consumer = %s
+            FOR UPDATE{' SKIP LOCKED' if skip_locked else ''}
+        """, (self.name,))
+        return cursor.fetchone()
+
+    def poll(self, cursor, limit=OUTBOX_BATCH_SIZE, wait=True):
+        """Events after the stored offset, oldest first (see read())
+
+        With wait=False nothing is returned (and commit() does nothing) when
+        another process holds this consumer's offset, instead of waiting
+        for it.
+        """
+        row = self._lock_offset(cursor, skip_locked=not wait)
+        if row is None:
+            cursor.execute("SELECT 1 FROM ConsumerOffset WHERE Consumer = %s", (self.name,))
+            if cursor.fetchone():
+                self.offset = self.position = None
+                return []
+            cursor.execute("INSERT IGNORE INTO ConsumerOffset (Consumer, Last_Event_ID) VALUES (%s, 0)",
+                           (self.name,))
+            row = self._lock_offset(cursor)
+        self.offset = int(row['Last_Event_ID'])
+        events, self.position, self.skipped = read(cursor, self.offset, limit, self.entities, self.grace)
+        return events
+
+    def commit(self, cursor):
+        """Store the position reached by the last poll() as the new offset"""
+        if self.position is not None and self.position != self.offset:
+            cursor.execute("""
+                UPDATE ConsumerOffset
+                SET Last_Event_ID = %s, Skipped_Events = Skipped_Events + %s, Updated_At = NOW()
+                WHERE Consumer = %s
+            """, (self.position, self.skipped, self.name))
+            self.offset = self.position
+            self.skipped = 0
+
+    def skip(self, cursor):
+        """Move the stored offset to the newest event, e.g. after a full rebuild"""
+        cursor.execute("""
+            INSERT INTO ConsumerOffset (Consumer, Last_Event_ID, Updated_At)
+            SELECT %s, COALESCE(MAX(Event_ID), 0), NOW() FROM ChangeEvent
+            ON DUPLICATE KEY UPDATE Last_Event_ID = VALUES(Last_Event_ID), Updated_At = NOW()
+        """, (self.name,))
+
+    def consume(self, db, handler, limit=OUTBOX_BATCH_SIZE, wait=True):
+        """Pass one poll's events to handler(cursor, events) and commit; returns the count
+
+        Runs in one transaction: if the handler raises, nothing is committed
+        and the same events are delivered again next time.
+        """
+        with db.transaction(invalidate_caches=False) as cursor:
+            events = self.poll(cursor, limit, wait)
+            if events:
+                handler(cursor, events)
+            self.commit(cursor)
+        return len(events)
+
+
+def lag(db):
+    """[{Consumer, Last_Event_ID, Behind, Skipped_Events, Updated_At}] for every consumer"""
+    return db.execute_query("""
+        SELECT c.Consumer, c.Last_Event_ID,
+               COALESCE((SELECT MAX(Event_ID) FROM ChangeEvent), 0) - c.Last_Event_ID AS Behind,
+               c.Skipped_Events, c.Updated_At
+        FROM ConsumerOffset c
+        ORDER BY c.Consumer
+    """, fetch=True)
+
+
+def prune(db, older_than_days=OUTBOX_RETENTION_DAYS):
+    """Delete events older than `older_than_days` that every consumer has read; returns the count"""
+    deleted = 0
+    while True:
+        with db.transaction(invalidate_caches=False) as cursor:
+            cursor.execute("""
+                DELETE FROM ChangeEvent
+                WHERE Created_At < NOW() - INTERVAL %s DAY
+                  AND Event_ID <= COALESCE((SELECT MIN(Last_Event_ID) FROM ConsumerOffset), 0)
+                ORDER BY Event_ID
+                LIMIT %s
+            """, (older_than_days, PRUNE_CHUNK_SIZE))
+            count = cursor.rowcount
+        deleted += count
+        if count < PRUNE_CHUNK_SIZE:
+            return deleted
+
+
+def tail(db, interval=1.0):
+    """Print events as they are committed until interrupted (no offset is stored)"""
+    position = db.execute_query("SELECT COALESCE(MAX(Event_ID), 0) AS Last FROM ChangeEvent",
+                                fetch=True)[0]['Last']
+    while True:
+        with db.transaction(invalidate_caches=False) as cursor:
+            events, position, _ = read(cursor, position)
+        for event in events:
+            print(f"{event['Event_ID']:>10} {event['Created_At']} {event['Entity']:<8} "
+                  f"#{event['Entity_ID']:<8} {event['Event_Type']:<15} {json.dumps(event['Payload'])}")
+        if not events:
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and maintain the change-event log")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--tail', action='store_true', help="print events as they are committed")
+    group.add_argument('--lag', action='store_true', help="show every consumer's position")
+    group.add_argument('--prune', type=int, metavar='DAYS', help="drop consumed events older than DAYS")
+    args = parser.parse_args()
+
+    from database import Database
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Could not connect to the database")
+    try:
+        if args.tail:
+            tail(db)
+        elif args.lag:
+            for row in lag(db) or []:
+                print(f"{row['Consumer']:<30} at {row['Last_Event_ID']:>10}  "
+                      f"{row['Behind']:>8} behind  {row['Skipped_Events']:>6} skipped  "
+                      f"(updated {row['Updated_At']})")
+        else:
+            print(f"Deleted {prune(db, args.prune):,} event(s)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Per-rerun render profiler for Cab Service Management System
+
+Streamlit reruns app.py top to bottom on every interaction. With
+PROFILE_RERUNS=1, each rerun records:
+- wall time per page section (nested);
+- the queries each section issued, taken from the query instrumentation
+  hooks;
+- the rows and bytes each query returned.
+
+The result is rendered as an icicle (flame-style) chart under the page, with
+a warning when the rerun goes over RERUN_QUERY_BUDGET queries or
+RERUN_TIME_BUDGET_MS.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from config import PROFILE_RERUNS, RERUN_QUERY_BUDGET, RERUN_TIME_BUDGET_MS
+
+# Context variable so queries run on worker threads with a copied context
+# (see async_db.py) are still attributed
+_active = contextvars.ContextVar('rerun_profile', default=None)
+
+
+def query_hook(event):
+    """Instrumentation hook: attribute a query to the running profile's current section"""
+    profile = _active.get()
+    if profile is not None:
+        profile.record_query(event)
+
+
+class _Section:
+    __slots__ = ('name', 'started', 'elapsed_ms', 'children', 'queries')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.elapsed_ms = None
+        self.children = []
+        self.queries = []
+
+    def close(self):
+        if self.elapsed_ms is None:
+            self.elapsed_ms = (time.perf_counter() - self.started) * 1000
+
+    def walk(self, path=()):
+        """Yield (path, section) depth first"""
+        path = path + (self.name,)
+        yield path, self
+        for child in self.children:
+            yield from child.walk(path)
+
+
+class RerunProfile:
+    """Wall-time tree and query log for one rerun of the app script"""
+
+    enabled = True
+
+    def __init__(self, query_budget=RERUN_QUERY_BUDGET, time_budget_ms=RERUN_TIME_BUDGET_MS):
+        self.query_budget = query_budget
+        self.time_budget_ms = time_budget_ms
+        self.root = _Section('rerun')
+        self._stack = [self.root]
+        self._checkpoint = None
+        _active.set(self)
+
+    @contextmanager
+    def section(self, name):
+        """Time a nested block; queries inside it are attributed to it"""
+        node = _Section(name)
+        self._stack[-1].children.append(node)
+        self._stack.append(node)
+        try:
+            yield node
+        finally:
+            node.close()
+            self._stack.pop()
+
+    def checkpoint(self, name):
+        """End the previous top-level checkpoint section and start a new one
+
+        For top-level script code that cannot be wrapped in a `with` block
+        without re-indenting it.
+        """
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+        self._stack = [self.root]
+        self._checkpoint = _Section(name)
+        self.root.children.append(self._checkpoint)
+        self._stack.append(self._checkpoint)
+
+    def record_query(self, event):
+        self._stack[-1].queries.append({
+            'method': event['method'], 'elapsed_ms': round(event['elapsed_ms'], 2),
+            'rows': event['rows'], 'bytes': event['bytes'], 'error': event['error']})
+
+    def finish(self):
+        """Close every open section and stop collecting queries"""
+        for node in reversed(self._stack):
+            node.close()
+        self._stack = [self.root]
+        if _active.get() is self:
+            _active.set(None)
+        return self
+
+    def summary(self):
+        sections = [section for _, section in self.root.walk()]
+        queries = [q for section in sections for q in section.queries]
+        return {'elapsed_ms': round(self.root.elapsed_ms or 0, 1),
+                'queries': len(queries),
+                'query_ms': round(sum(q['elapsed_ms'] for q in queries), 1),
+                'rows': sum(q['rows'] for q in queries),
+                'bytes': sum(q['bytes'] for q in queries)}
+
+    def over_budget(self):
+        """Human-readable budget violations (empty when within budget)"""
+        summary = self.summary()
+        problems = []
+        if self.query_budget and summary['queries'] > self.query_budget:
+            problems.append(f"{summary['queries']} queries (budget {self.query_budget})")
+        if self.time_budget_ms and summary['elapsed_ms'] > self.time_budget_ms:
+            problems.append(f"{summary['elapsed_ms']:,.0f} ms (budget {self.time_budget_ms:,.0f} ms)")
+        return problems
+
+    def render(self, st):
+        """Show the profile below the page"""
+        import pandas as pd
+        import plotly.graph_objects as go
+
+        self.finish()
+        summary = self.summary()
+        problems = self.over_budget()
+        if problems:
+            st.toast("⚠️ Rerun over budget: " + ", ".join(problems))
+
+        with st.expander(f"⏱️ Rerun profile · {summary['elapsed_ms']:,.0f} ms · "
+                         f"{summary['queries']} queries", expanded=bool(problems)):
+            if problems:
+                st.warning("Over budget: " + ", ".join(problems))
+            st.caption(f"Query time {summary['query_ms']:,.1f} ms · {summary['rows']:,} rows · "
+                       f"{summary['bytes'] / 1024:,.1f} KiB fetched")
+
+            ids, labels, parents, values, hover = [], [], [], [], []
+            rows = []
+            for path, section in self.root.walk():
+                ids.append('/'.join(path))
+                labels.append(section.name)
+                parents.append('/'.join(path[:-1]))
+                values.append(section.elapsed_ms or 0)
+                hover.append(f"{section.elapsed_ms or 0:,.1f} ms · {len(section.queries)} queries")
+                for query in section.queries:
+                    rows.append(dict(query, section=' › '.join(path[1:]) or 'rerun'))
+            fig = go.Figure(go.Icicle(ids=ids, labels=labels, parents=parents, values=values,
+                                      branchvalues='total', hovertext=hover, hoverinfo='label+text',
+                                      tiling=dict(orientation='v')))
+            fig.update_layout(margin=dict(t=10, l=10, r=10, b=10), height=320)
+            st.plotly_chart(fig, use_container_width=True)
+
+            if rows:
+                st.dataframe(pd.DataFrame(rows)[['section', 'method', 'elapsed_ms', 'rows', 'bytes', 'error']],
+                             use_container_width=True, hide_index=True)
+
+
+class NullProfile:
+    """Stand-in used when profiling is off; every call is a no-op"""
+
+    enabled = False
+
+    @contextmanager
+    def section(self, name):
+        yield None
+
+    def checkpoint(self, name):
+        pass
+
+    def finish(self):
+        return self
+
+    def render(self, st):
+        pass
+
+
+def start_rerun(instrumentation=None, enabled=PROFILE_RERUNS):
+    """Begin profiling one rerun; registers the query hook on first use"""
+    if not enabled:
+        return NullProfile()
+    if instrumentation is not None and query_hook not in instrumentation.hooks:
+        instrumentation.add_hook(query_hook)
+    return RerunProfile()
@@ -0,0 +1,262 @@
+"""
+Payment reconciliation for Cab Service Management System
+
+Checks every trip's payments against its fare. Trips and payments are
+streamed in Trip_ID order from two server-side cursors and merge-joined
+chunk by chunk, and each chunk is classified with vectorized pandas
+operations. Memory stays at about one chunk of each side however large
+the tables are. Issues found:
+
+    unpaid          completed trip with no Pending, Completed or Refunded payment
+    underpaid       Completed payments add up to less than the fare
+    overpaid        Completed payments add up to more than the fare
+    duplicate       more than one Completed payment for the trip
+    stale_pending   a payment has been Pending for RECONCILE_STALE_PENDING_HOURS
+    not_completed   a Pending or Completed payment for a trip that did not complete
+
+The unpaid trips are also kept in UnpaidTripQueue for the Add Payment form.
+sync_queue() applies Trip and Payment changes from the change-event log to
+it, so the form reads the queue instead of anti-joining every trip. The
+queue is first built from a full scan by `--rebuild-queue` (or the Rebuild
+Unpaid Queue button); until then sync_queue() leaves it alone.
+
+Usage:
+    python reconciliation.py --report                   # summary and first issues
+    python reconciliation.py --report --out issues.csv
+    python reconciliation.py --rebuild-queue            # e.g. after restoring a backup
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from config import (RECONCILE_TOLERANCE, RECONCILE_STALE_PENDING_HOURS, EXPORT_CHUNK_SIZE,
+                    OUTBOX_BATCH_SIZE)
+from outbox import Consumer
+
+TRIPS_QUERY = """
+    SELECT Trip_ID, Status, Fare, Dropoff_Time
+    FROM Trip
+    ORDER BY Trip_ID
+"""
+
+PAYMENTS_QUERY = """
+    SELECT Payment_ID, Trip_ID, Amount, Payment_Status, Payment_DateTime
+    FROM Payment
+    ORDER BY Trip_ID, Payment_ID
+"""
+
+PAYMENT_COLUMNS = ['Payment_ID', 'Trip_ID', 'Amount', 'Payment_Status', 'Payment_DateTime']
+
+ISSUES = ['unpaid', 'underpaid', 'overpaid', 'duplicate', 'stale_pending', 'not_completed']
+
+ISSUE_COLUMNS = ['Issue', 'Trip_ID', 'Trip_Status', 'Fare', 'Paid', 'Difference',
+                 'Payment_IDs', 'Completed_At']
+
+# Payment statuses that take a trip off the unpaid queue
+SETTLING_STATUSES = ('Pending', 'Completed', 'Refunded')
+
+QUEUE_CONSUMER = 'unpaid_queue'
+
+# Trip_IDs per queue DELETE / INSERT
+QUEUE_CHUNK_SIZE = 1000
+
+QUEUE_INSERT = """
+    INSERT INTO UnpaidTripQueue (Trip_ID, Fare, Completed_At)
+    SELECT t.Trip_ID, t.Fare, t.Dropoff_Time
+    FROM Trip t
+    WHERE t.Status = 'Completed'{where}
+      AND NOT EXISTS (
+          SELECT 1 FROM Payment p
+          WHERE p.Trip_ID = t.Trip_ID
+            AND p.Payment_Status IN ('Pending', 'Completed', 'Refunded')
+      )
+"""
+
+
+def _frames(db, query, chunk_size):
+    for description, rows in db.stream_query(query, chunk_size=chunk_size):
+        yield pd.DataFrame.from_records(rows, columns=[column[0] for column in description])
+
+
+def matched_chunks(db, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield (trips, payments) DataFrames: a chunk of trips and every payment for them
+
+    Payments are read ahead only as far as the current chunk's last Trip_ID.
+    The two cursors read separate snapshots, so rows written while the scan
+    runs may be missed or seen on one side only.
+    """
+    payments = _frames(db, PAYMENTS_QUERY, chunk_size)
+    ahead = []
+    exhausted = False
+    try:
+        for trips in _frames(db, TRIPS_QUERY, chunk_size):
+            last = trips['Trip_ID'].iat[-1]
+            while not exhausted and (not ahead or ahead[-1]['Trip_ID'].iat[-1] <= last):
+                chunk = next(payments, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    ahead.append(chunk)
+            frame = pd.concat(ahead, ignore_index=True) if ahead else pd.DataFrame(columns=PAYMENT_COLUMNS)
+            split = int(frame['Trip_ID'].searchsorted(last, side='right'))
+            rest = frame.iloc[split:]
+            ahead = [rest] if len(rest) else []
+            yield trips, frame.iloc[:split]
+    finally:
+        payments.close()
+
+
+def classify(trips, payments, tolerance=RECONCILE_TOLERANCE, stale_before=None):
+    """DataFrame of ISSUE_COLUMNS for one chunk of trips and their payments
+
+    A trip can appear once per issue it has. Underpayment is only flagged
+    when no payment is still Pending, since that may settle the difference.
+    """
+    status = payments['Payment_Status']
+    completed_payment = status == 'Completed'
+    per_trip = pd.DataFrame({
+        'Trip_ID': payments['Trip_ID'],
+        'Paid': pd.to_numeric(payments['Amount']).astype(float).where(completed_payment, 0.0),
+        'Completed_Payments': completed_payment.astype(int),
+        'Pending_Payments': (status == 'Pending').astype(int),
+        'Settling_Payments': status.isin(SETTLING_STATUSES).astype(int),
+    }).groupby('Trip_ID').sum()
+
+    matched = trips.join(per_trip, on='Trip_ID')
+    counts = ['Paid', 'Completed_Payments', 'Pending_Payments', 'Settling_Payments']
+    matched[counts] = matched[counts].fillna(0)
+    fare = pd.to_numeric(matched['Fare']).astype(float)
+    paid = matched['Paid']
+    completed = matched['Status'] == 'Completed'
+    priced = completed & fare.notna() & (matched['Completed_Payments'] > 0)
+
+    checks = {
+        'unpaid': completed & (matched['Settling_Payments'] == 0),
+        'underpaid': priced & (matched['Pending_Payments'] == 0) & (paid < fare - tolerance),
+        'overpaid': priced & (paid > fare + tolerance),
+        'duplicate': matched['Completed_Payments'] > 1,
+        'not_completed': ~completed & (matched['Completed_Payments'] + matched['Pending_Payments'] > 0),
+    }
+    if stale_before is not None:
+        stale = payments[(status == 'Pending')
+                         & (pd.to_datetime(payments['Payment_DateTime']) < stale_before)]
+        checks['stale_pending'] = matched['Trip_ID'].isin(stale['Trip_ID'])
+
+    flagged = [matched[mask].assign(Issue=issue) for issue, mask in checks.items() if mask.any()]
+    if not flagged:
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
+    issues = pd.concat(flagged, ignore_index=True)
+    ids = payments[payments['Trip_ID'].isin(issues['Trip_ID'])] \
+        .groupby('Trip_ID')['Payment_ID'].agg(lambda s: ', '.join(map(str, s)))
+    issues['Payment_IDs'] = issues['Trip_ID'].map(ids).fillna('')
+    issues['Difference'] = (issues['Paid'] - pd.to_numeric(issues['Fare']).astype(float)).round(2)
+    issues = issues.rename(columns={'Status': 'Trip_Status', 'Dropoff_Time': 'Completed_At'})
+    return issues[ISSUE_COLUMNS]
+
+
+def reconcile(db, tolerance=RECONCILE_TOLERANCE, stale_hours=RECONCILE_STALE_PENDING_HOURS,
+              chunk_size=EXPORT_CHUNK_SIZE):
+    """Return (summary, issues): trips and payments checked plus a count per issue, and the issues"""
+    stale_before = datetime.now() - timedelta(hours=stale_hours)
+    summary = dict({'trips': 0, 'payments': 0}, **{issue: 0 for issue in ISSUES})
+    flagged = []
+    for trips, payments in matched_chunks(db, chunk_size):
+        summary['trips'] += len(trips)
+        summary['payments'] += len(payments)
+        issues = classify(trips, payments, tolerance, stale_before)
+        for issue, count in issues['Issue'].value_counts().items():
+            summary[issue] += int(count)
+        if not issues.empty:
+            flagged.append(issues)
+    issues = pd.concat(flagged, ignore_index=True) if flagged else pd.DataFrame(columns=ISSUE_COLUMNS)
+    return summary, issues
+
+
+def _queue_consumer():
+    return Consumer(QUEUE_CONSUMER, entities=('Trip', 'Payment'))
+
+
+def _refresh_queue(cursor, trip_ids):
+    """Re-evaluate whether each of `trip_ids` belongs on the unpaid queue"""
+    for start in range(0, len(trip_ids), QUEUE_CHUNK_SIZE):
+        chunk = trip_ids[start:start + QUEUE_CHUNK_SIZE]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f"DELETE FROM UnpaidTripQueue WHERE Trip_ID IN ({placeholders})", tuple(chunk))
+        cursor.execute(QUEUE_INSERT.format(where=f" AND t.Trip_ID IN ({placeholders})"), tuple(chunk))
+
+
+def _apply_events(cursor, events):
+    trip_ids = {event['Entity_ID'] if event['Entity'] == 'Trip' else event['Payload'].get('Trip_ID')
+                for event in events}
+    trip_ids.discard(None)
+    _refresh_queue(cursor, sorted(trip_ids))
+
+
+def sync_queue(db, wait=True):
+    """Apply logged Trip and Payment changes to the unpaid queue; returns the events applied
+
+    Each batch of events and the consumer's offset commit together. With
+    wait=False the call returns at once if another process is syncing.
+    Without a stored offset the queue has never been built: nothing is
+    applied and None is returned (see rebuild_queue()).
+    """
+    if not db.execute_query("SELECT 1 FROM ConsumerOffset WHERE Consumer = %s",
+                            (QUEUE_CONSUMER,), fetch=True):
+        return None
+    consumer = _queue_consumer()
+    applied = 0
+    while True:
+        count = consumer.consume(db, _apply_events, wait=wait)
+        applied += count
+        if count < OUTBOX_BATCH_SIZE:
+            return applied
+
+
+def rebuild_queue(db):
+    """Refill the unpaid queue from a full scan; returns the number of queued trips"""
+    with db.transaction(invalidate_caches=False) as cursor:
+        # Changes logged from here on are applied by the next sync_queue()
+        _queue_consumer().skip(cursor)
+        cursor.execute("DELETE FROM UnpaidTripQueue")
+        cursor.execute(QUEUE_INSERT.format(where=""))
+        return cursor.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile payments against trip fares")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--report', action='store_true', help="report payment issues")
+    group.add_argument('--rebuild-queue', action='store_true', help="refill the unpaid trips queue")
+    parser.add_argument('--tolerance', type=float, default=RECONCILE_TOLERANCE)
+    parser.add_argument('--stale-hours', type=float, default=RECONCILE_STALE_PENDING_HOURS)
+    parser.add_argument('--out', help="write issues to this CSV (report only)")
+    args = parser.parse_args()
+
+    from database import Database
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Could not connect to the database")
+    started = time.perf_counter()
+    try:
+        if args.report:
+            summary, issues = reconcile(db, args.tolerance, args.stale_hours)
+            print(f"Checked {summary['trips']:,} trips and {summary['payments']:,} payments "
+                  f"in {time.perf_counter() - started:.2f} s")
+            for issue in ISSUES:
+                print(f"  {issue:<15}{summary[issue]:>10,}")
+            if args.out:
+                issues.to_csv(args.out, index=False)
+                print(f"Issues written to {args.out}")
+            elif not issues.empty:
+                print(issues.head(20).to_string(index=False))
+        else:
+            queued = rebuild_queue(db)
+            print(f"Queued {queued:,} unpaid trip(s) in {time.perf_counter() - started:.2f} s")
+    finally:
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
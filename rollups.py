@@ -0,0 +1,302 @@
+"""
+Materialized daily rollups for Cab Service Management System
+
+Keeps daily aggregates of trips (per vehicle type, driver and status) and
+payments (per payment mode and status). The analytics charts read these
+instead of joining the full Trip and Payment history on every view.
+
+Each rollup is refreshed from a high-water mark stored in RollupWatermark. A
+refresh re-aggregates whole days, from the day of the stored mark minus
+ROLLUP_LOOKBACK_DAYS onwards. Re-running it is harmless, and rows that arrive
+slightly late are picked up. Older days changed since the last refresh are
+found in the change-event log (see outbox.py) and re-aggregated one by one;
+`--since` or a backfill covers edits the log does not record.
+
+A rollup over existing data is first built with `--backfill`; refreshes,
+including the app's, leave an unbuilt rollup alone.
+
+Usage:
+    python rollups.py --once                # refresh from the high-water marks
+    python rollups.py --since 2024-01-01    # re-aggregate from a date onwards
+    python rollups.py --backfill            # rebuild everything from scratch
+    python rollups.py --interval 60         # refresh every 60 seconds
+"""
+import argparse
+import time
+from datetime import date, datetime, timedelta
+
+from config import (OUTBOX_BATCH_SIZE, ROLLUP_BACKFILL_DAYS, ROLLUP_LOOKBACK_DAYS,
+                    ROLLUP_REFRESH_SECONDS)
+from outbox import Consumer, event_date
+
+# Open end of a refreshed range (MySQL DATETIME range)
+END_OF_TIME = datetime(9999, 12, 31)
+
+# Each rollup aggregates its source by DATE(time_column). `insert` fills the
+# rollup table for the time range [%s, %s).
+ROLLUPS = {
+    'trip_daily': {
+        'table': 'TripDailyRollup',
+        'source': 'Trip',
+        'time_column': 'Dropoff_Time',
+        'insert': """
+            INSERT INTO TripDailyRollup
+                (Rollup_Date, Vehicle_Type, Driver_ID, Status,
+                 Trip_Count, Total_Fare, Total_Distance)
+            SELECT
+                DATE(t.Dropoff_Time),
+                COALESCE(v.Vehicle_Type, ''),
+                COALESCE(t.Driver_ID, 0),
+                t.Status,
+                COUNT(*),
+                COALESCE(SUM(t.Fare), 0),
+                COALESCE(SUM(t.Distance), 0)
+            FROM Trip t
+            LEFT JOIN Vehicle v ON t.Vehicle_ID = v.Vehicle_ID
+            WHERE t.Dropoff_Time >= %s AND t.Dropoff_Time < %s
+            GROUP BY DATE(t.Dropoff_Time), COALESCE(v.Vehicle_Type, ''),
+                     COALESCE(t.Driver_ID, 0), t.Status
+        """,
+    },
+    'payment_daily': {
+        'table': 'PaymentDailyRollup',
+        'source': 'Payment',
+        'time_column': 'Payment_DateTime',
+        'insert': """
+            INSERT INTO PaymentDailyRollup
+                (Rollup_Date, Payment_Mode, Payment_Status, Payment_Count, Total_Amount)
+            SELECT
+                DATE(Payment_DateTime),
+                Payment_Mode,
+                Payment_Status,
+                COUNT(*),
+                COALESCE(SUM(Amount), 0)
+            FROM Payment
+            WHERE Payment_DateTime >= %s AND Payment_DateTime < %s
+            GROUP BY DATE(Payment_DateTime), Payment_Mode, Payment_Status
+        """,
+    },
+}
+
+
+def _day_start(value):
+    """Midnight of the day containing `value`"""
+    if isinstance(value, datetime):
+        value = value.date()
+    return datetime.combine(value, datetime.min.time())
+
+
+def _rebuild_range(cursor, spec, start, end):
+    """Replace the rollup rows for [start, end) with fresh aggregates"""
+    cursor.execute(f"DELETE FROM {spec['table']} WHERE Rollup_Date >= %s AND Rollup_Date < %s",
+                   (start.date(), end.date()))
+    cursor.execute(spec['insert'], (start, end))
+    return cursor.rowcount
+
+
+def _day_runs(days):
+    """Group sorted dates into [first, last] runs of consecutive days"""
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def _consumer(name):
+    """Change-event consumer feeding one rollup"""
+    return Consumer(f"rollup_{name}", entities=(ROLLUPS[name]['source'],))
+
+
+def _apply_events(cursor, spec, consumer, covered_from=None):
+    """Re-aggregate the days touched by changes logged since the consumer's offset
+
+    Days from `covered_from` on are skipped (the caller rebuilds those).
+    The offset is committed with the rollup rows. Returns (rollup rows
+    written, event IDs moved past).
+    """
+    column = spec['time_column']
+    days = set()
+    for event in consumer.poll(cursor):
+        payload = event['Payload']
+        for value in (payload.get(column), (payload.get('Previous') or {}).get(column)):
+            day = event_date(value)
+            if day is not None and (covered_from is None or day < covered_from.date()):
+                days.add(day)
+    written = 0
+    for first, last in _day_runs(sorted(days)):
+        written += _rebuild_range(cursor, spec, _day_start(first), _day_start(last) + timedelta(days=1))
+    moved = consumer.position - consumer.offset
+    consumer.commit(cursor)
+    return written, moved
+
+
+def _lock_watermark(cursor, name):
+    """Lock a rollup's watermark row (creating it) and return it
+
+    Refreshed_At is NULL until the rollup has been built once; High_Water
+    stays NULL after that only while the source is empty.
+    """
+    cursor.execute("INSERT IGNORE INTO RollupWatermark (Rollup_Name) VALUES (%s)", (name,))
+    cursor.execute("SELECT High_Water, Refreshed_At FROM RollupWatermark "
+                   "WHERE Rollup_Name = %s FOR UPDATE", (name,))
+    return cursor.fetchone()
+
+
+def _high_water(cursor, spec):
+    cursor.execute(f"SELECT MAX({spec['time_column']}) AS High_Water FROM {spec['source']}")
+    return cursor.fetchone()['High_Water']
+
+
+def refresh(db, name, since=None):
+    """Bring one rollup up to date; returns the number of rollup rows written
+
+    The watermark row is locked for the whole refresh, so concurrent refreshes
+    (several app replicas or a cron job) run one after another. The range
+    from the watermark on is only rebuilt when the source's latest timestamp
+    has moved since the last run, or when `since` asks for it. Older days
+    named by the change-event log are rebuilt on their own; a long backlog
+    of events is worked off in further transactions.
+
+    A rollup that has never been built is left alone and None is returned:
+    building it is backfill()'s job, run from the command line, not
+    something to start from a page render.
+    """
+    spec = ROLLUPS[name]
+    consumer = _consumer(name)
+    with db.transaction() as cursor:
+        state = _lock_watermark(cursor, name)
+        watermark = state['High_Water']
+        high_water = _high_water(cursor, spec)
+        unbuilt = since is None and state['Refreshed_At'] is None and high_water is not None
+
+        if not unbuilt:
+            if since is not None:
+                start = _day_start(since)
+            elif high_water is None or high_water == watermark:
+                start = None
+            else:
+                # No High_Water: built while the source was empty
+                mark = watermark if watermark is not None else state['Refreshed_At']
+                start = _day_start(mark) - timedelta(days=ROLLUP_LOOKBACK_DAYS)
+
+            written = 0
+            if start is not None:
+                written = _rebuild_range(cursor, spec, start, END_OF_TIME)
+            if start is not None or state['Refreshed_At'] is None:
+                cursor.execute("""
+                    UPDATE RollupWatermark SET High_Water = %s, Refreshed_At = NOW()
+                    WHERE Rollup_Name = %s
+                """, (high_water, name))
+            rows, moved = _apply_events(cursor, spec, consumer, start)
+            written += rows
+
+    if unbuilt:
+        return None
+    while moved >= OUTBOX_BATCH_SIZE:
+        with db.transaction() as cursor:
+            _lock_watermark(cursor, name)
+            rows, moved = _apply_events(cursor, spec, consumer)
+            written += rows
+    return written
+
+
+def refresh_all(db, since=None):
+    """Refresh every rollup; returns {name: rows written, or None if never built}"""
+    return {name: refresh(db, name, since) for name in ROLLUPS}
+
+
+def backfill(db, name, chunk_days=ROLLUP_BACKFILL_DAYS):
+    """Rebuild one rollup from scratch, `chunk_days` of history per transaction
+
+    Short transactions keep the source tables free for normal traffic while a
+    long history is re-aggregated. The watermark is set last; until then
+    refresh() treats the rollup as unbuilt and leaves it alone, and an
+    interrupted backfill has to be run again.
+    """
+    spec = ROLLUPS[name]
+    with db.transaction() as cursor:
+        cursor.execute(f"SELECT MIN({spec['time_column']}) AS Low_Water, "
+                       f"MAX({spec['time_column']}) AS High_Water FROM {spec['source']}")
+        bounds = cursor.fetchone()
+        cursor.execute(f"DELETE FROM {spec['table']}")
+        cursor.execute("""
+            INSERT INTO RollupWatermark (Rollup_Name, High_Water, Refreshed_At) VALUES (%s, NULL, NULL)
+            ON DUPLICATE KEY UPDATE High_Water = NULL, Refreshed_At = NULL
+        """, (name,))
+        # Everything logged so far is covered by the rebuild
+        _consumer(name).skip(cursor)
+
+    written = 0
+    last = bounds['High_Water']
+    if bounds['Low_Water'] is not None:
+        start = _day_start(bounds['Low_Water'])
+        while start <= last:
+            end = start + timedelta(days=chunk_days)
+            with db.transaction() as cursor:
+                written += _rebuild_range(cursor, spec, start, end)
+            start = end
+
+    with db.transaction() as cursor:
+        cursor.execute("""
+            UPDATE RollupWatermark SET High_Water = %s, Refreshed_At = NOW()
+            WHERE Rollup_Name = %s
+        """, (last, name))
+    # Catch rows written while the backfill was running
+    return written + refresh(db, name)
+
+
+def run_forever(db, interval=ROLLUP_REFRESH_SECONDS):
+    """Refresh every `interval` seconds until interrupted"""
+    while True:
+        started = time.perf_counter()
+        try:
+            written = refresh_all(db)
+            print(f"[{datetime.now():%H:%M:%S}] refreshed rollups "
+                  f"({', '.join(f'{k}: {v}' for k, v in written.items())}) "
+                  f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+        except Exception as e:
+            print(f"[{datetime.now():%H:%M:%S}] rollup refresh failed: {e}")
+        time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh or rebuild the daily analytics rollups")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--once', action='store_true', help="refresh from the high-water marks")
+    group.add_argument('--since', type=date.fromisoformat, help="re-aggregate from YYYY-MM-DD onwards")
+    group.add_argument('--backfill', action='store_true', help="rebuild all rollups from scratch")
+    group.add_argument('--interval', type=float, help="refresh continuously every N seconds")
+    parser.add_argument('--rollup', choices=sorted(ROLLUPS), action='append',
+                        help="limit to one rollup (repeat for several)")
+    args = parser.parse_args()
+    names = args.rollup or list(ROLLUPS)
+
+    from database import Database
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Could not connect to the database")
+    try:
+        if args.interval:
+            run_forever(db, args.interval)
+        for name in names:
+            started = time.perf_counter()
+            if args.backfill:
+                written = backfill(db, name)
+            else:
+                written = refresh(db, name, args.since)
+            if written is None:
+                print(f"{name}: not built yet, run with --backfill")
+                continue
+            print(f"{name}: {written:,} rollup row(s) written "
+                  f"in {(time.perf_counter() - started):.2f} s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
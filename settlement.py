@@ -0,0 +1,250 @@
+"""
+Payment settlement for Cab Service Management System
+
+settle() applies many payment status changes at once, e.g. an operator
+settling a page of Pending payments or a file of payment-gateway callbacks.
+Each change names its payment by Payment_ID or, for callbacks, by the
+gateway's Reference_Number. It is checked against TRANSITIONS (unless an
+operator overrides them to correct a mistake), and every change gets an
+Outcome:
+
+    applied     the payment moved to the new status (detail: its reference)
+    unchanged   the payment already had that status and reference
+    rejected    not allowed, unknown payment or reference taken (detail: why)
+
+A payment that becomes Completed without a reference gets one generated
+from its Payment_ID (REFERENCE_PREFIX + 10 digits). The references are
+unique without a lookup and stay the same if the settlement is retried.
+A status change sets Settled_At; Payment_DateTime, which dates the payment
+in listings and rollups, is never changed.
+
+Changes are applied in batches of BATCH_SIZE, one transaction each: a
+locking SELECT of the batch's payments, one multi-row UPDATE and one
+INSERT logging them to the change-event log. Files of changes have a
+Payment_Status column and a Payment_ID or Reference_Number column.
+
+Usage:
+    python settlement.py callbacks.csv
+    python settlement.py callbacks.csv --out outcomes.csv --batch-size 5000
+"""
+import argparse
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+from outbox import record as record_event
+
+# Allowed status changes
+TRANSITIONS = {
+    'Pending': ('Completed', 'Failed'),
+    'Failed': ('Pending', 'Completed'),
+    'Completed': ('Refunded',),
+    'Refunded': (),
+}
+
+# Changes per transaction
+BATCH_SIZE = 1000
+
+# Prefix of generated reference numbers
+REFERENCE_PREFIX = 'CSM'
+
+# A requested status change. Callbacks may leave payment_id as None and
+# name the payment by reference_number instead.
+PaymentChange = namedtuple('PaymentChange', ['payment_id', 'status', 'reference_number'],
+                           defaults=(None,))
+
+# result: 'applied', 'unchanged' or 'rejected'; detail: reference or reason
+Outcome = namedtuple('Outcome', ['change', 'payment_id', 'result', 'detail'])
+
+_UPDATE_COLUMNS = ['Payment_ID', 'Payment_Status', 'Reference_Number', 'Settled_At']
+
+
+def can_transition(current, status):
+    """Whether a payment in status `current` may move to `status`"""
+    return status in TRANSITIONS.get(current, ())
+
+
+def reference_for(payment_id):
+    """Generated reference number of a payment"""
+    return f"{REFERENCE_PREFIX}{payment_id:010d}"
+
+
+def _lock_payments(cursor, payment_ids, references):
+    """Lock the payments named by ID or reference; returns ({Payment_ID: row}, {reference: Payment_ID})
+
+    References in use by any payment are found too, so a change cannot
+    give a payment a reference that another one holds.
+    """
+    clauses, params = [], []
+    if payment_ids:
+        clauses.append(f"Payment_ID IN ({', '.join(['%s'] * len(payment_ids))})")
+        params.extend(payment_ids)
+    if references:
+        clauses.append(f"Reference_Number IN ({', '.join(['%s'] * len(references))})")
+        params.extend(references)
+    if not clauses:
+        return {}, {}
+    cursor.execute(f"""
+        SELECT Payment_ID, Payment_Status, Reference_Number, Settled_At, NOW() AS Now
+        FROM Payment
+        WHERE {' OR '.join(clauses)}
+        ORDER BY Payment_ID
+        FOR UPDATE
+    """, tuple(params))
+    payments = {row['Payment_ID']: row for row in cursor.fetchall()}
+    owners = {row['Reference_Number']: payment_id for payment_id, row in payments.items()
+              if row['Reference_Number']}
+    return payments, owners
+
+
+def _settle(payment, change, owners, override=False):
+    """Apply one change to a locked payment row in place; returns (result, detail)
+
+    override=True allows any status change, not only TRANSITIONS.
+    """
+    payment_id = payment['Payment_ID']
+    current = payment['Payment_Status']
+    reference = change.reference_number or payment['Reference_Number']
+    if change.status == 'Completed' and not reference:
+        reference = reference_for(payment_id)
+    if owners.get(reference, payment_id) != payment_id:
+        return 'rejected', f"Reference {reference} belongs to payment #{owners[reference]}"
+
+    if change.status == current:
+        if reference == payment['Reference_Number']:
+            return 'unchanged', reference
+    elif not override and not can_transition(current, change.status):
+        return 'rejected', f"Payment #{payment_id} is {current} and cannot become {change.status}"
+    else:
+        payment['Settled_At'] = payment['Now']
+
+    owners.pop(payment['Reference_Number'], None)
+    if reference:
+        owners[reference] = payment_id
+    payment.update(Payment_Status=change.status, Reference_Number=reference)
+    return 'applied', reference
+
+
+def _apply_batch(db, changes, override=False):
+    """Apply one batch of changes in one transaction; returns their Outcomes"""
+    from database import values_table
+
+    outcomes = []
+    with db.transaction() as cursor:
+        # Generated references are looked up too, in case one was entered by hand
+        references = {c.reference_number for c in changes if c.reference_number}
+        references.update(reference_for(c.payment_id) for c in changes
+                          if c.status == 'Completed' and c.payment_id is not None)
+        payments, owners = _lock_payments(
+            cursor, sorted({c.payment_id for c in changes if c.payment_id is not None}), sorted(references))
+        previous = {payment_id: {'Payment_Status': row['Payment_Status']}
+                    for payment_id, row in payments.items()}
+
+        applied = []
+        for change in changes:
+            payment_id = change.payment_id
+            if payment_id is None:
+                payment_id = owners.get(change.reference_number)
+            payment = payments.get(payment_id)
+            if payment is None:
+                if change.payment_id is not None:
+                    reason = f"Payment #{change.payment_id} not found"
+                elif change.reference_number:
+                    reason = f"Reference {change.reference_number} not found"
+                else:
+                    reason = "No Payment_ID or Reference_Number given"
+                outcomes.append(Outcome(change, payment_id, 'rejected', reason))
+                continue
+            result, detail = _settle(payment, change, owners, override)
+            outcomes.append(Outcome(change, payment_id, result, detail))
+            if result == 'applied' and payment_id not in applied:
+                applied.append(payment_id)
+
+        if applied:
+            rows = [[payments[payment_id][column] for column in _UPDATE_COLUMNS] for payment_id in applied]
+            rows_sql, params = values_table(_UPDATE_COLUMNS, rows)
+            cursor.execute(f"""
+                UPDATE Payment p
+                JOIN ({rows_sql}) e ON p.Payment_ID = e.Payment_ID
+                SET p.Payment_Status = e.Payment_Status, p.Reference_Number = e.Reference_Number,
+                    p.Settled_At = e.Settled_At
+            """, tuple(params))
+            record_event(cursor, 'Payment', 'status_changed', applied,
+                         previous_by_id={payment_id: previous[payment_id] for payment_id in applied})
+
+    if applied:
+        db.cache.invalidate('Payment', *applied)
+    return outcomes
+
+
+def settle(db, changes, batch_size=BATCH_SIZE, override=False):
+    """Apply payment status changes, one transaction per `batch_size` changes
+
+    Changes are applied in order, and a payment may appear more than once.
+    override=True skips the TRANSITIONS check (operator corrections only).
+    Returns one Outcome per change, in order. Database errors are raised;
+    the failing batch is rolled back, earlier batches stay committed.
+    """
+    changes = list(changes)
+    outcomes = []
+    for start in range(0, len(changes), batch_size):
+        outcomes.extend(_apply_batch(db, changes[start:start + batch_size], override))
+    return outcomes
+
+
+def outcomes_frame(outcomes):
+    """DataFrame with one row per Outcome"""
+    return pd.DataFrame([{
+        'Payment_ID': outcome.payment_id,
+        'Payment_Status': outcome.change.status,
+        'Result': outcome.result,
+        'Detail': outcome.detail,
+    } for outcome in outcomes], columns=['Payment_ID', 'Payment_Status', 'Result', 'Detail'])
+
+
+def read_changes(path):
+    """PaymentChanges from a CSV with Payment_Status and Payment_ID and/or Reference_Number"""
+    frame = pd.read_csv(path, dtype={'Reference_Number': str})
+    if 'Payment_Status' not in frame or not ({'Payment_ID', 'Reference_Number'} & set(frame.columns)):
+        raise SystemExit(f"{path} needs a Payment_Status column and a Payment_ID or Reference_Number column")
+    ids = frame['Payment_ID'] if 'Payment_ID' in frame else pd.Series([None] * len(frame))
+    references = frame['Reference_Number'] if 'Reference_Number' in frame else pd.Series([None] * len(frame))
+    return [PaymentChange(None if pd.isna(payment_id) else int(payment_id), status,
+                          None if pd.isna(reference) else reference)
+            for payment_id, status, reference in zip(ids, frame['Payment_Status'], references)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a file of payment status changes")
+    parser.add_argument('path', help="CSV of changes or gateway callbacks")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--out', help="write one outcome per change to this CSV")
+    args = parser.parse_args()
+
+    changes = read_changes(args.path)
+    from database import Database
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Could not connect to the database")
+    started = time.perf_counter()
+    try:
+        outcomes = outcomes_frame(settle(db, changes, args.batch_size))
+    finally:
+        db.disconnect()
+
+    counts = outcomes['Result'].value_counts()
+    print(f"{len(changes):,} change(s) in {time.perf_counter() - started:.2f} s: "
+          + ", ".join(f"{counts.get(result, 0):,} {result}"
+                      for result in ('applied', 'unchanged', 'rejected')))
+    if args.out:
+        outcomes.to_csv(args.out, index=False)
+        print(f"Outcomes written to {args.out}")
+    else:
+        rejected = outcomes[outcomes['Result'] == 'rejected']
+        if not rejected.empty:
+            print(rejected.head(20).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
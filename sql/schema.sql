@@ -3,6 +3,12 @@
 -- ===================================================
 
 -- Drop tables if exist (for clean setup)
+DROP TABLE IF EXISTS UnpaidTripQueue;
+DROP TABLE IF EXISTS ConsumerOffset;
+DROP TABLE IF EXISTS ChangeEvent;
+DROP TABLE IF EXISTS RollupWatermark;
+DROP TABLE IF EXISTS PaymentDailyRollup;
+DROP TABLE IF EXISTS TripDailyRollup;
 DROP TABLE IF EXISTS Payment;
 DROP TABLE IF EXISTS Trip;
 DROP TABLE IF EXISTS Vehicle;
@@ -39,12 +45,16 @@ CREATE TABLE Driver (
     Rating DECIMAL(2,1) DEFAULT 0.0,
     Status ENUM('Active', 'Inactive', 'Suspended') NOT NULL DEFAULT 'Active',
     Current_Active_Location VARCHAR(200),
+    Current_Lat DECIMAL(9,6),
+    Current_Lon DECIMAL(9,6),
+    Location_Updated_At DATETIME,
     Join_Date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     Last_Active DATETIME,
     
     -- Constraints
     CONSTRAINT chk_driver_phone CHECK (Phone_Number REGEXP '^[0-9]{10,15}$'),
-    CONSTRAINT chk_driver_rating CHECK (Rating >= 0.0 AND Rating <= 5.0)
+    CONSTRAINT chk_driver_rating CHECK (Rating >= 0.0 AND Rating <= 5.0),
+    CONSTRAINT chk_driver_coords CHECK (Current_Lat BETWEEN -90 AND 90 AND Current_Lon BETWEEN -180 AND 180)
 );
 
 -- ===================================================
@@ -101,6 +111,10 @@ CREATE TABLE Trip (
     Vehicle_ID INT,
     Pickup_Location VARCHAR(200) NOT NULL,
     Dropoff_Location VARCHAR(200) NOT NULL,
+    Pickup_Lat DECIMAL(9,6),
+    Pickup_Lon DECIMAL(9,6),
+    Dropoff_Lat DECIMAL(9,6),
+    Dropoff_Lon DECIMAL(9,6),
     Pickup_Time DATETIME,
     Dropoff_Time DATETIME,
     Booking_Time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
@@ -128,7 +142,9 @@ CREATE TABLE Trip (
     -- Constraints
     CONSTRAINT chk_trip_distance CHECK (Distance >= 0),
     CONSTRAINT chk_trip_fare CHECK (Fare >= 0),
-    CONSTRAINT chk_trip_times CHECK (Dropoff_Time IS NULL OR Dropoff_Time >= Pickup_Time)
+    CONSTRAINT chk_trip_times CHECK (Dropoff_Time IS NULL OR Dropoff_Time >= Pickup_Time),
+    CONSTRAINT chk_trip_coords CHECK (Pickup_Lat BETWEEN -90 AND 90 AND Pickup_Lon BETWEEN -180 AND 180
+                                      AND Dropoff_Lat BETWEEN -90 AND 90 AND Dropoff_Lon BETWEEN -180 AND 180)
 );
 
 -- ===================================================
@@ -143,6 +159,7 @@ CREATE TABLE Payment (
         NOT NULL DEFAULT 'Pending',
     Payment_DateTime DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     Reference_Number VARCHAR(50) UNIQUE,
+    Settled_At DATETIME,  -- last status change (see settlement.py)
     
     -- Foreign Keys
     CONSTRAINT fk_payment_trip
@@ -155,6 +172,70 @@ CREATE TABLE Payment (
     CONSTRAINT chk_payment_mode CHECK (Payment_Mode IN ('Cash', 'Card', 'UPI', 'Wallet', 'Net_Banking'))
 );
 
+-- ===================================================
+-- ROLLUP TABLES (daily aggregates, maintained by rollups.py)
+-- ===================================================
+
+-- Trips by dropoff day; Vehicle_Type '' and Driver_ID 0 stand for "none"
+CREATE TABLE TripDailyRollup (
+    Rollup_Date DATE NOT NULL,
+    Vehicle_Type VARCHAR(20) NOT NULL,
+    Driver_ID INT NOT NULL,
+    Status VARCHAR(20) NOT NULL,
+    Trip_Count INT NOT NULL,
+    Total_Fare DECIMAL(14,2) NOT NULL,
+    Total_Distance DECIMAL(14,2) NOT NULL,
+    
+    PRIMARY KEY (Rollup_Date, Vehicle_Type, Driver_ID, Status)
+);
+
+-- Payments by payment day
+CREATE TABLE PaymentDailyRollup (
+    Rollup_Date DATE NOT NULL,
+    Payment_Mode VARCHAR(20) NOT NULL,
+    Payment_Status VARCHAR(20) NOT NULL,
+    Payment_Count INT NOT NULL,
+    Total_Amount DECIMAL(14,2) NOT NULL,
+    
+    PRIMARY KEY (Rollup_Date, Payment_Mode, Payment_Status)
+);
+
+-- Latest source timestamp folded into each rollup
+CREATE TABLE RollupWatermark (
+    Rollup_Name VARCHAR(50) PRIMARY KEY,
+    High_Water DATETIME,
+    Refreshed_At DATETIME
+);
+
+-- Append-only log of Trip and Payment changes (see outbox.py)
+CREATE TABLE ChangeEvent (
+    Event_ID BIGINT PRIMARY KEY AUTO_INCREMENT,
+    Entity VARCHAR(20) NOT NULL,
+    Entity_ID INT NOT NULL,
+    Event_Type VARCHAR(20) NOT NULL,
+    Payload JSON NOT NULL,
+    Created_At DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3)
+);
+
+-- Last event read by each ChangeEvent consumer
+CREATE TABLE ConsumerOffset (
+    Consumer VARCHAR(50) PRIMARY KEY,
+    Last_Event_ID BIGINT NOT NULL DEFAULT 0,
+    Skipped_Events BIGINT NOT NULL DEFAULT 0,
+    Updated_At DATETIME
+);
+
+-- Completed trips still waiting for a payment (see reconciliation.py)
+CREATE TABLE UnpaidTripQueue (
+    Trip_ID INT PRIMARY KEY,
+    Fare DECIMAL(10,2),
+    Completed_At DATETIME,
+    
+    CONSTRAINT fk_unpaid_trip
+        FOREIGN KEY (Trip_ID) REFERENCES Trip(Trip_ID)
+        ON DELETE CASCADE
+);
+
 -- ===================================================
 -- INDEXES FOR PERFORMANCE
 -- ===================================================
@@ -169,12 +250,14 @@ CREATE INDEX idx_driver_phone ON Driver(Phone_Number);
 CREATE INDEX idx_driver_license ON Driver(License_Number);
 CREATE INDEX idx_driver_status ON Driver(Status);
 CREATE INDEX idx_driver_rating ON Driver(Rating);
+CREATE INDEX idx_driver_join_date ON Driver(Join_Date);        -- Keyset pagination
 
 -- Vehicle Indexes
 CREATE INDEX idx_vehicle_driver ON Vehicle(Driver_ID);
 CREATE INDEX idx_vehicle_type ON Vehicle(Vehicle_Type);
 CREATE INDEX idx_vehicle_status ON Vehicle(Status);
 CREATE INDEX idx_vehicle_number ON Vehicle(Vehicle_Number);
+CREATE INDEX idx_vehicle_registration ON Vehicle(Registration_Date);  -- Keyset pagination
 
 -- Trip Indexes (Critical for performance)
 CREATE INDEX idx_trip_user ON Trip(User_ID);
@@ -182,6 +265,8 @@ CREATE INDEX idx_trip_driver ON Trip(Driver_ID);
 CREATE INDEX idx_trip_vehicle ON Trip(Vehicle_ID);
 CREATE INDEX idx_trip_status ON Trip(Status);
 CREATE INDEX idx_trip_booking_time ON Trip(Booking_Time);
+CREATE INDEX idx_trip_dropoff_time ON Trip(Dropoff_Time);        -- Rollup refresh
+CREATE INDEX idx_trip_booking_trend ON Trip(Booking_Time, Status, Pickup_Time);  -- Covering index for trends
 CREATE INDEX idx_trip_driver_status ON Trip(Driver_ID, Status);  -- Composite index
 CREATE INDEX idx_trip_user_status ON Trip(User_ID, Status);      -- Composite index
 
@@ -189,8 +274,23 @@ CREATE INDEX idx_trip_user_status ON Trip(User_ID, Status);      -- Composite in
 CREATE INDEX idx_payment_trip ON Payment(Trip_ID);
 CREATE INDEX idx_payment_status ON Payment(Payment_Status);
 CREATE INDEX idx_payment_datetime ON Payment(Payment_DateTime);
+CREATE INDEX idx_payment_datetime_trend ON Payment(Payment_DateTime, Payment_Status, Amount);  -- Covering index for trends
 CREATE INDEX idx_payment_mode ON Payment(Payment_Mode);
 
+-- Full-text Indexes (ranked name / location search, maintained by InnoDB)
+CREATE FULLTEXT INDEX ft_user_name ON User(First_Name, Last_Name);
+CREATE FULLTEXT INDEX ft_driver_name ON Driver(First_Name, Last_Name);
+CREATE FULLTEXT INDEX ft_trip_locations ON Trip(Pickup_Location, Dropoff_Location);
+
+-- Rollup Indexes (chart reads group across all days)
+CREATE INDEX idx_trip_rollup_status_type ON TripDailyRollup(Status, Vehicle_Type);
+CREATE INDEX idx_trip_rollup_driver ON TripDailyRollup(Driver_ID, Status);
+CREATE INDEX idx_payment_rollup_status_mode ON PaymentDailyRollup(Payment_Status, Payment_Mode);
+
+-- Change-Event Indexes
+CREATE INDEX idx_change_event_created ON ChangeEvent(Created_At);  -- Pruning
+CREATE INDEX idx_unpaid_completed ON UnpaidTripQueue(Completed_At);  -- Add Payment list order
+
 -- ===================================================
 -- SAMPLE DATA INSERTION (VehicleType Lookup)
 -- ===================================================
@@ -229,18 +329,19 @@ LEFT JOIN Vehicle v ON t.Vehicle_ID = v.Vehicle_ID
 LEFT JOIN VehicleType vt ON v.Vehicle_Type = vt.Vehicle_Type
 WHERE t.Status IN ('Pending', 'Accepted', 'In_Progress');
 
--- View: Driver Earnings Summary
+-- View: Driver Earnings Summary (reads the daily rollup; trips count once dropped off)
 CREATE VIEW vw_driver_earnings AS
 SELECT 
     d.Driver_ID,
     d.First_Name,
     d.Last_Name,
-    COUNT(t.Trip_ID) AS Total_Trips,
-    SUM(CASE WHEN t.Status = 'Completed' THEN t.Fare ELSE 0 END) AS Total_Earnings,
-    AVG(CASE WHEN t.Status = 'Completed' THEN t.Fare ELSE NULL END) AS Avg_Fare_Per_Trip,
+    COALESCE(SUM(r.Trip_Count), 0) AS Total_Trips,
+    COALESCE(SUM(CASE WHEN r.Status = 'Completed' THEN r.Total_Fare ELSE 0 END), 0) AS Total_Earnings,
+    SUM(CASE WHEN r.Status = 'Completed' THEN r.Total_Fare ELSE NULL END) /
+        NULLIF(SUM(CASE WHEN r.Status = 'Completed' THEN r.Trip_Count ELSE 0 END), 0) AS Avg_Fare_Per_Trip,
     d.Rating
 FROM Driver d
-LEFT JOIN Trip t ON d.Driver_ID = t.Driver_ID
+LEFT JOIN TripDailyRollup r ON d.Driver_ID = r.Driver_ID
 GROUP BY d.Driver_ID, d.First_Name, d.Last_Name, d.Rating;
 
 -- View: Payment Summary
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+from bulk_import import validate_chunk
+
+
+def users(*rows):
+    return pd.DataFrame(rows, columns=['First_Name', 'Last_Name', 'Phone_Number', 'Email'])
+
+
+def reasons(rejects):
+    return dict(rejects)
+
+
+def test_valid_rows_pass_with_defaults_filled():
+    valid, rejects = validate_chunk('users', users(
+        ('Asha', 'Rao', '9876543210', 'asha@example.com')).assign(Registration_Date=[None]))
+    assert rejects == []
+    assert len(valid) == 1
+    assert isinstance(valid['Registration_Date'].iat[0], pd.Timestamp)
+
+
+def test_unknown_columns_are_dropped():
+    valid, rejects = validate_chunk('users', users(
+        ('Asha', 'Rao', '9876543210', 'asha@example.com')).assign(Notes=['vip']))
+    assert rejects == []
+    assert 'Notes' not in valid.columns
+
+
+def test_missing_required_column_rejects_every_row():
+    df = users(('Asha', 'Rao', '9876543210', 'a@b.co'), ('Ravi', 'Kumar', '9876543211', 'r@b.co'))
+    valid, rejects = validate_chunk('users', df.drop(columns=['Email']))
+    assert valid.empty
+    assert rejects == [(0, 'missing column(s): Email'), (1, 'missing column(s): Email')]
+
+
+def test_user_checks():
+    valid, rejects = validate_chunk('users', users(
+        ('Asha', 'Rao', '9876543210', 'asha@example.com'),
+        ('', 'Rao', '9876543211', 'b@example.com'),
+        ('Ravi', 'K' * 51, '9876543212', 'c@example.com'),
+        ('Ravi', 'Kumar', '98765', 'd@example.com'),
+        ('Ravi', 'Kumar', '9876543213', 'not-an-email'),
+        ('Ravi', 'Kumar', '9876543210', 'e@example.com'),
+        ('Ravi', 'Kumar', '9876543214', 'asha@example.com'),
+    ))
+    assert list(valid.index) == [0]
+    assert reasons(rejects) == {
+        1: 'First_Name is required',
+        2: 'Last_Name longer than 50 characters',
+        3: 'invalid phone number',
+        4: 'invalid email',
+        5: 'duplicate Phone_Number within batch',
+        6: 'duplicate Email within batch',
+    }
+
+
+def test_only_the_first_problem_is_reported():
+    _, rejects = validate_chunk('users', users(('', 'Rao', '123', 'nope')))
+    assert rejects == [(0, 'First_Name is required')]
+
+
+def test_driver_enums_numbers_and_ranges():
+    df = pd.DataFrame({
+        'First_Name': ['A', 'B', 'C', 'D', 'E'],
+        'Last_Name': ['X'] * 5,
+        'Phone_Number': ['9000000001', '9000000002', '9000000003', '9000000004', '9000000005'],
+        'License_Number': ['L1', 'L2', 'L3', 'L4', 'L5'],
+        'Status': ['Active', 'Retired', None, 'Active', 'Active'],
+        'Rating': [4.5, 4.0, 3.0, 'five', 5.5],
+        'Current_Lat': [12.9, 12.9, 95.0, 12.9, 12.9],
+    })
+    valid, rejects = validate_chunk('drivers', df)
+    assert reasons(rejects) == {
+        1: 'invalid Status',
+        2: 'Current_Lat out of range',
+        3: 'Rating is not a number',
+        4: 'rating must be 0-5',
+    }
+    assert list(valid['Status']) == ['Active']
+    assert valid['Rating'].dtype == np.float64
+
+
+def test_vehicle_types_and_years():
+    df = pd.DataFrame({
+        'Vehicle_Type': ['Sedan', 'Hovercraft', 'SUV'],
+        'Vehicle_Number': ['KA01AB1234', 'KA01AB1235', 'KA01AB1236'],
+        'Year': [2020, 2021, 1985],
+    })
+    valid, rejects = validate_chunk('vehicles', df, vehicle_types=['Sedan', 'SUV'])
+    assert reasons(rejects) == {1: 'unknown Vehicle_Type', 2: 'year must be 1990-2030'}
+    # Columns missing from the file are left to the table defaults
+    assert 'Status' not in valid.columns
+
+    # Without a list of known types the foreign key is left to the database
+    _, rejects = validate_chunk('vehicles', df)
+    assert reasons(rejects) == {2: 'year must be 1990-2030'}
+
+
+def test_trip_dates_and_amounts():
+    df = pd.DataFrame({
+        'Pickup_Location': ['MG Road', 'Indiranagar', 'Koramangala', 'Whitefield'],
+        'Dropoff_Location': ['Airport', 'HSR Layout', 'Jayanagar', 'Hebbal'],
+        'Pickup_Time': ['2024-01-01 10:00', 'yesterday-ish', '2024-01-01 10:00', '2024-01-01 10:00'],
+        'Dropoff_Time': ['2024-01-01 10:45', None, '2024-01-01 09:00', '2024-01-01 11:00'],
+        'Distance': [18.5, 3.0, 5.0, -1.0],
+        'Status': ['Completed', None, None, None],
+    })
+    valid, rejects = validate_chunk('trips', df)
+    assert reasons(rejects) == {
+        1: 'Pickup_Time is not a valid date/time',
+        2: 'Dropoff_Time must be on or after Pickup_Time',
+        3: 'Distance must not be negative',
+    }
+    assert valid['Pickup_Time'].iat[0] == pd.Timestamp('2024-01-01 10:00')
+    assert list(valid['Status']) == ['Completed']
+
+
+def test_payment_defaults_and_duplicate_references():
+    df = pd.DataFrame({
+        'Trip_ID': [1, 2, 3, 4],
+        'Amount': ['250.50', '100', '80', '90'],
+        'Payment_Mode': ['UPI', 'Cheque', 'Cash', 'Card'],
+        'Payment_Status': [None, 'Completed', 'Completed', 'Completed'],
+        'Reference_Number': [None, 'R1', 'R2', 'R2'],
+    })
+    valid, rejects = validate_chunk('payments', df)
+    assert reasons(rejects) == {1: 'invalid Payment_Mode', 3: 'duplicate Reference_Number within batch'}
+    assert list(valid['Payment_Status']) == ['Pending', 'Completed']
+    assert list(valid['Amount']) == [250.5, 80.0]
+    # Payments without a reference are not duplicates of each other
+    assert valid['Reference_Number'].isna().iat[0]
@@ -0,0 +1,105 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from config import FARE_MINIMUMS, FARE_PER_MINUTE
+from fares import FareEngine, price_frame, surge_by_hour
+
+RATES = {'Bike': 8.0, 'Auto': 12.0, 'Sedan': 15.0, 'SUV': 20.0}
+
+
+def engine(rates=RATES):
+    return FareEngine(lambda: dict(rates))
+
+
+def quotes(trips, rates=RATES):
+    fares = engine(rates)
+    return [fares.quote(*(None if pd.isna(value) else value for value in row))
+            for row in trips[['Vehicle_Type', 'Distance', 'Pickup_Time', 'Dropoff_Time']]
+            .itertuples(index=False, name=None)]
+
+
+def test_surge_windows_wrap_past_midnight():
+    table = surge_by_hour([(8, 11, 1.25), (10, 12, 1.5), (23, 2, 1.2)])
+    assert list(table[[7, 8, 10, 11, 12, 23, 0, 1, 2]]) == [1, 1.25, 1.5, 1.5, 1, 1.2, 1.2, 1.2, 1]
+
+
+def test_quote_adds_time_surge_and_minimum():
+    fares = engine()
+    pickup = datetime(2024, 1, 1, 13, 0)
+    assert fares.quote('Sedan', 10, pickup, pickup + timedelta(minutes=30)) == \
+        round(15.0 * 10 + FARE_PER_MINUTE * 30, 2)
+    # Evening peak
+    pickup = datetime(2024, 1, 1, 18, 0)
+    assert fares.quote('Sedan', 10, pickup, pickup + timedelta(minutes=30)) == \
+        round((15.0 * 10 + FARE_PER_MINUTE * 30) * 1.5, 2)
+    # Short ride falls back to the minimum
+    assert fares.quote('SUV', 0.5) == FARE_MINIMUMS['SUV']
+    assert fares.quote('Hovercraft', 10) is None
+    assert fares.quote('Sedan', None) is None
+
+
+def test_price_frame_matches_quote_row_by_row():
+    rng = random.Random(11)
+    types = list(RATES) + ['Hovercraft', None]
+    rows = []
+    for _ in range(500):
+        pickup = datetime(2024, 1, 1) + timedelta(minutes=rng.randrange(60 * 24 * 7))
+        rows.append({
+            'Vehicle_Type': rng.choice(types),
+            'Distance': rng.choice([None, 0.3, round(rng.uniform(0, 40), 2)]),
+            'Pickup_Time': rng.choice([None, pickup]),
+            'Dropoff_Time': rng.choice([None, pickup + timedelta(minutes=rng.randrange(-5, 90))]),
+        })
+    trips = pd.DataFrame(rows)
+    computed = price_frame(trips, RATES)
+    expected = quotes(trips)
+    assert computed.index.equals(trips.index)
+    for row, (fare, quote) in enumerate(zip(computed, expected)):
+        if quote is None:
+            assert math.isnan(fare), row
+        else:
+            assert fare == pytest.approx(quote, abs=0.01), row
+
+
+def test_price_frame_unpriceable_rows_are_nan():
+    trips = pd.DataFrame({
+        'Vehicle_Type': ['Sedan', 'Hovercraft', 'Sedan'],
+        'Distance': [10.0, 10.0, None],
+        'Pickup_Time': [None] * 3,
+        'Dropoff_Time': [None] * 3,
+    })
+    fares = price_frame(trips, RATES)
+    assert fares.iat[0] == 150.0
+    assert fares.iloc[1:].isna().all()
+
+
+def test_engine_price_frame_uses_loaded_rates():
+    trips = pd.DataFrame({'Vehicle_Type': ['Bike'], 'Distance': [10],
+                          'Pickup_Time': [None], 'Dropoff_Time': [None]})
+    assert engine({'Bike': '8.00'}).price_frame(trips).iat[0] == 80.0
+
+
+def test_rates_are_cached_until_invalidated():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {'Sedan': 15.0 + len(loads)}
+
+    fares = FareEngine(load, refresh_seconds=3600)
+    assert fares.rates() == {'Sedan': 16.0}
+    assert fares.rates() == {'Sedan': 16.0}
+    assert len(loads) == 1
+    fares.invalidate()
+    assert fares.rates() == {'Sedan': 17.0}
+
+
+def test_failed_load_keeps_previous_rates():
+    results = iter([{'Sedan': 15.0}, None])
+    fares = FareEngine(lambda: next(results), refresh_seconds=0)
+    assert fares.rates() == {'Sedan': 15.0}
+    assert fares.rates() == {'Sedan': 15.0}
@@ -0,0 +1,116 @@
+import math
+import random
+
+import pytest
+
+from geo import KM_PER_DEGREE_LAT, GridIndex, haversine_km
+
+BANGALORE = (12.9716, 77.5946)
+CITIES = [BANGALORE, (19.0760, 72.8777), (28.6139, 77.2090), (13.0827, 80.2707)]
+
+
+def scatter(rng, center, n, spread_deg=0.15):
+    return [(center[0] + rng.uniform(-spread_deg, spread_deg),
+             center[1] + rng.uniform(-spread_deg, spread_deg)) for _ in range(n)]
+
+
+def build(points, cell_km=1.0):
+    index = GridIndex(cell_km)
+    for key, (lat, lon) in enumerate(points):
+        index.insert(key, lat, lon)
+    return index
+
+
+def brute_force(points, lat, lon, k, max_km=None):
+    """The k closest keys by the index's own ranking (equirectangular degrees)"""
+    scale = math.cos(math.radians(lat))
+    ranked = sorted((math.hypot(p_lat - lat, (p_lon - lon) * scale), key)
+                    for key, (p_lat, p_lon) in enumerate(points))
+    if max_km is not None:
+        ranked = [(d, key) for d, key in ranked if d <= max_km / KM_PER_DEGREE_LAT]
+    return [key for _, key in ranked[:k]]
+
+
+def test_haversine_known_distances():
+    assert haversine_km(*BANGALORE, *BANGALORE) == 0
+    # Bangalore to Chennai is about 290 km as the crow flies
+    assert haversine_km(*BANGALORE, 13.0827, 80.2707) == pytest.approx(290, abs=5)
+    # One degree of latitude
+    assert haversine_km(0, 0, 1, 0) == pytest.approx(111.2, abs=0.1)
+
+
+@pytest.mark.parametrize('k', [1, 5, 20])
+def test_nearest_matches_brute_force_within_a_city(k):
+    rng = random.Random(k)
+    points = scatter(rng, BANGALORE, 2000)
+    index = build(points)
+    for lat, lon in scatter(rng, BANGALORE, 50):
+        found = index.nearest(lat, lon, k)
+        assert [key for key, _ in found] == brute_force(points, lat, lon, k)
+        for key, distance in found:
+            assert distance == pytest.approx(haversine_km(lat, lon, *points[key]))
+
+
+def test_nearest_across_distant_cities():
+    rng = random.Random(7)
+    points = [p for city in CITIES for p in scatter(rng, city, 100)]
+    index = build(points)
+    lat, lon = BANGALORE
+    found = index.nearest(lat, lon, 300)
+    assert len(found) == 300
+    # Ranking is approximate over hundreds of km, so compare distances
+    exact = sorted(haversine_km(lat, lon, *p) for p in points)[:300]
+    for (_, distance), expected in zip(found, exact):
+        assert distance == pytest.approx(expected, rel=0.01)
+
+
+def test_nearest_reaches_a_lone_distant_point():
+    rng = random.Random(3)
+    points = scatter(rng, BANGALORE, 50) + [CITIES[2]]
+    index = build(points)
+    found = index.nearest(*BANGALORE, k=51)
+    assert len(found) == 51
+    assert found[-1][0] == 50
+
+
+def test_k_larger_than_the_index_returns_everything():
+    points = scatter(random.Random(1), BANGALORE, 12)
+    found = build(points).nearest(*BANGALORE, k=100)
+    assert sorted(key for key, _ in found) == list(range(12))
+
+
+def test_max_km_limits_results():
+    rng = random.Random(5)
+    points = scatter(rng, BANGALORE, 1000)
+    index = build(points)
+    found = index.nearest(*BANGALORE, k=1000, max_km=3)
+    assert [key for key, _ in found] == brute_force(points, *BANGALORE, 1000, max_km=3)
+    assert 0 < len(found) < 1000
+    assert all(distance <= 3.05 for _, distance in found)
+
+
+def test_empty_index_and_zero_k():
+    assert GridIndex().nearest(*BANGALORE) == []
+    index = build([BANGALORE])
+    assert index.nearest(*BANGALORE, k=0) == []
+
+
+def test_insert_moves_and_remove_drops_points():
+    index = GridIndex()
+    index.insert('a', *BANGALORE)
+    index.insert('b', BANGALORE[0] + 0.05, BANGALORE[1])
+    assert [key for key, _ in index.nearest(*BANGALORE, k=1)] == ['a']
+
+    index.insert('a', *CITIES[1])
+    assert len(index) == 2
+    assert index.location('a') == CITIES[1]
+    assert [key for key, _ in index.nearest(*BANGALORE, k=1)] == ['b']
+
+    index.remove('b')
+    index.remove('missing')
+    assert 'b' not in index
+    assert index.location('b') is None
+    assert [key for key, _ in index.nearest(*BANGALORE, k=5)] == ['a']
+    index.remove('a')
+    assert len(index) == 0
+    assert index._cells == {}
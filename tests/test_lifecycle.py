@@ -0,0 +1,134 @@
+from datetime import datetime
+
+import pytest
+
+from lifecycle import TRANSITIONS, TripEvent, _transition, can_transition
+
+NOW = datetime(2024, 6, 1, 12, 0)
+STATUSES = ['Pending', 'Accepted', 'In_Progress', 'Completed', 'Cancelled']
+
+
+class FlatFares:
+    """quote() stand-in: 10 per km for Sedan, no rate for anything else"""
+
+    def quote(self, vehicle_type, distance, pickup_time=None, dropoff_time=None):
+        if vehicle_type != 'Sedan' or distance is None:
+            return None
+        return round(10.0 * float(distance), 2)
+
+
+def trip(status, **values):
+    row = {'Trip_ID': 1, 'Status': status, 'Driver_ID': None, 'Vehicle_ID': None,
+           'Pickup_Time': None, 'Dropoff_Time': None, 'Distance': None, 'Fare': None,
+           'Vehicle_Type': None, 'Now': NOW, 'Vehicle_Status': None}
+    row.update(values)
+    return row
+
+
+def apply(row, event, drivers=None, vehicles=None, claimed=None):
+    return _transition(row, event, drivers or {}, vehicles or {},
+                       set() if claimed is None else claimed, FlatFares())
+
+
+def test_transition_table():
+    allowed = {(current, status) for current, targets in TRANSITIONS.items() for status in targets}
+    assert allowed == {
+        ('Pending', 'Accepted'), ('Pending', 'Cancelled'),
+        ('Accepted', 'In_Progress'), ('Accepted', 'Cancelled'),
+        ('In_Progress', 'Completed'), ('In_Progress', 'Cancelled'),
+    }
+    for current in STATUSES:
+        for status in STATUSES:
+            assert can_transition(current, status) == ((current, status) in allowed)
+
+
+@pytest.mark.parametrize('current', ['Completed', 'Cancelled'])
+def test_final_states_reject_everything(current):
+    row = trip(current)
+    reason = apply(row, TripEvent(1, 'Cancelled'))
+    assert reason == f"Trip #1 is {current} and cannot become Cancelled"
+    assert row['Status'] == current
+
+
+def test_accept_claims_driver_and_vehicle():
+    row = trip('Pending')
+    drivers = {5: {'Status': 'Active', 'Busy_Trip_ID': None}}
+    vehicles = {9: {'Status': 'Available', 'Busy_Trip_ID': None, 'Vehicle_Type': 'Sedan'}}
+    claimed = set()
+    assert apply(row, TripEvent(1, 'Accepted', 5, 9), drivers, vehicles, claimed) is None
+    assert row['Status'] == 'Accepted'
+    assert (row['Driver_ID'], row['Vehicle_ID'], row['Pickup_Time']) == (5, 9, NOW)
+    assert row['Vehicle_Status'] == 'In_Use'
+    assert claimed == {('Driver', 5), ('Vehicle', 9)}
+
+    # The same driver cannot be claimed twice in one batch
+    other = trip('Pending', Trip_ID=2)
+    reason = apply(other, TripEvent(2, 'Accepted', 5, 9), drivers, vehicles, claimed)
+    assert reason == "Driver #5 is already on trip #(this batch)"
+    assert other['Status'] == 'Pending'
+
+
+@pytest.mark.parametrize('driver, vehicle, reason', [
+    (None, {'Status': 'Available', 'Busy_Trip_ID': None}, "Driver #5 is not active"),
+    ({'Status': 'Inactive', 'Busy_Trip_ID': None}, {'Status': 'Available', 'Busy_Trip_ID': None},
+     "Driver #5 is not active"),
+    ({'Status': 'Active', 'Busy_Trip_ID': 7}, {'Status': 'Available', 'Busy_Trip_ID': None},
+     "Driver #5 is already on trip #7"),
+    ({'Status': 'Active', 'Busy_Trip_ID': None}, {'Status': 'Maintenance', 'Busy_Trip_ID': None},
+     "Vehicle #9 is not available (Maintenance)"),
+    ({'Status': 'Active', 'Busy_Trip_ID': None}, {'Status': 'Available', 'Busy_Trip_ID': 8},
+     "Vehicle #9 is already on trip #8"),
+])
+def test_accept_conflicts(driver, vehicle, reason):
+    drivers = {5: driver} if driver else {}
+    vehicles = {9: dict(vehicle, Vehicle_Type='Sedan')}
+    row = trip('Pending')
+    assert apply(row, TripEvent(1, 'Accepted', 5, 9), drivers, vehicles) == reason
+    assert row['Status'] == 'Pending'
+
+
+def test_accept_needs_driver_and_vehicle():
+    assert apply(trip('Pending'), TripEvent(1, 'Accepted', 5)) == \
+        "Trip #1 needs a driver and a vehicle to be accepted"
+
+
+def test_complete_prices_and_releases_vehicle():
+    row = trip('In_Progress', Vehicle_Type='Sedan', Pickup_Time=datetime(2024, 6, 1, 11, 40))
+    assert apply(row, TripEvent(1, 'Completed', distance=7.5)) is None
+    assert (row['Status'], row['Distance'], row['Fare']) == ('Completed', 7.5, 75.0)
+    assert (row['Dropoff_Time'], row['Vehicle_Status']) == (NOW, 'Available')
+
+
+def test_complete_uses_given_fare_and_stored_distance():
+    row = trip('In_Progress', Vehicle_Type='Van', Distance=3.0)
+    assert apply(row, TripEvent(1, 'Completed', fare=120.0)) is None
+    assert (row['Distance'], row['Fare']) == (3.0, 120.0)
+
+
+def test_complete_without_distance_is_rejected():
+    row = trip('In_Progress', Vehicle_Type='Sedan')
+    assert apply(row, TripEvent(1, 'Completed')) == "Trip #1 needs a distance to be completed"
+    assert row['Status'] == 'In_Progress'
+
+
+def test_complete_without_rate_is_rejected():
+    row = trip('In_Progress', Vehicle_Type='Van')
+    assert apply(row, TripEvent(1, 'Completed', distance=4.0)) == \
+        "Trip #1 has no fare rate for vehicle type Van"
+    assert row['Status'] == 'In_Progress'
+
+
+def test_cancel_before_and_after_pickup():
+    accepted = trip('Accepted', Pickup_Time=NOW)
+    assert apply(accepted, TripEvent(1, 'Cancelled')) is None
+    assert (accepted['Pickup_Time'], accepted['Dropoff_Time']) == (None, None)
+    assert accepted['Vehicle_Status'] == 'Available'
+
+    started = trip('In_Progress', Pickup_Time=datetime(2024, 6, 1, 11, 0))
+    assert apply(started, TripEvent(1, 'Cancelled')) is None
+    assert started['Dropoff_Time'] == NOW
+    assert started['Vehicle_Status'] == 'Available'
+
+    pending = trip('Pending')
+    assert apply(pending, TripEvent(1, 'Cancelled')) is None
+    assert pending['Vehicle_Status'] is None
@@ -0,0 +1,137 @@
+import json
+from datetime import datetime
+
+from outbox import Consumer, read, record
+
+
+class FakeCursor:
+    """Answers the outbox's queries from in-memory rows and records every statement"""
+
+    def __init__(self, events=(), offset=None, snapshots=()):
+        self.events = list(events)
+        self.offset = offset
+        self.snapshots = list(snapshots)
+        self.statements = []
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.statements.append((' '.join(query.split()), params))
+        if 'FROM ChangeEvent' in query:
+            grace, after, limit = params
+            self._rows = [dict(e) for e in self.events if e['Event_ID'] > after][:limit]
+        elif 'SELECT Last_Event_ID' in query:
+            self._rows = [] if self.offset is None else [{'Last_Event_ID': self.offset}]
+        elif 'INSERT IGNORE INTO ConsumerOffset' in query:
+            self.offset = 0
+        elif 'AS Payload' in query:
+            self._rows = list(self.snapshots)
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+def event(event_id, entity='Trip', settled=True, payload=None):
+    return {'Event_ID': event_id, 'Entity': entity, 'Entity_ID': event_id * 10,
+            'Event_Type': 'created', 'Payload': json.dumps(payload or {'Status': 'Pending'}),
+            'Created_At': datetime(2024, 1, 1), 'Settled': settled}
+
+
+def ids(events):
+    return [e['Event_ID'] for e in events]
+
+
+def test_read_returns_consecutive_events():
+    events, position, skipped = read(FakeCursor([event(1), event(2), event(3)]), 0)
+    assert ids(events) == [1, 2, 3]
+    assert (position, skipped) == (3, 0)
+    assert events[0]['Payload'] == {'Status': 'Pending'}
+    assert 'Settled' not in events[0]
+
+
+def test_read_stops_at_a_recent_gap():
+    # Event 3 may belong to a transaction that has not committed yet
+    events, position, skipped = read(FakeCursor([event(1), event(2), event(4, settled=False)]), 0)
+    assert ids(events) == [1, 2]
+    assert (position, skipped) == (2, 0)
+
+
+def test_read_skips_and_counts_a_settled_gap():
+    events, position, skipped = read(FakeCursor([event(2), event(5), event(6)]), 1)
+    assert ids(events) == [2, 5, 6]
+    assert (position, skipped) == (6, 2)
+
+
+def test_gap_right_after_the_offset():
+    assert read(FakeCursor([event(3, settled=False)]), 1) == ([], 1, 0)
+    events, position, skipped = read(FakeCursor([event(3)]), 1)
+    assert (ids(events), position, skipped) == ([3], 3, 1)
+
+
+def test_entity_filter_still_advances_position():
+    cursor = FakeCursor([event(1, 'Trip'), event(2, 'Payment'), event(3, 'Trip')])
+    events, position, skipped = read(cursor, 0, entities={'Payment'})
+    assert ids(events) == [2]
+    assert (position, skipped) == (3, 0)
+
+
+def test_read_passes_grace_and_limit():
+    cursor = FakeCursor([event(1), event(2), event(3)])
+    events, position, _ = read(cursor, 0, limit=2, grace=1.5)
+    assert ids(events) == [1, 2] and position == 2
+    assert cursor.statements[-1][1] == (1500000, 0, 2)
+
+
+def test_bytes_and_decoded_payloads():
+    raw = event(1)
+    raw['Payload'] = b'{"Fare": 120.5}'
+    decoded = event(2)
+    decoded['Payload'] = {'Fare': 80}
+    events, _, _ = read(FakeCursor([raw, decoded]), 0)
+    assert [e['Payload'] for e in events] == [{'Fare': 120.5}, {'Fare': 80}]
+
+
+def test_consumer_creates_offset_and_commits_skipped_count():
+    cursor = FakeCursor([event(1), event(4), event(5)])
+    consumer = Consumer('test', entities=['Trip'])
+    assert ids(consumer.poll(cursor)) == [1, 4, 5]
+    assert (consumer.offset, consumer.position, consumer.skipped) == (0, 5, 2)
+    consumer.commit(cursor)
+    query, params = cursor.statements[-1]
+    assert query.startswith('UPDATE ConsumerOffset')
+    assert 'Skipped_Events = Skipped_Events + %s' in query
+    assert params == (5, 2, 'test')
+    assert (consumer.offset, consumer.skipped) == (5, 0)
+
+
+def test_consumer_commit_without_progress_writes_nothing():
+    cursor = FakeCursor([event(9, settled=False)], offset=7)
+    consumer = Consumer('test')
+    assert consumer.poll(cursor) == []
+    statements = len(cursor.statements)
+    consumer.commit(cursor)
+    assert len(cursor.statements) == statements
+
+
+def test_record_inserts_snapshots_in_one_statement():
+    cursor = FakeCursor(snapshots=[{'Entity_ID': 1, 'Payload': b'{"Status": "Paid"}'},
+                                   {'Entity_ID': 2, 'Payload': '{"Status": "Pending"}'}])
+    record(cursor, 'Payment', 'status_changed', [1, 2])
+    assert cursor.events_logged_at is not None
+    select, insert = cursor.statements
+    assert 'FOR SHARE' in select[0] and select[1] == (1, 2)
+    assert insert[0].startswith('INSERT INTO ChangeEvent')
+    assert insert[1] == ('Payment', 1, 'status_changed', '{"Status": "Paid"}',
+                         'Payment', 2, 'status_changed', '{"Status": "Pending"}')
+
+
+def test_record_without_rows_inserts_nothing():
+    cursor = FakeCursor()
+    record(cursor, 'Trip', 'created', [])
+    assert cursor.statements == []
+    record(cursor, 'Trip', 'created', [99])
+    assert len(cursor.statements) == 1
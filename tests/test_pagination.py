@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from config import COUNT_ESTIMATE_CAP
+from database import Database
+
+QUERY = "SELECT t.Trip_ID, t.Booking_Time, p.Payment_ID FROM Trip t LEFT JOIN Payment p USING (Trip_ID) {where} {order}"
+
+START = datetime(2024, 1, 1)
+
+
+class PagedDatabase(Database):
+    """Serves a fixed set of rows and records every query it gets"""
+
+    def __init__(self, rows, count=None, table_rows=None):
+        super().__init__()
+        self.rows = pd.DataFrame(rows, columns=['Trip_ID', 'Booking_Time', 'Payment_ID'])
+        self.count = len(self.rows['Trip_ID'].unique()) if count is None else count
+        self.table_rows = table_rows
+        self.queries = []
+
+    def execute_query(self, query, params=None, fetch=False):
+        self.queries.append((query, params))
+        if 'information_schema' in query:
+            return [{'count': self.table_rows}]
+        return [{'count': min(self.count, params[-1])}]
+
+    def fetch_dataframe(self, query, params=None):
+        self.queries.append((query, params))
+        rows = self.rows.sort_values(['Booking_Time', 'Trip_ID'], ascending=False)
+        if 'Booking_Time <' in query:
+            time, _, trip_id = params[-4:-1]
+            rows = rows[(rows['Booking_Time'] < time)
+                        | ((rows['Booking_Time'] == time) & (rows['Trip_ID'] < trip_id))]
+        # LIMIT applies to the paged table before the join, as in get_drivers_page
+        kept = rows['Trip_ID'].drop_duplicates().head(params[-1])
+        return rows[rows['Trip_ID'].isin(kept)].reset_index(drop=True)
+
+
+def trips(n):
+    return [(trip_id, START + timedelta(minutes=trip_id // 2), None) for trip_id in range(1, n + 1)]
+
+
+def fetch(db, cursor=None, page_size=3, where=None, params=None):
+    return db._fetch_page(QUERY, 't.Booking_Time', 't.Trip_ID', 'Trip t', cursor=cursor,
+                          page_size=page_size, where=where, params=params)
+
+
+def test_first_page_asks_for_one_extra_row():
+    db = PagedDatabase(trips(7))
+    page = fetch(db)
+    query, params = db.queries[-1]
+    assert 'ORDER BY t.Booking_Time DESC, t.Trip_ID DESC LIMIT %s' in query
+    assert 'WHERE' not in query
+    assert params == (4,)
+    assert list(page.rows['Trip_ID']) == [7, 6, 5]
+    assert page.next_cursor == (START + timedelta(minutes=2), 5)
+
+
+def test_cursor_adds_seek_predicate_after_filters():
+    db = PagedDatabase(trips(7))
+    cursor = (START + timedelta(minutes=2), 5)
+    fetch(db, cursor=cursor, where=['t.Status = %s'], params=['Completed'])
+    query, params = db.queries[-1]
+    assert ("WHERE t.Status = %s AND (t.Booking_Time < %s OR "
+            "(t.Booking_Time = %s AND t.Trip_ID < %s))") in query
+    assert params == ('Completed', cursor[0], cursor[0], 5, 4)
+
+
+def test_walking_cursors_visits_every_row_once():
+    db = PagedDatabase(trips(7))
+    seen, cursor = [], None
+    while True:
+        page = fetch(db, cursor=cursor)
+        seen += list(page.rows['Trip_ID'])
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert seen == [7, 6, 5, 4, 3, 2, 1]
+
+
+def test_last_full_page_has_no_cursor():
+    page = fetch(PagedDatabase(trips(3)))
+    assert len(page.rows) == 3
+    assert page.next_cursor is None
+
+
+def test_cursor_values_are_plain_python_types():
+    page = fetch(PagedDatabase(trips(7)))
+    time, trip_id = page.next_cursor
+    assert type(time) is datetime
+    assert type(trip_id) is int
+
+
+def test_joined_rows_do_not_split_a_trip_across_pages():
+    # Trips 4 and 2 have two payments each; a page holds three distinct trips
+    rows = [(5, START, 50), (4, START, 40), (4, START, 41), (3, START, 30),
+            (2, START, 20), (2, START, 21), (1, START, 10)]
+    db = PagedDatabase(rows)
+    page = fetch(db)
+    assert list(page.rows['Trip_ID']) == [5, 4, 4, 3]
+    assert page.next_cursor == (START, 3)
+    page = fetch(db, cursor=page.next_cursor)
+    assert list(page.rows['Trip_ID']) == [2, 2, 1]
+    assert page.next_cursor is None
+
+
+def test_exact_count_below_cap():
+    page = fetch(PagedDatabase(trips(7)))
+    assert (page.total, page.total_exact, page.total_at_least) == (7, True, False)
+
+
+def test_filtered_count_past_cap_is_a_lower_bound():
+    db = PagedDatabase(trips(7), count=COUNT_ESTIMATE_CAP + 500)
+    page = fetch(db, where=['t.Status = %s'], params=['Completed'])
+    assert (page.total, page.total_exact, page.total_at_least) == (COUNT_ESTIMATE_CAP, False, True)
+    count_query, count_params = db.queries[0]
+    assert 'LIMIT %s' in count_query and 'WHERE t.Status = %s' in count_query
+    assert count_params == ('Completed', COUNT_ESTIMATE_CAP + 1)
+
+
+def test_unfiltered_count_past_cap_uses_table_statistics():
+    db = PagedDatabase(trips(7), count=COUNT_ESTIMATE_CAP + 500, table_rows=250000)
+    page = fetch(db)
+    assert (page.total, page.total_exact, page.total_at_least) == (250000, False, False)
+    assert db.queries[1][1] == ('Trip',)
+
+
+def test_stale_table_statistics_never_undercount():
+    db = PagedDatabase(trips(7), count=COUNT_ESTIMATE_CAP + 500, table_rows=100)
+    assert fetch(db).total == COUNT_ESTIMATE_CAP + 1
@@ -0,0 +1,62 @@
+from datetime import date, datetime
+
+from database import QueryFilter, fulltext_query
+
+
+def test_empty_values_add_nothing():
+    f = (QueryFilter().equals('t.Status', None).equals('t.Status', '').is_in('t.Status', [])
+         .is_in('t.Status', None).at_least('d.Rating', 0).since('t.Booking_Time', None)
+         .until('t.Booking_Time', None).prefix('u.Email', '').contains(['u.First_Name'], '')
+         .fulltext(['u.First_Name'], ''))
+    assert f.clauses == []
+    assert f.params == []
+
+
+def test_chained_clauses_and_params_stay_in_order():
+    f = (QueryFilter().equals('t.User_ID', 7).is_in('t.Status', ['Pending', 'Accepted'])
+         .at_least('d.Rating', 4.5))
+    assert f.clauses == ['t.User_ID = %s', 't.Status IN (%s, %s)', 'd.Rating >= %s']
+    assert f.params == [7, 'Pending', 'Accepted', 4.5]
+
+
+def test_dates_cover_whole_days():
+    f = QueryFilter().since('t.Booking_Time', date(2024, 1, 1)).until('t.Booking_Time', date(2024, 1, 31))
+    assert f.clauses == ['t.Booking_Time >= %s', 't.Booking_Time < %s']
+    assert f.params == [datetime(2024, 1, 1), datetime(2024, 2, 1)]
+
+
+def test_datetimes_are_used_as_given():
+    start, end = datetime(2024, 1, 1, 8, 30), datetime(2024, 1, 1, 18, 0)
+    f = QueryFilter().since('p.Payment_DateTime', start).until('p.Payment_DateTime', end)
+    assert f.params == [start, end]
+
+
+def test_like_patterns_are_escaped():
+    f = QueryFilter().prefix('u.Email', ' 50%_off\\ ').contains(['u.First_Name', 'u.Last_Name'], 'a_b')
+    assert f.clauses == ['u.Email LIKE %s', '(u.First_Name LIKE %s OR u.Last_Name LIKE %s)']
+    assert f.params == ['50\\%\\_off\\\\%', '%a\\_b%', '%a\\_b%']
+
+
+def test_fulltext_uses_boolean_prefix_query():
+    f = QueryFilter().fulltext(['u.First_Name', 'u.Last_Name'], 'rahul sharma')
+    assert f.clauses == ['MATCH(u.First_Name, u.Last_Name) AGAINST (%s IN BOOLEAN MODE)']
+    assert f.params == ['+rahul* +sharma*']
+
+
+def test_fulltext_falls_back_to_prefix_for_short_terms():
+    f = QueryFilter().fulltext(['u.First_Name', 'u.Last_Name'], 'ra')
+    assert f.clauses == ['(u.First_Name LIKE %s OR u.Last_Name LIKE %s)']
+    assert f.params == ['ra%', 'ra%']
+
+
+def test_fulltext_query_drops_short_words():
+    assert fulltext_query('rah sha') == '+rah* +sha*'
+    assert fulltext_query('a rahul b') == '+rahul*'
+    assert fulltext_query('a b') is None
+    assert fulltext_query(None) is None
+
+
+def test_raw_clause():
+    f = QueryFilter().raw('t.Fare BETWEEN %s AND %s', 100, 200)
+    assert f.clauses == ['t.Fare BETWEEN %s AND %s']
+    assert f.params == [100, 200]
@@ -0,0 +1,162 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+
+from settlement import (TRANSITIONS, PaymentChange, _settle, can_transition, reference_for,
+                        settle)
+
+NOW = datetime(2024, 6, 1, 12, 0)
+STATUSES = ['Pending', 'Completed', 'Failed', 'Refunded']
+
+
+def payment(payment_id, status, reference=None):
+    return {'Payment_ID': payment_id, 'Payment_Status': status, 'Reference_Number': reference,
+            'Settled_At': None, 'Now': NOW}
+
+
+def test_transition_table():
+    allowed = {(current, status) for current, targets in TRANSITIONS.items() for status in targets}
+    assert allowed == {
+        ('Pending', 'Completed'), ('Pending', 'Failed'),
+        ('Failed', 'Pending'), ('Failed', 'Completed'),
+        ('Completed', 'Refunded'),
+    }
+    for current in STATUSES:
+        for status in STATUSES:
+            assert can_transition(current, status) == ((current, status) in allowed)
+
+
+def test_reference_for():
+    assert reference_for(42) == 'CSM0000000042'
+
+
+def test_completing_generates_reference_and_stamps_settlement():
+    row = payment(7, 'Pending')
+    owners = {}
+    assert _settle(row, PaymentChange(7, 'Completed'), owners) == ('applied', 'CSM0000000007')
+    assert row['Payment_Status'] == 'Completed'
+    assert row['Reference_Number'] == 'CSM0000000007'
+    assert row['Settled_At'] == NOW
+    assert owners == {'CSM0000000007': 7}
+
+
+def test_given_reference_is_kept():
+    row = payment(7, 'Pending')
+    assert _settle(row, PaymentChange(7, 'Completed', 'GW-1'), {}) == ('applied', 'GW-1')
+    assert row['Reference_Number'] == 'GW-1'
+
+
+def test_same_status_and_reference_is_unchanged():
+    row = payment(7, 'Completed', 'GW-1')
+    assert _settle(row, PaymentChange(7, 'Completed'), {'GW-1': 7}) == ('unchanged', 'GW-1')
+    assert row['Settled_At'] is None
+
+
+def test_new_reference_without_status_change_keeps_settled_at():
+    row = payment(7, 'Completed', 'GW-1')
+    owners = {'GW-1': 7}
+    assert _settle(row, PaymentChange(7, 'Completed', 'GW-2'), owners) == ('applied', 'GW-2')
+    assert row['Settled_At'] is None
+    assert owners == {'GW-2': 7}
+
+
+@pytest.mark.parametrize('current, status', [
+    ('Completed', 'Failed'), ('Completed', 'Pending'), ('Refunded', 'Completed'),
+    ('Refunded', 'Pending'), ('Pending', 'Refunded'),
+])
+def test_disallowed_changes_are_rejected(current, status):
+    row = payment(7, current, 'GW-1')
+    assert _settle(row, PaymentChange(7, status), {'GW-1': 7}) == \
+        ('rejected', f"Payment #7 is {current} and cannot become {status}")
+    assert row['Payment_Status'] == current
+
+
+def test_override_allows_any_change():
+    row = payment(7, 'Refunded', 'GW-1')
+    assert _settle(row, PaymentChange(7, 'Completed'), {'GW-1': 7}, override=True) == \
+        ('applied', 'GW-1')
+    assert row['Payment_Status'] == 'Completed'
+
+
+def test_reference_held_by_another_payment_is_rejected():
+    row = payment(7, 'Pending')
+    assert _settle(row, PaymentChange(7, 'Completed', 'GW-1'), {'GW-1': 3}) == \
+        ('rejected', "Reference GW-1 belongs to payment #3")
+    assert row['Payment_Status'] == 'Pending'
+
+
+class FakeCursor:
+    """Answers settlement's locking SELECT from a dict of payments and logs writes"""
+
+    def __init__(self, payments, log):
+        self.payments = payments
+        self.log = log
+        self.rows = []
+
+    def execute(self, query, params=()):
+        words = query.split()
+        if words[0] == 'SELECT' and 'AS Payload' in query:
+            self.rows = []      # change-event snapshots
+        elif words[0] == 'SELECT':
+            self.rows = [dict(payment(payment_id, status, reference))
+                         for payment_id, (status, reference) in sorted(self.payments.items())
+                         if payment_id in params or (reference and reference in params)]
+        else:
+            self.log.append(' '.join(words[:3]))
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeCache:
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, entity, *keys):
+        self.invalidated.append((entity,) + keys)
+
+
+class FakeDb:
+    def __init__(self, payments):
+        self.payments = payments
+        self.log = []
+        self.cache = FakeCache()
+
+    @contextmanager
+    def transaction(self, invalidate_caches=True):
+        yield FakeCursor(self.payments, self.log)
+
+
+def test_settle_outcomes_in_order():
+    db = FakeDb({1: ('Pending', None), 2: ('Pending', 'GW-2'), 3: ('Completed', 'X'),
+                 4: ('Refunded', None)})
+    changes = [
+        PaymentChange(1, 'Completed'),
+        PaymentChange(None, 'Completed', 'GW-2'),
+        PaymentChange(3, 'Failed'),
+        PaymentChange(4, 'Refunded'),
+        PaymentChange(99, 'Completed'),
+        PaymentChange(None, 'Completed', 'nope'),
+        PaymentChange(1, 'Completed'),
+    ]
+    outcomes = settle(db, changes)
+    assert [(o.payment_id, o.result, o.detail) for o in outcomes] == [
+        (1, 'applied', 'CSM0000000001'),
+        (2, 'applied', 'GW-2'),
+        (3, 'rejected', "Payment #3 is Completed and cannot become Failed"),
+        (4, 'unchanged', None),
+        (99, 'rejected', "Payment #99 not found"),
+        (None, 'rejected', "Reference nope not found"),
+        (1, 'unchanged', 'CSM0000000001'),
+    ]
+    assert [o.change for o in outcomes] == changes
+    assert db.log == ['UPDATE Payment p']
+    assert db.cache.invalidated == [('Payment', 1, 2)]
+
+
+def test_settle_batches():
+    db = FakeDb({i: ('Pending', None) for i in range(1, 6)})
+    outcomes = settle(db, [PaymentChange(i, 'Failed') for i in range(1, 6)], batch_size=2)
+    assert [o.result for o in outcomes] == ['applied'] * 5
+    assert db.log == ['UPDATE Payment p'] * 3